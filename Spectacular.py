@@ -2,25 +2,42 @@
 #created by Cassandra Clowe-Coish
 
 import inspect
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import bisect
+import codecs
+import json
+import marshal
+import os
+import re
+import socket
+import struct
+import tempfile
+import time
+import tracemalloc
+import weakref
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from enum import Enum
+from functools import lru_cache, partial
+
+LAUNCH_TIME = time.perf_counter() #for measuring the time to the first window
 
 import numpy as np
 import pandas as pd
 
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
-import matplotlib.colors as mcolors
-from matplotlib.gridspec import GridSpec
-
-from scipy.signal import find_peaks
+#matplotlib, scipy & tk_html_widgets take most of the startup time, so they are imported where they are first needed
 
 import tkinter as tk
-from tkinter.filedialog import askopenfilename, asksaveasfilename
+from tkinter.filedialog import askopenfilename, askopenfilenames, asksaveasfilename, askdirectory
 from tkinter import ttk
-from tk_html_widgets import HTMLScrolledText
 
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
@@ -51,89 +68,413 @@ class App(tk.Tk): ###The controller of all pages, & control of operations
 
         self.frames = {} #holds the app's pages
 
-        self.dfs = {}  #contains dataframes loaded from csv/made by the user
+        self.dfs = DataFrameStore()  #contains dataframes loaded from csv/made by the user. Loaded files may be evicted to stay within dfs.budget
         self.spectra = {} #contains spectrum objects
         self.plots = {} #contains Figure objects. Each figure can have exactly one axis
 
-        self.filetypes = {'csv':pd.read_csv,
-                          'fwf':pd.read_fwf} #the file types and pandas method references
-        
-        for F in (HomePage, SpectraPage, GraphPage, MakeSpectrumPage, TutorialPage):
-            frame = F(container, self)
-            self.frames[F] = frame
-
-            self.wm_title(SOFTWARE_NAME + " " + VERSION_NUMBER)
-            self.iconbitmap('icon.ico')
-            
+        self.filetypes = {'csv':DelimitedReader.read,
+                          'fwf':FixedWidthReader.read,
+                          'opus':VendorReaders.read_opus,
+                          'spc':VendorReaders.read_spc,
+                          'jdx':VendorReaders.read_jcamp} #the file types and their reader method references
+
+        self.lazy = False #when True, operations build a graph of pending work which is only evaluated when the data is read
+        self.operationCache = OperationCache() #results of eager operations, reused when the same operation is repeated on the same data
+        self.watchers = {} #DirectoryWatchers, keyed by the directory they watch
+        self.index = SpectrumIndex() #searchable metadata of the spectra
+        self.library = None #the SpectralLibrary which spectra are matched against
+        self.history = History() #undo & redo of the changes to spectra & plots
+
+        self.subscribers = [] #(topics, callback) pairs. Topics are 'files', 'spectra' & 'plots', for the dictionaries above
+        self.changed = set() #the topics changed since the subscribers were last called
+        self.publishPending = False
+        self.bulkDepth = 0
+
+        self.container = container
+        self.startupTime = None #seconds from launch until the first window was drawn
+        self.wm_title(SOFTWARE_NAME + " " + VERSION_NUMBER)
+        self.iconbitmap('icon.ico')
+
+        self.show_frame(HomePage) #the other pages are built when they are first shown
+        self.after_idle(self.recordStartup)
+        self.bind_all('<Control-z>', lambda event:self.undo())
+        self.bind_all('<Control-y>', lambda event:self.redo())
+
+    def recordStartup(self):
+        self.update_idletasks()
+        self.startupTime = time.perf_counter() - LAUNCH_TIME
+
+    def page(self, cont):
+        #@return the page, building it the first time it is needed
+        if cont not in self.frames:
+            frame = cont(self.container, self)
             frame.grid(row=0, column=0, sticky="nsew")
-
-        self.show_frame(HomePage)
+            self.frames[cont] = frame
+        return self.frames[cont]
 
     def show_frame(self, cont):
-        self.frames[cont].tkraise()
-
-    def updatePages(self):
-        for Page in {MakeSpectrumPage, SpectraPage}:
-            self.frames[Page].insertItems()
+        self.page(cont).tkraise()
+
+    def subscribe(self, callback, *topics):
+        #@param callback is called with the set of the topics which changed, once per event loop tick at most
+        self.subscribers.append((set(topics), callback))
+
+    def notify(self, topic):
+        #record a change to the files, spectra or plots. Subscribers are called when the app is next idle, so many
+        #changes in a row cause a single refresh of each page
+        self.changed.add(topic)
+        if not self.publishPending and not self.bulkDepth:
+            self.publishPending = True
+            self.after_idle(self.publishChanges)
+
+    def publishChanges(self):
+        self.publishPending = False
+        if not self.bulkDepth:
+            changed, self.changed = self.changed, set()
+            for topics, callback in self.subscribers:
+                if topics & changed:
+                    callback(topics & changed)
+
+    @contextmanager
+    def bulk(self):
+        #make many changes with the subscribers only called once all of them are done, & undone or redone together
+        self.bulkDepth += 1
+        try:
+            with self.history.action():
+                yield
+        finally:
+            self.bulkDepth -= 1
+            for topic in list(self.changed):
+                self.notify(topic)
 
     def load(self, filename, filetype, delimiter=None): #load csv file
+        #if the file is evicted from memory later, it is read again from disk when next used
+        self.dfs.add(filename, self.read(filename, filetype, delimiter), reload=lambda:self.read(filename, filetype, delimiter))
+        self.notify('files')
+
+    def read(self, filename, filetype, delimiter=None):
         try:
-            df = self.filetypes[filetype](filename, thousands=" ", delimiter=delimiter, header=None)
-            if any(df.iloc[0].apply(lambda x: isinstance(x, str))): #if the csv file has column names already
-                df = df[1:].reset_index(drop=True).rename(columns=df.iloc[0]).apply(pd.to_numeric, axis=1)
-            else: #give the DataFrame default column names
-                names=[]
-                for i in range(len(df.columns)):
-                    names.append("w%i" %i)
-                df.columns = names
-            self.dfs[filename] = df
-            self.updatePages()
+            reader = self.filetypes[filetype]
+            return reader(filename) if delimiter is None else reader(filename, delimiter=delimiter)
  
-        except pd.errors.ParserError:
+        except (pd.errors.ParserError, struct.error, ValueError): #ValueError: e.g. a truncated file's columns are of different lengths
             raise UnsupportedFileTypeException(filename)
         except FileNotFoundError as not_found:
             raise NoPathNameException(not_found)
 
+    def watch_directory(self, directory, **kwargs):
+        #start loading new files from the directory as they appear. @param kwargs are passed to the DirectoryWatcher
+        self.stop_watching(directory)
+        self.watchers[directory] = DirectoryWatcher(self, directory, **kwargs)
+        self.watchers[directory].start()
+        return self.watchers[directory]
+
+    def stop_watching(self, directory):
+        if directory in self.watchers:
+            self.watchers.pop(directory).stop()
+
     def save(self, key, savefilename):
         self.spectra[key].df.to_csv(savefilename)
 
-    def rename_plot(self, oldKey, newKey):
-        self.plots[newKey] = self.plots.pop(oldKey)
+    def export_spectra(self, keys, savefilename, layout='wide', fmt='csv'):
+        return SpectrumExporter.export([self.spectra[key] for key in keys], savefilename, layout, fmt)
+
+    def export_each(self, keys, directory, fmt='csv', workers=4):
+        return SpectrumExporter.export_each([self.spectra[key] for key in keys], directory, fmt, workers)
 
-    def make_spectrum(self, name, df, x, y): #create a Spectrum object and add it to dictionary
-        spectrum = Spectrum(name, df, x, y)
-        self.spectra[name] = spectrum
-        self.updatePages()
+    def rename_plot(self, oldKey, newKey):
+        fig = self.plots[oldKey]
+        oldTitle = fig.get_suptitle()
+        previous = None if newKey == oldKey else self.plots.get(newKey) #a plot already under the new name is replaced, & put back by undo
+        def rename(fromKey, toKey, title):
+            self.plots[toKey] = self.plots.pop(fromKey)
+            fig.suptitle(title)
+        def undo():
+            rename(newKey, oldKey, oldTitle)
+            if newKey != oldKey:
+                self.setPlot(newKey, previous)
+        rename(oldKey, newKey, newKey)
+        self.history.command(undo=undo, redo=lambda:rename(oldKey, newKey, newKey),
+                             buffers=lambda:[] if previous is None else MemoryAccounting.plot_buffers(previous))
+        self.notify('plots')
+
+    def make_spectrum(self, name, df, x, y, source=None): #create a Spectrum object and add it to dictionary
+        #@param source the name of the file the data came from, for searching
+        return self.add_spectrum(Spectrum(name, df, x, y), source=source)
+
+    def add_spectrum(self, spectrum, source=None, op=None): #add an existing Spectrum object to the dictionary
+        #@param op a description of the operation which made the spectrum, for searching
+        self.history.spectrum(self, spectrum.name, spectrum)
+        self.spectra[spectrum.name] = spectrum
+        self.index.add(spectrum, source, op)
+        self.notify('spectra')
         return spectrum
 
-    def make_plot(self, name, numOfSubplots=1):
+    def map_spectrum(self, spectralMap, row, column):
+        #read the spectrum at one pixel of a map, & add it to the spectra
+        return self.add_spectrum(spectralMap.spectrum(row, column), source=spectralMap.filename, op="pixel(%i, %i)" %(row, column))
+
+    def set_precision(self, precision):
+        #store the y data of spectra as 'float64' or 'float32', converting the spectra made so far. Spectra which shared
+        #data still do. Pending lazy spectra are computed at the new precision when they are evaluated
+        dtype = np.dtype(precision)
+        if dtype == Spectrum.dtype:
+            return
+        Spectrum.dtype = dtype
+        converted = {}
+        for name, spectrum in self.spectra.items():
+            if not isinstance(spectrum, LazySpectrum):
+                spectrum = spectrum.derive(y=spectrum.y.astype(dtype, converted))
+                self.spectra[name] = self.index.entries[name]['spectrum'] = spectrum
+        self.operationCache.clear() #results are keyed by content, not precision
+        self.notify('spectra')
+
+    def duplicate_spectrum(self, sourceName, name):
+        #the duplicate shares the source's read-only data until either of them is edited, so duplicating costs no memory
+        return self.add_spectrum(self.spectra[sourceName].derive(name), source=self.index.source(sourceName), op="duplicate(%s)" %sourceName)
+
+    def tag_spectrum(self, name, tags):
+        #replace the tags of a spectrum. @param tags an iterable of str
+        self.history.spectrum(self, name, self.spectra[name])
+        self.index.setTags(name, tags)
+        self.notify('spectra')
+
+    def build_library(self, keys, filename, normalisation='vector'):
+        #make a reference library from spectra, save it and use it for matching
+        self.library = SpectralLibrary.build([self.spectra[key] for key in keys], normalisation=normalisation)
+        self.library.save(filename)
+        return self.library
+
+    def open_library(self, filename):
+        try:
+            self.library = SpectralLibrary.open(filename)
+            return self.library
+        except (KeyError, ValueError, zipfile.BadZipFile):
+            raise UnsupportedFileTypeException(filename)
+        except FileNotFoundError as not_found:
+            raise NoPathNameException(not_found)
+
+    def match_spectrum(self, key, metric='correlation', k=10, candidates=None):
+        #rank the library's references by their similarity to a spectrum. The table of matches is added to the files
+        matches = self.library.search(self.spectra[key], metric, k, candidates)
+        self.dfs["Library matches for " + key] = matches
+        self.notify('files')
+        return matches
+
+    def band_table(self, name, keys, bands, ratios, method='trapezoid', baseline=True):
+        #integrate bands of many spectra & add the table of areas & ratios to the files. See BandIntegration
+        table = BandIntegration.band_ratios([self.spectra[key] for key in keys], bands, ratios, method, baseline)
+        self.dfs[name] = table
+        self.notify('files')
+        return table
+
+    def pca(self, name, keys, components=2):
+        #principal component analysis of spectra. The loadings are added as spectra, the scores as a file & as a scatter plot
+        #of the first two components. See Chemometrics
+        spectra = [self.spectra[key] for key in keys]
+        scores, loadings, explained = Chemometrics.pca(spectra, components)
+        labels = ["PC%i" %(i + 1) for i in range(len(explained))]
+        table = pd.DataFrame(scores, columns=labels, index=pd.Index(keys, name='spectrum'))
+        with self.bulk():
+            for label, loading, fraction in zip(labels, loadings, explained):
+                self.add_spectrum(Spectrum.from_arrays("%s %s loading" %(name, label), spectra[0].x.array, loading, spectra[0].index,
+                                                       spectra[0].xname, "%s (%.1f%%)" %(label, 100*fraction)), op="pca(%s)" %name)
+            self.dfs[name + " scores"] = table
+            self.notify('files')
+            if len(labels) > 1:
+                self.scores_plot(name + " scores", table, labels[0], labels[1],
+                                 "PC1 (%.1f%%)" %(100*explained[0]), "PC2 (%.1f%%)" %(100*explained[1]))
+        return table
+
+    def pls(self, name, keys, response, components=2):
+        #PLS regression of a response on spectra. The regression coefficients & weights are added as spectra, the scores &
+        #fitted response as a file, and the fitted against the given response as a scatter plot. See Chemometrics
+        spectra = [self.spectra[key] for key in keys]
+        coefficients, intercept, scores, weights, fitted = Chemometrics.pls(spectra, response, components)
+        labels = ["LV%i" %(i + 1) for i in range(len(weights))]
+        table = pd.DataFrame(scores, columns=labels, index=pd.Index(keys, name='spectrum'))
+        table['response'] = np.asarray(response, dtype=float)
+        table['fitted'] = fitted
+        x, index, xname = spectra[0].x.array, spectra[0].index, spectra[0].xname
+        with self.bulk():
+            self.add_spectrum(Spectrum.from_arrays(name + " coefficients", x, coefficients, index, xname, "coefficient (intercept %g)" %intercept), op="pls(%s)" %name)
+            for label, weight in zip(labels, weights):
+                self.add_spectrum(Spectrum.from_arrays("%s %s weights" %(name, label), x, weight, index, xname, label), op="pls(%s)" %name)
+            self.dfs[name + " scores"] = table
+            self.notify('files')
+            self.scores_plot(name + " fit", table, 'response', 'fitted')
+        return table
+
+    def scores_plot(self, name, table, xcolumn, ycolumn, xlabel=None, ylabel=None):
+        #scatter two columns of a table against each other as a new plot, with one marker per row
+        if name in self.plots:
+            self.delete_plot(name)
+        self.make_plot(name)
+        ax = self.plots[name].axes[0]
+        ax.plot(table[xcolumn].to_numpy(), table[ycolumn].to_numpy(), linestyle='none', marker='o', markersize=4, label=name)
+        ax.set(xlabel=xcolumn if xlabel is None else xlabel, ylabel=ycolumn if ylabel is None else ylabel)
+        return self.plots[name]
+
+    def search_spectra(self, text, limit=None):
+        #@return the names of the spectra matching a search. See SpectrumIndex.search
+        return self.index.search(text, limit)
+
+    def save_project(self, filename):
+        ProjectFile.save(self, filename)
+
+    def open_project(self, filename):
+        #restore a saved session into this one. Objects with the same names as saved ones are overwritten
+        try:
+            names = ProjectFile.open(self, filename)
+            self.history.clear() #the project replaced spectra without recording them, so older steps no longer apply
+            for topic in ('files', 'spectra', 'plots'):
+                self.notify(topic)
+            return names
+        except (zipfile.BadZipFile, KeyError):
+            raise UnsupportedFileTypeException(filename)
+        except FileNotFoundError as not_found:
+            raise NoPathNameException(not_found)
+
+    def memory_usage(self):
+        #@return {'files':{name:bytes}, 'spectra':{name:bytes}, 'plots':{name:bytes}}. Data shared by several spectra or
+        #plots is only counted for the first one, so the totals are the memory actually held. Evicted files hold none
+        seen = set()
+        return {'files':self.dfs.memory_usage(),
+                'spectra':{name:MemoryAccounting.count(spectrum.buffers(), seen) for name, spectrum in self.spectra.items()},
+                'plots':{name:MemoryAccounting.count(MemoryAccounting.plot_buffers(fig), seen) for name, fig in self.plots.items()}}
+
+    @staticmethod
+    def new_figure(name, numOfSubplots=1):
+        from matplotlib.figure import Figure
         fig = Figure(figsize=(8.5, 5.5), dpi=100, tight_layout=True)
         fig.suptitle(name)
-        axes = fig.subplots(numOfSubplots, 1)
+        fig.subplots(numOfSubplots, 1)
         fig.set_tight_layout({"rect":(0, 0.03, 1, 0.95)})
+        return fig
 
+    def make_plot(self, name, numOfSubplots=1):
+        fig = self.new_figure(name, numOfSubplots)
+        previous = self.plots.get(name)
         self.plots[name] = fig
+        self.history.command(undo=lambda:self.setPlot(name, previous), redo=lambda:self.setPlot(name, fig),
+                             buffers=lambda:MemoryAccounting.plot_buffers(fig) + ([] if previous is None else MemoryAccounting.plot_buffers(previous)))
+        self.notify('plots')
+
+    def setPlot(self, name, fig):
+        #put a figure under a name, or remove the name if fig is None, without recording it in the history
+        if fig is None:
+            self.plots.pop(name, None)
+        else:
+            self.plots[name] = fig
 
     def delete_spectrum(self, name):
+        self.history.spectrum(self, name, None)
         del self.spectra[name]
-        self.updatePages()
+        self.index.remove(name)
+        self.notify('spectra')
 
     def delete_plot(self, name):
-        plt.close(self.plots.pop(name))
+        fig = self.plots.pop(name) #the figures are not made by pyplot, so there is nothing to close
+        self.history.command(undo=lambda:self.setPlot(name, fig), redo=lambda:self.setPlot(name, None), buffers=lambda:MemoryAccounting.plot_buffers(fig))
+        self.notify('plots')
 
     def graph(self, axis, spectrum, **kwargs):
-        axis.plot(spectrum.xdata, spectrum.ydata, label=spectrum.name, **kwargs)
+        line, = axis.plot(spectrum.xdata, spectrum.ydata, label=spectrum.name, **kwargs)
+        self.history.command(undo=line.remove, redo=lambda:axis.add_line(line), buffers=lambda:MemoryAccounting.line_buffers(line))
+        return line
+
+    def delete_trace(self, line):
+        axis = line.axes
+        line.remove()
+        self.history.command(undo=lambda:axis.add_line(line), redo=line.remove, buffers=lambda:MemoryAccounting.line_buffers(line))
+
+    def set_properties(self, artist, **properties):
+        #change the properties of a trace or an axis, e.g. color or xlim, so that the change can be undone
+        old = {key:getattr(artist, 'get_' + key)() for key in properties}
+        artist.set(**properties)
+        self.history.command(undo=lambda:artist.set(**old), redo=lambda:artist.set(**properties))
+
+    def undo(self):
+        #@return False if there was nothing to undo
+        if self.history.undo(self):
+            for topic in ('spectra', 'plots'):
+                self.notify(topic)
+            return True
+        return False
+
+    def redo(self):
+        #@return False if there was nothing to redo
+        if self.history.redo(self):
+            for topic in ('spectra', 'plots'):
+                self.notify(topic)
+            return True
+        return False
 
     def operation(self, Class, operationName, name, *args, **kwargs):
         #perform an operation on spectral operands and format them & send to a Spectrum object
         #operate on operands only if their x axes are identical
         if all(isinstance(arg, Spectrum) for arg in args):
             if all(arg.xdata.equals(args[0].xdata) for arg in args):
-                df = getattr(Class, operationName)(*args, **kwargs)
-                return self.make_spectrum(name, df, df.columns[0], df.columns[1])
+                source, op = self.index.source(args[0].name), "%s(%s)" %(operationName, ", ".join(arg.name for arg in args))
+                if self.lazy:
+                    return self.add_spectrum(LazySpectrum(name, OperationNode(Class, operationName, args, kwargs)), source, op)
+                key = self.operationCache.key(Class, operationName, args, kwargs)
+                result = self.operationCache.get(key)
+                if result is None:
+                    result = getattr(Class, operationName)(*args, **kwargs)
+                    if not isinstance(result, Spectrum): #copy-on-write results already share their data with the operands
+                        result = Spectrum.from_frame(name, result)
+                    self.operationCache.put(key, result)
+                return self.add_spectrum(result.derive(name), source, op) #cached results are read-only, so they can be shared
+            else: raise BadAxisSymmetryException
+        else: raise ValueError
+
+    def batch_operation(self, Class, operationName, names, *args, **kwargs):
+        #perform an operation which returns one DataFrame per spectral operand, & send each to a Spectrum object
+        if all(isinstance(arg, Spectrum) for arg in args):
+            if all(arg.xdata.equals(args[0].xdata) for arg in args):
+                dfs = getattr(Class, operationName)(*args, **kwargs)
+                with self.bulk():
+                    return [self.add_spectrum(Spectrum.from_frame(name, df), self.index.source(arg.name), "%s(%s)" %(operationName, arg.name))
+                            for name, df, arg in zip(names, dfs, args)]
             else: raise BadAxisSymmetryException
         else: raise ValueError
 
+#=====================================================================================================================================================================================
+class HeadlessApp:
+    #the App's data & operation methods without its windows, for the service mode & the benchmarks, which run without a display
+    load = App.load
+    read = App.read
+    make_spectrum = App.make_spectrum
+    add_spectrum = App.add_spectrum
+    delete_spectrum = App.delete_spectrum
+    operation = App.operation
+    batch_operation = App.batch_operation
+    bulk = App.bulk
+    graph = App.graph
+    memory_usage = App.memory_usage
+    set_precision = App.set_precision
+    map_spectrum = App.map_spectrum
+
+    def __init__(self):
+        self.dfs = DataFrameStore()
+        self.spectra = {}
+        self.plots = {}
+        self.filetypes = {'csv':DelimitedReader.read,
+                          'fwf':FixedWidthReader.read,
+                          'opus':VendorReaders.read_opus,
+                          'spc':VendorReaders.read_spc,
+                          'jdx':VendorReaders.read_jcamp}
+        self.lazy = False
+        self.operationCache = OperationCache()
+        self.index = SpectrumIndex()
+        self.history = History(depth=0) #a service or a benchmark has no one to undo anything
+        self.changed = set()
+        self.bulkDepth = 0
+
+    def notify(self, topic): #there are no pages to refresh
+        pass
+
 #=====================================================================================================================================================================================
 class SpectrumOperations:
 #operations whose operands are spectra only
@@ -163,11 +504,38 @@ class SpectrumOperations:
 
 #==========================================================================================================================================================================================
 class ParameterisedOperations:
+    #the range-editing operations (zero, clip, mask & crop) never write to their operand. Their results are copy-on-write
+    #Spectrum objects which share all unedited data with the operand, and only allocate memory for the edited range
+    @classmethod
+    def wavenumber_range(cls, spectrum, low, high):
+        #@return the (start, stop) positions of the points with low <= x <= high
+        x = spectrum.x.array
+        if x.size < 2 or x[0] <= x[-1]:
+            start, stop = np.searchsorted(x, low, 'left'), np.searchsorted(x, high, 'right')
+        else: #descending wavenumbers, as FTIR spectra are usually stored
+            reverse = x[::-1]
+            start, stop = x.size - np.searchsorted(reverse, high, 'right'), x.size - np.searchsorted(reverse, low, 'left')
+        return int(start), int(max(start, stop))
+
+    @classmethod
+    def zero(cls, spectrum, low=0, high=0): #zero the spectrum between two wavenumbers
+        start, stop = cls.wavenumber_range(spectrum, low, high)
+        return spectrum.derive(y=spectrum.y.patch(start, stop, 0))
+
     @classmethod
-    def zero(cls, spectrum, leftidx=0, rightidx=0): #zero the spectrum between two indices
-        y = spectrum.ydata
-        y.loc[leftidx:rightidx] = 0
-        return pd.concat([spectrum.xdata, y], axis=1)
+    def clip(cls, spectrum, low=0, high=0, ymin=None, ymax=None): #clip the y values between two wavenumbers to [ymin, ymax]
+        start, stop = cls.wavenumber_range(spectrum, low, high)
+        return spectrum.derive(y=spectrum.y.patch(start, stop, np.clip(spectrum.y.array[start:stop], ymin, ymax)))
+
+    @classmethod
+    def mask(cls, spectrum, low=0, high=0): #blank out the spectrum between two wavenumbers
+        start, stop = cls.wavenumber_range(spectrum, low, high)
+        return spectrum.derive(y=spectrum.y.patch(start, stop, np.nan))
+
+    @classmethod
+    def crop(cls, spectrum, low=0, high=0): #keep only the part of the spectrum between two wavenumbers
+        start, stop = cls.wavenumber_range(spectrum, low, high)
+        return spectrum.derive(x=spectrum.x.slice(start, stop), y=spectrum.y.slice(start, stop), index=spectrum.index[start:stop])
     
     @classmethod
     def grinding_curve(cls, *args, mineral=Minerals.CALCITE):
@@ -183,6 +551,933 @@ class ParameterisedOperations:
                 points.append((maxima[0]/largest, maxima[1]/largest))
             return pd.DataFrame(points, columns=["v2/v3", "v4/v3"])
     
+#==========================================================================================================================================================================================
+class SmoothingOperations:
+#Savitzky-Golay smoothing & derivatives. The filter coefficients are computed once per (window, order, derivative),
+#so applying the same filter to many spectra only costs the convolution
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def coefficients(window, order, deriv=0):
+        from scipy.signal import savgol_coeffs
+        coeffs = savgol_coeffs(window, order, deriv=deriv)
+        coeffs.setflags(write=False) #the cached array is shared by every caller
+        return coeffs
+
+    @classmethod
+    def savgol(cls, spectrum, window=11, order=3, deriv=0):
+        return cls.savgol_stack(spectrum, window=window, order=order, deriv=deriv)[0]
+
+    @classmethod
+    def smooth(cls, spectrum, window=11, order=3):
+        return cls.savgol(spectrum, window, order)
+
+    @classmethod
+    def first_derivative(cls, spectrum, window=11, order=3):
+        return cls.savgol(spectrum, window, order, deriv=1)
+
+    @classmethod
+    def second_derivative(cls, spectrum, window=11, order=3):
+        return cls.savgol(spectrum, window, order, deriv=2)
+
+    @classmethod
+    def savgol_stack(cls, *spectra, window=11, order=3, deriv=0):
+        #filter every spectrum in one vectorised pass. The spectra must share an x axis
+        #@return a list of DataFrames, one per spectrum, in the order given
+        x = spectra[0].xdata.to_numpy(dtype=float)
+        stack = np.vstack([spectrum.ydata.to_numpy(dtype=float) for spectrum in spectra])
+        coeffs = cls.coefficients(window, order, deriv)
+        if deriv:
+            delta = (x[-1] - x[0])/(x.size - 1) #mean point spacing, so derivatives are per unit of x
+            coeffs = coeffs/delta**deriv
+        from scipy.ndimage import convolve1d
+        filtered = convolve1d(stack, coeffs, axis=1, mode='mirror')
+        return [pd.concat([spectrum.xdata, pd.Series(row, index=spectrum.ydata.index, name=spectrum.ydata.name)], axis=1)
+                for spectrum, row in zip(spectra, filtered)]
+
+#==========================================================================================================================================================================================
+class BandIntegration:
+#Integrated band areas of many spectra at once. Integrating a band, with or without subtracting a straight baseline
+#between its limits, is a weighted sum of the y values, so each band is turned into a column of weights on the shared
+#x axis, and the areas of every band of every spectrum are a single matrix product of the stacked spectra & the weights
+    METHODS = ('trapezoid', 'simpson')
+    PRESETS = {'CALCITE':([('v4', 700, 730), ('v2', 840, 910), ('v3', 1300, 1550)], [('v2', 'v3'), ('v4', 'v3')]),
+               'ARAGONITE':([('v4', 695, 720), ('v2', 840, 870), ('v3', 1350, 1550)], [('v2', 'v3'), ('v4', 'v3')])}
+    #(bands, ratios) for carbonate work. Bands are (name, low, high) in wavenumbers, ratios are (numerator, denominator)
+
+    @classmethod
+    def weights(cls, spectrum, bands, method='trapezoid', baseline=True):
+        #@return a (points, bands) array W, such that y @ W are the areas of the bands of any spectrum on this x axis
+        x = spectrum.x.array
+        W = np.zeros((x.size, len(bands)))
+        for column, (name, low, high) in enumerate(bands):
+            start, stop = ParameterisedOperations.wavenumber_range(spectrum, low, high)
+            if stop - start < 2:
+                W[:, column] = np.nan #too few points to integrate
+                continue
+            xs = x[start:stop]
+            if method == 'simpson': #the integral of each unit vector is the weight of that point
+                from scipy.integrate import simpson
+                w = simpson(np.eye(xs.size), x=xs, axis=1)
+            else:
+                w = np.empty(xs.size)
+                w[0], w[-1] = (xs[1] - xs[0])/2, (xs[-1] - xs[-2])/2
+                w[1:-1] = (xs[2:] - xs[:-2])/2
+            if baseline: #less the trapezoid under the straight line joining the band's end points
+                w[0] -= (xs[-1] - xs[0])/2
+                w[-1] -= (xs[-1] - xs[0])/2
+            W[start:stop, column] = w*np.sign(xs[-1] - xs[0]) #areas are positive whichever way x runs
+        return W
+
+    @classmethod
+    def areas(cls, spectra, bands, method='trapezoid', baseline=True):
+        #@return a DataFrame of band areas, with a row per spectrum & a column per band. The spectra must share an x axis
+        x = spectra[0].x.array
+        if not all(np.array_equal(spectrum.x.array, x, equal_nan=True) for spectrum in spectra):
+            raise BadAxisSymmetryException
+        W = cls.weights(spectra[0], bands, method, baseline)
+        rows = np.flatnonzero(np.nan_to_num(W, nan=1).any(axis=1)) #only the points inside the bands are stacked
+        Y = np.vstack([spectrum.y.array[rows] for spectrum in spectra]) #the product with the float64 weights is in float64
+        return pd.DataFrame(Y @ W[rows], columns=[name for name, low, high in bands],
+                            index=pd.Index([spectrum.name for spectrum in spectra], name='spectrum'))
+
+    @classmethod
+    def band_ratios(cls, spectra, bands, ratios, method='trapezoid', baseline=True):
+        #@return the band areas, followed by a column for each (numerator, denominator) ratio of bands
+        table = cls.areas(spectra, bands, method, baseline)
+        for numerator, denominator in ratios:
+            table[numerator + "/" + denominator] = table[numerator]/table[denominator]
+        return table
+
+#==========================================================================================================================================================================================
+class Chemometrics:
+    #Principal component analysis & partial least squares (PLS1) regression of many spectra on a shared x axis. The spectra
+    #are stacked into one mean-centred (spectra, points) matrix. PCA takes only the leading singular vectors, by randomized
+    #projection onto a few random directions (Halko, Martinsson & Tropp, 2011), which costs a handful of passes over the
+    #matrix instead of a full SVD. PLS uses NIPALS, deflating the scores rather than the matrix, so the matrix is never
+    #copied. Points which are NaN in any spectrum are left out of the models, and are NaN in the loadings
+    OVERSAMPLE = 10 #random directions beyond the number of components, which make the leading ones accurate
+    POWER_ITERATIONS = 4 #passes which sharpen the separation of the components when the singular values decay slowly
+
+    @classmethod
+    def stack(cls, spectra):
+        #@return (the mean-centred matrix of the usable points, the mask of the usable points, their means)
+        x = spectra[0].x.array
+        if not all(np.array_equal(spectrum.x.array, x, equal_nan=True) for spectrum in spectra):
+            raise BadAxisSymmetryException
+        X = np.vstack([spectrum.y.array for spectrum in spectra]) #at the spectra's precision, as are the products with it
+        usable = np.isfinite(X).all(axis=0) & np.isfinite(x)
+        if not usable.all():
+            X = X[:, usable]
+        mean = X.mean(axis=0, dtype=float)
+        X -= mean.astype(X.dtype)
+        return X, usable, mean
+
+    @classmethod
+    def randomized_svd(cls, X, components, seed=0):
+        #@return (U, s, Vt) of the leading singular values & vectors of X
+        rng = np.random.default_rng(seed)
+        Q = np.linalg.qr(X @ rng.standard_normal((X.shape[1], min(components + cls.OVERSAMPLE, *X.shape)), dtype=X.dtype))[0]
+        for i in range(cls.POWER_ITERATIONS): #re-orthonormalised every pass, so small components are not lost to rounding
+            Q = np.linalg.qr(X @ np.linalg.qr(X.T @ Q)[0])[0]
+        U, s, Vt = np.linalg.svd(Q.T @ X, full_matrices=False)
+        U, s, Vt = (Q @ U)[:, :components].astype(float), s[:components].astype(float), Vt[:components].astype(float)
+        signs = np.sign(Vt[np.arange(len(Vt)), np.abs(Vt).argmax(axis=1)]) #the largest loading is positive, for repeatable signs
+        return U*signs, s, Vt*signs[:, None]
+
+    @classmethod
+    def unstack(cls, rows, usable):
+        #@return the rows spread over all the points, with NaN at the points left out of the model
+        full = np.full((len(rows), usable.size), np.nan)
+        full[:, usable] = rows
+        return full
+
+    @classmethod
+    def pca(cls, spectra, components=2):
+        #@return (scores (spectra, components), loadings (components, points), the fraction of the variance of each component)
+        X, usable, mean = cls.stack(spectra)
+        U, s, Vt = cls.randomized_svd(X, components)
+        total = np.einsum('ij,ij->', X, X, dtype=float) #the total variance, which is 0 for a single spectrum or identical ones
+        return U*s, cls.unstack(Vt, usable), np.divide(s**2, total, out=np.zeros_like(s), where=total > 0)
+
+    @classmethod
+    def pls(cls, spectra, response, components=2):
+        #@param response a value for each spectrum, which is modelled from the spectra
+        #@return (regression coefficients over the points, intercept, scores (spectra, components), weights (components, points),
+        #the fitted response)
+        X, usable, mean = cls.stack(spectra)
+        y = np.asarray(response, dtype=float)
+        if y.shape != (len(spectra),) or not np.isfinite(y).all():
+            raise ValueError("There must be one finite response value for each spectrum.")
+        f = y - y.mean()
+        dot = lambda A, v:(A @ v.astype(X.dtype)).astype(float) #products with X at its precision, as a float64 v would copy it to float64
+        components = min(components, *X.shape)
+        T, W, P, q = np.empty((len(y), components)), np.empty((components, X.shape[1])), np.empty((components, X.shape[1])), np.empty(components)
+        for a in range(components):
+            w = dot(X.T, f) #the residual response is orthogonal to the earlier scores, so the undeflated matrix gives the same weights
+            norm = np.linalg.norm(w)
+            if norm == 0: #the response is fully explained
+                T, W, P, q = T[:, :a], W[:a], P[:a], q[:a]
+                break
+            W[a] = w/norm
+            t = dot(X, W[a]) - T[:, :a] @ (P[:a] @ W[a]) #the scores of the deflated matrix
+            T[:, a] = t
+            P[a] = dot(X.T, t)/(t @ t)
+            q[a] = f @ t/(t @ t)
+            f -= q[a]*t
+        coefficients = W.T @ np.linalg.solve(P @ W.T, q)
+        return cls.unstack([coefficients], usable)[0], y.mean() - mean @ coefficients, T, cls.unstack(W, usable), y - f
+
+#==========================================================================================================================================================================================
+class SpectralMap:
+    #A hyperspectral map from a microscope: a spectrum at every (row, column) position, held as a (rows, columns, points)
+    #.npy cube. The cube is memory mapped, so only the parts which are used are read from disk. The x axis is read from a
+    #.x.npy file beside the cube, or is evenly spaced between two given wavenumbers. An image of a band is computed in one
+    #vectorised pass over the cube, a block of pixels at a time, reading only the points inside the band
+    MODES = ('area', 'height')
+    BLOCK_BYTES = 32*2**20 #the most of the cube read at once, which bounds the memory a band image takes besides the image itself
+
+    def __init__(self, filename, first=None, last=None):
+        #@param first, last the wavenumbers of the first & last points, if there is no .x.npy file
+        self.filename = filename
+        self.name = os.path.splitext(os.path.basename(filename))[0]
+        self.cube = np.load(filename, mmap_mode='r')
+        if self.cube.ndim != 3:
+            raise ValueError("A map must be a (rows, columns, points) array.")
+        if os.path.exists(self.axisFilename(filename)):
+            x = np.load(self.axisFilename(filename))
+        elif first is not None and last is not None:
+            x = np.linspace(first, last, self.cube.shape[2])
+        else:
+            raise ValueError("There is no %s file, so the first & last wavenumbers must be given." %os.path.basename(self.axisFilename(filename)))
+        if x.shape != self.cube.shape[2:]:
+            raise BadAxisSymmetryException
+        self.axis = Spectrum.from_arrays(self.name, x, np.zeros(x.size)) #for finding bands on the x axis
+
+    @staticmethod
+    def axisFilename(filename):
+        return os.path.splitext(filename)[0] + ".x.npy"
+
+    @classmethod
+    def save(cls, filename, x, cube):
+        #write a (rows, columns, points) cube & its x axis, as a map which can be opened
+        np.save(filename, np.asarray(cube))
+        np.save(cls.axisFilename(filename), np.asarray(x, dtype=float))
+
+    @property
+    def shape(self): #(rows, columns)
+        return self.cube.shape[:2]
+
+    def band_image(self, low, high, mode='area', method='trapezoid', baseline=True):
+        #@return a (rows, columns) image of the area or height of a band at each pixel, above a straight baseline joining
+        #the ends of the band if baseline. Pixels are NaN where the band has too few points
+        rows, columns = self.shape
+        start, stop = ParameterisedOperations.wavenumber_range(self.axis, low, high)
+        image = np.full(rows*columns, np.nan)
+        if stop - start < 2:
+            return image.reshape(rows, columns)
+        if mode == 'area': #integrating is a weighted sum of the points, as in BandIntegration
+            weights = BandIntegration.weights(self.axis, [(self.name, low, high)], method, baseline)[start:stop, 0]
+        else:
+            xs = self.axis.x.array[start:stop]
+            fraction = (xs - xs[0])/(xs[-1] - xs[0]) #the position of each point between the ends of the band
+        blockRows = max(1, self.BLOCK_BYTES//max(1, columns*(stop - start)*self.cube.itemsize))
+        for row in range(0, rows, blockRows):
+            block = np.asarray(self.cube[row:row + blockRows, :, start:stop]).reshape(-1, stop - start)
+            if mode == 'area':
+                values = block @ weights #accumulated in float64, whatever the cube is stored as
+            else:
+                if baseline:
+                    block = block - (block[:, :1] + (block[:, -1:] - block[:, :1])*fraction)
+                values = block.max(axis=1)
+            image[row*columns:row*columns + len(values)] = values
+        return image.reshape(rows, columns)
+
+    def spectrum(self, row, column):
+        #@return the spectrum at a pixel, read on its own
+        return Spectrum.from_arrays("%s (%i, %i)" %(self.name, row, column), self.axis.x.array, np.array(self.cube[row, column]))
+
+#==========================================================================================================================================================================================
+class ImagePyramid:
+    #Levels of detail of a map image, for drawing. Level 0 is the image, & each level above it halves both dimensions,
+    #taking the mean of each 2x2 block of pixels (leaving out NaNs). A view is drawn from the coarsest level which still
+    #has a pixel for every pixel of the screen, cropped to the tiles of that level which the view covers. Zoomed out
+    #views of large maps then draw few pixels, & zoomed in views only draw what is in view
+    TILE = 256 #pixels along each side of a tile, & the largest side of the top level
+
+    def __init__(self, image):
+        self.levels = [image]
+        while max(self.levels[-1].shape) > self.TILE:
+            self.levels.append(self.downsample(self.levels[-1]))
+
+    @staticmethod
+    def downsample(image):
+        rows, columns = image.shape
+        padded = np.full((rows + rows%2, columns + columns%2), np.nan)
+        padded[:rows, :columns] = image
+        blocks = padded.reshape(padded.shape[0]//2, 2, padded.shape[1]//2, 2)
+        finite = np.isfinite(blocks)
+        sums, counts = np.where(finite, blocks, 0).sum(axis=(1, 3)), finite.sum(axis=(1, 3))
+        return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+    def view(self, xlim, ylim, width, height):
+        #@param xlim, ylim the region in view, in pixels of level 0. @param width, height the size of the view on screen, in pixels
+        #@return (the part of a level to draw, its extent (left, right, bottom, top) in pixels of level 0, the level)
+        pixelsPerScreenPixel = max(abs(xlim[1] - xlim[0])/max(width, 1), abs(ylim[1] - ylim[0])/max(height, 1))
+        level = 0
+        while level + 1 < len(self.levels) and pixelsPerScreenPixel >= 2**(level + 1):
+            level += 1
+        image, scale = self.levels[level], 2**level
+        (rowStart, rowStop), (columnStart, columnStop) = [self.tiles(limits, scale, size) for limits, size in zip((ylim, xlim), image.shape)]
+        return (image[rowStart:rowStop, columnStart:columnStop],
+                (columnStart*scale - 0.5, columnStop*scale - 0.5, rowStop*scale - 0.5, rowStart*scale - 0.5), level)
+
+    @classmethod
+    def tiles(cls, limits, scale, size):
+        #@return the (start, stop) pixels of a level, at whole tiles, which cover the limits
+        low, high = (min(limits) + 0.5)/scale, (max(limits) + 0.5)/scale
+        start = min(size, max(0, int(np.floor(low/cls.TILE))*cls.TILE))
+        stop = max(start, min(size, int(np.ceil(high/cls.TILE))*cls.TILE))
+        return start, stop
+
+#==========================================================================================================================================================================================
+class OperationCache:
+    #A size-bounded LRU cache of operation results. Results are keyed by the operation, its parameters, and content
+    #hashes of its operands, so an operation repeated on the same data is not recomputed, whatever the operands are named
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.results = OrderedDict() #least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, Class, operationName, args, kwargs):
+        return (Class.__name__, operationName,
+                tuple(OperationCache.fingerprint(arg) for arg in args),
+                tuple(sorted((key, repr(value)) for key, value in kwargs.items())))
+
+    @staticmethod
+    def fingerprint(spectrum):
+        index = spectrum.index
+        return (spectrum.xname, spectrum.yname, spectrum.x.digest, spectrum.y.digest,
+                len(index), index[0] if len(index) else None, index[-1] if len(index) else None)
+
+    def get(self, key):
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+        self.misses += 1
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits':self.hits, 'misses':self.misses, 'size':len(self.results), 'maxsize':self.maxsize,
+                'hitRate':self.hits/lookups if lookups else 0.0}
+
+#==========================================================================================================================================================================================
+class DataFrameStore(MutableMapping):
+    #The App's DataFrames, keyed by name. A DataFrame loaded from a file can be evicted, least recently used first, to keep
+    #the store within its memory budget, and is loaded again when it is next used. DataFrames which were not loaded from
+    #anywhere (e.g. made by an operation) cannot be loaded again, so they are never evicted
+    def __init__(self, budget=None):
+        self.budget = budget #in bytes, or None for no limit
+        self.frames = OrderedDict() #name -> DataFrame, or None if evicted. Least recently used first
+        self.sizes = {} #name -> bytes held by the DataFrame when it is in memory
+        self.reloaders = {} #name -> function which loads the DataFrame again
+        self.residentBytes = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def __getitem__(self, name):
+        if self.frames[name] is None:
+            self.restore(name, self.reloaders[name]())
+        self.frames.move_to_end(name)
+        self.enforce(keep=name)
+        return self.frames[name]
+
+    def restore(self, name, df):
+        #put back an evicted DataFrame which has been loaded again, e.g. by its reloader on another thread
+        if self.frames[name] is None:
+            self.reloads += 1
+            self.frames[name] = df
+            self.sizes[name] = MemoryAccounting.dataframe(df)
+            self.residentBytes += self.sizes[name]
+
+    def __setitem__(self, name, df):
+        self.add(name, df)
+
+    def add(self, name, df, reload=None):
+        #@param reload a function of no arguments which returns the DataFrame again, if it can be evicted
+        if name in self.frames:
+            del self[name]
+        self.frames[name] = df
+        self.sizes[name] = MemoryAccounting.dataframe(df)
+        self.residentBytes += self.sizes[name]
+        if reload is not None:
+            self.reloaders[name] = reload
+        self.enforce(keep=name)
+
+    def __delitem__(self, name):
+        if self.frames.pop(name) is not None:
+            self.residentBytes -= self.sizes[name]
+        self.sizes.pop(name)
+        self.reloaders.pop(name, None)
+
+    def __contains__(self, name): #without loading an evicted DataFrame
+        return name in self.frames
+
+    def __iter__(self): #over a snapshot, as reading a DataFrame while iterating reorders the store
+        return iter(list(self.frames))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def isResident(self, name):
+        return self.frames[name] is not None
+
+    def memory_usage(self):
+        #@return {name:bytes}, which is 0 for evicted DataFrames
+        return {name:(0 if df is None else self.sizes[name]) for name, df in self.frames.items()}
+
+    def enforce(self, keep=None):
+        #evict the least recently used DataFrames which can be loaded again, until the store is within its budget
+        if self.budget is not None:
+            for name, df in list(self.frames.items()):
+                if self.residentBytes <= self.budget:
+                    break
+                if df is not None and name != keep and name in self.reloaders:
+                    self.frames[name] = None
+                    self.residentBytes -= self.sizes[name]
+                    self.evictions += 1
+
+#==========================================================================================================================================================================================
+class History:
+    #Undo & redo of the changes to spectra & plots. Each thing the user does is an entry of one or more steps, which are
+    #undone & redone together. A spectrum step keeps a SpectrumDelta, not a copy, & a plot step keeps a pair of undo &
+    #redo functions. The oldest entries are dropped beyond `depth` entries, or when the deltas, & the arrays which steps
+    #keep alive (the traces of deleted plots, lazy spectra), exceed `budget` bytes
+    def __init__(self, depth=100, budget=64*2**20):
+        self.depth = depth #0 records nothing
+        self.budget = budget
+        self.undoStack = [] #entries, each a list of steps, oldest first
+        self.redoStack = []
+        self.pending = None #the steps of the entry being recorded by an action
+        self.actionDepth = 0
+
+    @contextmanager
+    def action(self):
+        #record the steps made inside as one entry
+        self.actionDepth += 1
+        if self.actionDepth == 1:
+            self.pending = []
+        try:
+            yield
+        finally:
+            self.actionDepth -= 1
+            if not self.actionDepth:
+                steps, self.pending = self.pending, None
+                if steps:
+                    self.push(steps)
+
+    def record(self, step):
+        if self.depth:
+            if self.actionDepth:
+                self.pending.append(step)
+            else:
+                self.push([step])
+
+    def spectrum(self, app, name, spectrum):
+        #record that the spectrum under a name is about to be replaced by spectrum (None to delete it). The delta is only
+        #worked out if the history is kept
+        if self.depth:
+            self.record(SpectrumStep(app, name, spectrum))
+
+    def command(self, undo, redo, buffers=None):
+        #record a change which undo reverses & redo makes again. Both are functions of no arguments
+        #@param buffers a function of no arguments which returns the arrays that undo & redo keep alive, e.g. a plot's traces
+        self.record(CommandStep(undo, redo, buffers))
+
+    def push(self, steps):
+        self.undoStack.append(steps)
+        self.redoStack.clear()
+        while len(self.undoStack) > self.depth or (self.nbytes() > self.budget and len(self.undoStack) > 1):
+            self.undoStack.pop(0)
+
+    def nbytes(self):
+        #arrays kept alive by several steps (e.g. a figure's traces, by the steps which made & restyled it) are counted once
+        steps = [step for stack in (self.undoStack, self.redoStack) for entry in stack for step in entry]
+        return sum(step.nbytes for step in steps) + MemoryAccounting.count([buffer for step in steps for buffer in step.buffers()], set())
+
+    def undo(self, app):
+        #@return False if there was nothing to undo
+        if not self.undoStack:
+            return False
+        steps = self.undoStack.pop()
+        for step in reversed(steps):
+            step.undo(app)
+        self.redoStack.append(steps)
+        return True
+
+    def redo(self, app):
+        #@return False if there was nothing to redo
+        if not self.redoStack:
+            return False
+        steps = self.redoStack.pop()
+        for step in steps:
+            step.redo(app)
+        self.undoStack.append(steps)
+        return True
+
+    def clear(self):
+        self.undoStack.clear()
+        self.redoStack.clear()
+
+#==========================================================================================================================================================================================
+class CommandStep:
+    #a step of the History which is undone & redone by calling functions, as plot changes are
+    nbytes = 0 #the step stores no data of its own; what its functions keep alive is counted by buffers
+
+    def __init__(self, undo, redo, buffers=None):
+        self.undoFunction = undo
+        self.redoFunction = redo
+        self.buffersFunction = buffers
+
+    def buffers(self):
+        return [] if self.buffersFunction is None else self.buffersFunction()
+
+    def undo(self, app):
+        self.undoFunction()
+
+    def redo(self, app):
+        self.redoFunction()
+
+#==========================================================================================================================================================================================
+class SpectrumStep:
+    #a step of the History which changed the spectrum under a name: made, replaced, deleted or tagged it. The step keeps
+    #the delta which rebuilds the spectrum on the other side of the step from the one in the app now, so undoing & redoing
+    #are the same swap, which replaces the delta with the one leading back
+    def __init__(self, app, name, spectrum):
+        #@param spectrum the spectrum which is about to be put under the name, or None if it is about to be deleted
+        self.name = name
+        self.delta = SpectrumDelta(app.spectra.get(name), spectrum)
+        self.metadata = self.describe(app, name)
+
+    @staticmethod
+    def describe(app, name):
+        return (app.index.source(name), app.index.op(name), set(app.index.tags(name)))
+
+    @property
+    def nbytes(self):
+        return self.delta.nbytes
+
+    def buffers(self):
+        return self.delta.buffers()
+
+    def swap(self, app):
+        current = app.spectra.get(self.name)
+        restored = self.delta.rebuild(current)
+        metadata = self.describe(app, self.name)
+        self.delta = SpectrumDelta(current, restored)
+        app.index.remove(self.name)
+        if restored is None:
+            app.spectra.pop(self.name, None)
+        else:
+            app.spectra[self.name] = restored
+            app.index.add(restored, *self.metadata)
+        self.metadata = metadata
+
+    undo = redo = swap
+
+#==========================================================================================================================================================================================
+class SpectrumDelta:
+    #How to rebuild a spectrum (the target) from another one (the reference). Only the ranges of points where the x or
+    #y data differ are stored, compressed with zlib, and the target is rebuilt as copy-on-write patches of the reference's
+    #data, so a step which edited part of a spectrum costs little more than the edited part. Data the two spectra share
+    #costs nothing, and a target with no reference (e.g. a deleted spectrum) is stored whole, compressed. A lazy spectrum
+    #is kept as it is, & the data it holds (its result, or the operands it is still to be worked out from) is given by buffers
+    MAX_PATCHES = 64 #a target with more changed ranges than this is rebuilt as a new array rather than as patches
+
+    def __init__(self, target, reference):
+        self.absent = target is None
+        self.lazy = None
+        self.nbytes = 0
+        if self.absent:
+            return
+        if isinstance(target, LazySpectrum):
+            self.lazy = target
+            return
+        self.name, self.xname, self.yname, self.index = target.name, target.xname, target.yname, target.index
+        self.whole = reference is None or isinstance(reference, LazySpectrum) or len(reference.x) != len(target.x)
+        if self.whole: #reading a lazy reference's data would evaluate it
+            reference = None
+        self.x = self.difference(target.x, None if reference is None else reference.x)
+        self.y = self.difference(target.y, None if reference is None else reference.y)
+
+    def difference(self, target, reference):
+        #@return None if the CowArrays are the same, else (starts, stops, compressed values of the target in those ranges)
+        if target is reference:
+            return None
+        values = target.array
+        if reference is not None and reference.array.dtype != values.dtype: #e.g. the precision was changed in between
+            reference = None
+        if reference is None:
+            starts, stops = np.array([0]), np.array([values.size])
+        else:
+            other = reference.array
+            changed = np.concatenate(([False], ~((values == other) | (np.isnan(values) & np.isnan(other))), [False]))
+            edges = np.flatnonzero(changed[1:] != changed[:-1])
+            starts, stops = edges[::2], edges[1::2]
+        data = zlib.compress(np.concatenate([values[start:stop] for start, stop in zip(starts, stops)] or [np.empty(0, values.dtype)]).tobytes())
+        self.nbytes += len(data) + starts.nbytes + stops.nbytes
+        return starts, stops, values.dtype, data
+
+    def buffers(self):
+        #the arrays a kept lazy spectrum holds: its result once evaluated, else the data it will be worked out from
+        if self.lazy is None:
+            return []
+        buffers, pending = [], [self.lazy]
+        while pending:
+            spectrum = pending.pop()
+            if isinstance(spectrum, LazySpectrum) and spectrum.node.result is None:
+                pending += spectrum.node.operands
+            else:
+                buffers += spectrum.buffers()
+        return buffers
+
+    def patch(self, delta, reference):
+        #@return the target's CowArray, rebuilt from the reference's. Values patched into a reference stored at another
+        #precision are converted to it
+        if delta is None:
+            return reference
+        starts, stops, dtype, data = delta
+        values = np.frombuffer(zlib.decompress(data), dtype=dtype)
+        if reference is None:
+            return CowArray(values)
+        if len(starts) > self.MAX_PATCHES:
+            array = reference.array.copy()
+            array[np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])] = values
+            return CowArray(array)
+        offset = 0
+        for start, stop in zip(starts, stops):
+            reference = reference.patch(start, stop, values[offset:offset + stop - start])
+            offset += stop - start
+        return reference
+
+    def rebuild(self, reference):
+        #@return the target, or None if there was none
+        if self.absent:
+            return None
+        if self.lazy is not None:
+            return self.lazy
+        if self.whole:
+            reference = None
+        spectrum = Spectrum.__new__(Spectrum)
+        spectrum.name, spectrum.xname, spectrum.yname, spectrum.index = self.name, self.xname, self.yname, self.index
+        spectrum.x = self.patch(self.x, None if reference is None else reference.x)
+        spectrum.y = self.patch(self.y, None if reference is None else reference.y)
+        return spectrum
+
+#==========================================================================================================================================================================================
+class MemoryAccounting:
+    #Measures the memory held by DataFrames, spectra & plots. Spectra & plots can share arrays (copy-on-write duplicates,
+    #views, traces of a spectrum), so each array is counted once, against the numpy array which owns its memory
+    @staticmethod
+    def dataframe(df):
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+    @staticmethod
+    def owner(array):
+        #@return the array which owns the memory that the array (or view) uses
+        while isinstance(array.base, np.ndarray):
+            array = array.base
+        return array
+
+    @classmethod
+    def count(cls, arrays, seen):
+        #@return the bytes held by the arrays which are not owned by an array in seen. @param seen a set of ids, updated in place
+        nbytes = 0
+        for array in arrays:
+            owner = cls.owner(np.asarray(array))
+            if id(owner) not in seen:
+                seen.add(id(owner))
+                nbytes += owner.nbytes
+        return nbytes
+
+    @staticmethod
+    def line_buffers(line):
+        #the data given to a trace, which is usually a spectrum's, and the copy matplotlib keeps of it for drawing
+        return [np.asarray(line.get_xdata(orig=True)), np.asarray(line.get_ydata(orig=True)), line.get_xydata()]
+
+    @classmethod
+    def plot_buffers(cls, fig):
+        return [buffer for ax in fig.axes for line in ax.lines for buffer in cls.line_buffers(line)]
+
+#==========================================================================================================================================================================================
+class SpectrumIndex:
+    #A searchable index of spectra by name, source file, tags, the operation which made them, x range & peak positions.
+    #Names are kept sorted, so a prefix search is a binary search. A search which only narrows the previous one (e.g.
+    #one more character typed) filters the previous results instead of the whole index. The x range & peaks of a
+    #spectrum are only computed the first time a search needs them, so indexing a new spectrum is cheap
+    FILTERS = ('source', 'tag', 'op', 'x', 'peak') #the field:value terms a search can use
+    PEAK_TOLERANCE = 5 #how far from a peak:value a peak may be, in the units of x
+    PEAK_PROMINENCE = 0.05 #the prominence of an indexed peak, as a fraction of the spectrum's range of y values
+    PEAK_SPACING = 5 #the least number of points between indexed peaks, which saves measuring the prominence of noise
+
+    def __init__(self):
+        self.entries = {} #name -> {'spectrum', 'source', 'op', 'tags', 'xrange', 'peaks'}
+        self.sortedNames = None #(lower case name, name) pairs, sorted. None when it needs rebuilding
+        self.lastSearch = None #(name terms, filters, results) of the last search
+        self.peakCache = weakref.WeakKeyDictionary() #y CowArray -> peaks, so spectra sharing their y data share their peaks
+
+    def add(self, spectrum, source=None, op=None, tags=()):
+        self.entries[spectrum.name] = {'spectrum':spectrum, 'source':source, 'op':op, 'tags':set(tags), 'xrange':None, 'peaks':None}
+        self.changed()
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+        self.changed()
+
+    def changed(self):
+        self.sortedNames = None
+        self.lastSearch = None
+
+    def source(self, name):
+        return self.entries[name]['source'] if name in self.entries else None
+
+    def op(self, name):
+        return self.entries[name]['op'] if name in self.entries else None
+
+    def tags(self, name):
+        return self.entries[name]['tags'] if name in self.entries else set()
+
+    def setTags(self, name, tags):
+        self.entries[name]['tags'] = {tag.strip() for tag in tags if tag.strip()}
+        self.lastSearch = None
+
+    def xrange(self, name):
+        entry = self.entries[name]
+        if entry['xrange'] is None:
+            x = entry['spectrum'].x.array
+            entry['xrange'] = (np.nanmin(x), np.nanmax(x)) if x.size else (np.nan, np.nan)
+        return entry['xrange']
+
+    def peaks(self, name):
+        #@return the sorted x positions of the spectrum's prominent peaks
+        entry = self.entries[name]
+        if entry['peaks'] is None:
+            spectrum = entry['spectrum']
+            if spectrum.y not in self.peakCache:
+                from scipy.signal import find_peaks
+                x, y = spectrum.x.array, spectrum.y.array
+                finite = np.isfinite(y)
+                span = np.ptp(y[finite]) if finite.any() else 0
+                positions, _ = find_peaks(np.where(finite, y, np.nanmin(y) if finite.any() else 0), distance=self.PEAK_SPACING,
+                                          prominence=span*self.PEAK_PROMINENCE or None)
+                self.peakCache[spectrum.y] = np.sort(x[positions])
+            entry['peaks'] = self.peakCache[spectrum.y]
+        return entry['peaks']
+
+    def names(self):
+        if self.sortedNames is None:
+            self.sortedNames = sorted((name.lower(), name) for name in self.entries)
+        return self.sortedNames
+
+    @classmethod
+    def parse(cls, text):
+        #@return (name terms, {filter:value}) of a search. Terms are lower case
+        terms, filters = [], {}
+        for word in text.lower().split():
+            field, _, value = word.partition(':')
+            if value and field in cls.FILTERS:
+                filters[field] = value
+            else:
+                terms.append(word)
+        return tuple(terms), filters
+
+    @staticmethod
+    def interval(value, tolerance):
+        #parse 'a-b' as the interval [a, b], or a number as [value - tolerance, value + tolerance]. @return None if invalid
+        low, _, high = value.partition('-')
+        if high and isNumber(low) and isNumber(high):
+            return sorted((float(low), float(high)))
+        if isNumber(value):
+            return (float(value) - tolerance, float(value) + tolerance)
+
+    def matches(self, name, filters):
+        entry = self.entries[name]
+        for field, value in filters.items():
+            if field == 'source' and value not in str(entry['source'] or '').lower():
+                return False
+            if field == 'op' and value not in str(entry['op'] or '').lower():
+                return False
+            if field == 'tag' and value not in {tag.lower() for tag in entry['tags']}:
+                return False
+            if field == 'x':
+                interval = self.interval(value, 0)
+                xmin, xmax = self.xrange(name)
+                if interval is None or not (xmin <= interval[0] and interval[1] <= xmax):
+                    return False
+            if field == 'peak':
+                interval = self.interval(value, self.PEAK_TOLERANCE)
+                peaks = self.peaks(name)
+                if interval is None or np.searchsorted(peaks, interval[0], 'left') == np.searchsorted(peaks, interval[1], 'right'):
+                    return False
+        return True
+
+    def search(self, text, limit=None):
+        #Find spectra by words and field:value filters, e.g. "calcite tag:ground peak:1420 source:run3". Every word must
+        #be in the name; names which start with the first word come first. Filters are: source & op (substrings), tag,
+        #x (a value or range which the x axis covers) and peak (a peak within PEAK_TOLERANCE of a value, or in a range)
+        #@return the matching names, sorted, at most limit of them. A limited search stops as soon as it has enough
+        terms, filters = self.parse(text)
+        if self.lastSearch is not None and self.lastSearch[1] == filters and len(self.lastSearch[0]) == len(terms) \
+           and all(old in new for old, new in zip(self.lastSearch[0], terms)):
+            candidates = self.lastSearch[2] #the previous results, which are a superset of this search's
+            if terms: #names which start with the first word first, which the longer word may have changed
+                candidates = [pair for pair in candidates if pair[0].startswith(terms[0])] + [pair for pair in candidates if not pair[0].startswith(terms[0])]
+        elif terms:
+            names = self.names()
+            start = bisect.bisect_left(names, (terms[0],))
+            stop = bisect.bisect_left(names, (terms[0] + '\uffff',))
+            candidates = names[start:stop] + [pair for pair in itertools.chain(names[:start], names[stop:]) if terms[0] in pair[0]]
+        else:
+            candidates = self.names()
+        results = (pair for pair in candidates if all(term in pair[0] for term in terms) and (not filters or self.matches(pair[1], filters)))
+        if limit is not None:
+            self.lastSearch = None #the results are incomplete, so a refined search cannot start from them
+            return [name for _, name in itertools.islice(results, limit)]
+        results = list(results)
+        self.lastSearch = (terms, filters, results)
+        return [name for _, name in results]
+
+#==========================================================================================================================================================================================
+class SpectralLibrary:
+    #A library of reference spectra for identifying unknowns. The references are resampled onto one wavenumber grid and
+    #normalised once, into a float32 matrix with one row per reference, and saved as an .npz file. A query is resampled &
+    #normalised the same way, and scored against every reference with a single matrix-vector product: the row sums &
+    #squared norms stored with the matrix turn the dot products into correlations, cosines or Euclidean distances.
+    #For very large libraries, the search can first score a coarse copy of the matrix (COARSEN points averaged into one)
+    #and then score only the best candidates at full resolution
+    METRICS = ('correlation', 'cosine', 'euclidean')
+    NORMALISATIONS = ('vector', 'max', 'snv', 'none')
+    POINTS = 1800 #points in the default grid
+    COARSEN = 8
+
+    def __init__(self, names, grid, matrix, normalisation='vector'):
+        self.names = np.asarray(names, dtype=str)
+        self.grid = np.asarray(grid, dtype=float)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.normalisation = normalisation
+        self.full = self.summarise(self.matrix)
+        usable = self.grid.size//self.COARSEN*self.COARSEN
+        self.coarse = self.summarise(self.matrix[:, :usable].reshape(len(self.names), -1, self.COARSEN).mean(axis=2))
+
+    @staticmethod
+    def summarise(matrix):
+        #@return (matrix, row sums, row squared norms), which is all the scoring needs
+        return matrix, matrix.sum(axis=1, dtype=float), np.einsum('ij,ij->i', matrix, matrix, dtype=float)
+
+    @classmethod
+    def resample(cls, spectrum, grid):
+        x, y = spectrum.x.array, spectrum.y.array
+        if x.size > 1 and x[0] > x[-1]: #np.interp needs ascending x
+            x, y = x[::-1], y[::-1]
+        finite = np.isfinite(x) & np.isfinite(y)
+        return np.interp(grid, x[finite], y[finite])
+
+    @classmethod
+    def normalise(cls, rows, normalisation):
+        #normalise each row of a 2-D array in place
+        if normalisation == 'snv': #standard normal variate: zero mean, unit standard deviation
+            rows -= rows.mean(axis=1, keepdims=True)
+            deviations = rows.std(axis=1, keepdims=True)
+            rows /= np.where(deviations > 0, deviations, 1)
+        elif normalisation == 'vector':
+            norms = np.linalg.norm(rows, axis=1, keepdims=True)
+            rows /= np.where(norms > 0, norms, 1)
+        elif normalisation == 'max':
+            peaks = np.abs(rows).max(axis=1, keepdims=True)
+            rows /= np.where(peaks > 0, peaks, 1)
+        return rows
+
+    @classmethod
+    def build(cls, spectra, grid=None, normalisation='vector'):
+        #@param grid the wavenumbers to resample onto. By default, POINTS points spanning the range all the spectra cover
+        if grid is None:
+            low = max(np.nanmin(spectrum.x.array) for spectrum in spectra)
+            high = min(np.nanmax(spectrum.x.array) for spectrum in spectra)
+            if not low < high:
+                raise BadAxisSymmetryException
+            grid = np.linspace(low, high, cls.POINTS)
+        matrix = np.empty((len(spectra), len(grid)))
+        for row, spectrum in zip(matrix, spectra):
+            row[:] = cls.resample(spectrum, grid)
+        return cls([spectrum.name for spectrum in spectra], grid, cls.normalise(matrix, normalisation), normalisation)
+
+    def save(self, filename):
+        np.savez(filename, names=self.names, grid=self.grid, matrix=self.matrix, normalisation=np.array(self.normalisation))
+
+    @classmethod
+    def open(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            return cls(data['names'], data['grid'], data['matrix'], str(data['normalisation']))
+
+    def query(self, spectrum):
+        #@return the spectrum resampled & normalised like the references
+        return self.normalise(self.resample(spectrum, self.grid)[np.newaxis, :], self.normalisation)[0].astype(np.float32)
+
+    @staticmethod
+    def score(summary, q, metric):
+        #@return the score of every row against q. Higher is better, except for euclidean distances
+        matrix, sums, squares = summary
+        n = q.size
+        dots = matrix @ q #the one pass over the matrix
+        qsum, qsquare = float(q.sum(dtype=float)), float(np.dot(q, q))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if metric == 'cosine':
+                return dots/np.sqrt(squares*qsquare)
+            if metric == 'correlation': #centring both vectors only changes the sums, so the dot products can be reused
+                return (dots - sums*qsum/n)/np.sqrt((squares - sums**2/n)*(qsquare - qsum**2/n))
+            return np.sqrt(np.maximum(squares - 2*dots + qsquare, 0))
+
+    @staticmethod
+    def best(scores, k, metric):
+        #@return the positions of the k best scores, best first
+        order = scores if metric == 'euclidean' else -np.nan_to_num(scores, nan=-np.inf)
+        k = min(k, order.size)
+        top = np.argpartition(order, k - 1)[:k] if k < order.size else np.arange(order.size)
+        return top[np.argsort(order[top], kind='stable')]
+
+    def search(self, spectrum, metric='correlation', k=10, candidates=None):
+        #@param candidates if given, only this many references are chosen by a coarse search to be scored in full, which
+        #is approximate but much faster for very large libraries
+        #@return a DataFrame of the k best matches (rank, reference, score), best first
+        if metric not in self.METRICS:
+            raise ValueError(metric)
+        q = self.query(spectrum)
+        if candidates is not None and candidates < len(self.names):
+            usable = self.grid.size//self.COARSEN*self.COARSEN
+            coarseQuery = q[:usable].reshape(-1, self.COARSEN).mean(axis=1)
+            rows = self.best(self.score(self.coarse, coarseQuery, metric), max(candidates, k), metric)
+            matrix, sums, squares = self.full
+            scores = self.score((matrix[rows], sums[rows], squares[rows]), q, metric)
+            top = self.best(scores, k, metric)
+            positions, scores = rows[top], scores[top]
+        else:
+            scores = self.score(self.full, q, metric)
+            positions = self.best(scores, k, metric)
+            scores = scores[positions]
+        return pd.DataFrame({'rank':np.arange(1, positions.size + 1), 'reference':self.names[positions], metric:scores})
+
 #==========================================================================================================================================================================================
 class Transformations:
 #a group of functions which returns a non-curve (non DataFrame) result
@@ -190,6 +1485,7 @@ class Transformations:
     def find_maximum(cls, spectrum, guess=None):
         #if no guess is provided, the global maximum will be returned
         if(guess):
+            from scipy.signal import find_peaks
             peaks, _ = find_peaks(spectrum.ydata.values)# returns array of indices
             peakpts = spectrum.df.iloc[peaks].reset_index()
             closest = peakpts.iloc[[(peakpts.iloc[:,1]-guess).abs().argsort()[0]]]
@@ -197,6 +1493,1163 @@ class Transformations:
         else:
             return (spectrum.xdata[spectrum.ydata.idxmax()], spectrum.ydata.max())
 
+#==========================================================================================================================================================================================
+class DelimitedReader:
+    #Reads delimited text files. The delimiter, decimal & thousands separators and header rows are detected by sniffing
+    #only the first few KB of the file, so the file itself is parsed exactly once, with the right options
+    SAMPLE_BYTES = 16384
+    DELIMITERS = [',', '\t', ';', '|', ' '] #in order of preference when two are equally consistent
+
+    @classmethod
+    def read(cls, filename, delimiter=None):
+        #@param delimiter overrides the sniffed delimiter if given
+        dialect = cls.sniff(filename)
+        if delimiter is not None:
+            dialect['delimiter'] = delimiter
+        sep = r'\s+' if dialect['delimiter'] == ' ' else dialect['delimiter']
+        parse = partial(pd.read_csv, filename, sep=sep, decimal=dialect['decimal'], thousands=dialect['thousands'],
+                        skiprows=dialect['skiprows'], header=None, skip_blank_lines=True)
+        try:
+            df = parse(encoding=dialect['encoding'])
+        except UnicodeDecodeError: #text after the sample which is not utf-8 after all
+            df = parse(encoding='latin-1')
+        names = dialect['names']
+        if names is None or len(names) != len(df.columns) or len(set(names)) != len(names): #give the DataFrame default column names
+            names = ["w%i" %i for i in range(len(df.columns))]
+        df.columns = names
+        return df
+
+    @classmethod
+    def sniff(cls, filename):
+        #@return a dict of the delimiter, decimal & thousands separators, the number of rows before the data (skiprows),
+        #the column names from the header row, if there is one, and the encoding the whole file is parsed with
+        with open(filename, 'rb') as f:
+            sample = f.read(cls.SAMPLE_BYTES)
+            complete = not f.read(1)
+        encoding = cls.sniff_encoding(sample, complete)
+        lines = codecs.getincrementaldecoder(encoding)().decode(sample, final=False).splitlines()
+        if not complete and len(lines) > 1:
+            lines = lines[:-1] #the last line may have been cut off
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            raise UnsupportedFileTypeException(filename)
+
+        delimiter = cls.sniff_delimiter(lines)
+        rows = [cls.split(line, delimiter) for line in lines]
+        decimal, thousands = cls.sniff_separators([field for row in rows[len(rows)//2:] for field in row], delimiter)
+
+        headerRows = 0
+        while headerRows < len(rows) and not all(cls.isNumber(field, decimal, thousands) for field in rows[headerRows]):
+            headerRows += 1
+        if headerRows == len(rows): #no numeric rows at all; let pandas decide what to do with it
+            headerRows = 0
+        names = [field.strip().strip('"') for field in rows[headerRows - 1]] if headerRows else None
+        return {'delimiter':delimiter, 'decimal':decimal, 'thousands':thousands, 'skiprows':headerRows, 'names':names,
+                'encoding':encoding}
+
+    @staticmethod
+    def sniff_encoding(sample, complete):
+        #@return 'utf-8-sig' or 'utf-8' if the sample is utf-8 text with a byte order mark or other non-ascii characters, else
+        #'latin-1', which can decode any bytes, so that e.g. a header written by Windows software (cm\xb9) or non-ascii
+        #characters after the sample never stop the file being parsed
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if not sample.isascii():
+            try:
+                codecs.getincrementaldecoder('utf-8')().decode(sample, final=complete) #the sample may end part way through a character
+                return 'utf-8'
+            except UnicodeDecodeError:
+                pass
+        return 'latin-1'
+
+    @classmethod
+    def sniff_delimiter(cls, lines):
+        #the delimiter is the candidate which splits the most lines into the same number of fields (more than one)
+        best, bestScore = ',', (0, 0)
+        for delimiter in cls.DELIMITERS:
+            counts = [len(cls.split(line, delimiter)) for line in lines]
+            mode = max(set(counts), key=counts.count)
+            score = (counts.count(mode)/len(counts), mode) if mode > 1 else (0, 0)
+            if score[0] > bestScore[0]:
+                best, bestScore = delimiter, score
+        return best
+
+    @classmethod
+    def sniff_separators(cls, fields, delimiter):
+        #@return (decimal, thousands) judged from the data fields
+        fields = [field.strip().strip('"') for field in fields]
+        commaDecimal = sum(bool(re.fullmatch(r'[+-]?\d+,\d+([eE][+-]?\d+)?', field)) for field in fields)
+        pointDecimal = sum(bool(re.fullmatch(r'[+-]?\d*\.\d+([eE][+-]?\d+)?', field)) for field in fields)
+        decimal = ',' if delimiter != ',' and commaDecimal > pointDecimal else '.'
+        thousands = None
+        for separator in ([',', ' ', "'"] if decimal == '.' else ['.', ' ', "'"]):
+            if separator != delimiter and any(re.fullmatch(r'[+-]?\d{1,3}(%s\d{3})+([.,]\d+)?' %re.escape(separator), field) for field in fields):
+                thousands = separator
+                break
+        return decimal, thousands
+
+    @staticmethod
+    def split(line, delimiter):
+        return line.split() if delimiter == ' ' else line.split(delimiter)
+
+    @staticmethod
+    def isNumber(field, decimal='.', thousands=None):
+        field = field.strip().strip('"')
+        if thousands:
+            field = field.replace(thousands, '')
+        try:
+            float(field.replace(decimal, '.'))
+            return True
+        except ValueError:
+            return field == '' #empty fields are missing values
+
+#==========================================================================================================================================================================================
+class FixedWidthReader:
+    #Reads fixed width text files. The column boundaries are inferred once, from a small sample of lines, and the whole
+    #file is then parsed by slicing a 2-D character array, rather than pandas inferring the widths over every line
+    SAMPLE_LINES = 100
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, 'rb') as f:
+            lines = [line for line in f.read().expandtabs(8).splitlines() if line.strip()]
+        if not lines:
+            raise UnsupportedFileTypeException(filename)
+
+        sample = lines[:cls.SAMPLE_LINES]
+        headerRows = 0
+        while headerRows < len(sample) and not cls.isNumeric(sample[headerRows]):
+            headerRows += 1
+        if headerRows == len(sample):
+            raise UnsupportedFileTypeException(filename)
+
+        colspecs = cls.infer_colspecs(sample[headerRows:])
+        header, lines = lines[headerRows - 1] if headerRows else None, lines[headerRows:]
+
+        width = max(len(line) for line in lines)
+        chars = np.array(lines, dtype='S%i' %width).view('S1').reshape(len(lines), width) #shorter lines are padded with nulls
+        columns = {}
+        for i, (start, stop) in enumerate(colspecs):
+            stop = width if stop is None else min(stop, width)
+            name = header[start:stop].strip().decode('latin-1') if header is not None else ""
+            field = np.ascontiguousarray(chars[:, start:stop]).view('S%i' %(stop - start)).ravel()
+            try:
+                values = field.astype(float)
+            except ValueError: #blank or malformed fields become NaN
+                values = pd.to_numeric(pd.Series(field.astype(str)).str.strip(), errors='coerce').to_numpy()
+            columns[name or "w%i" %i] = values
+        return pd.DataFrame(columns)
+
+    @classmethod
+    def infer_colspecs(cls, sample):
+        #columns are the runs of character positions which are occupied in at least one sample line. The boundary between
+        #two columns is the middle of the gap between them, so longer values later in the file still fit their column
+        width = max(len(line) for line in sample)
+        occupied = np.zeros(width + 1, dtype=bool)
+        for line in sample:
+            occupied[:len(line)] |= np.frombuffer(line, dtype=np.uint8) != ord(' ')
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], occupied)).astype(np.int8)))
+        starts, stops = edges[0::2], edges[1::2]
+        bounds = [0] + [(stop + start)//2 for stop, start in zip(stops[:-1], starts[1:])] + [None]
+        return [(bounds[i], bounds[i + 1]) for i in range(len(starts))]
+
+    @staticmethod
+    def isNumeric(line):
+        try:
+            [float(field) for field in line.split()]
+            return True
+        except ValueError:
+            return False
+
+#==========================================================================================================================================================================================
+class VendorReaders:
+    #Readers for instrument file formats. The binary formats (Bruker OPUS & Thermo Galactic SPC) are decoded straight
+    #from their data blocks into numpy arrays. Each reader returns a DataFrame with named x & y columns
+    FILETYPES = ('opus', 'spc', 'jdx')
+    EXTENSIONS = {'.spc':'spc', '.jdx':'jdx', '.dx':'jdx', '.jcamp':'jdx'} #OPUS files are numbered: .0, .1, ...
+
+    OPUS_MAGIC = b'\x0a\x0a\xfe\xfe'
+    OPUS_AB, OPUS_SAMPLE, OPUS_REFERENCE = 15, 7, 11 #the data types of spectrum blocks in the directory
+    OPUS_STATUS_OFFSET = 16 #a spectrum's data status block has the data type of its data block plus this, & the same channel type
+    OPUS_CHANNELS = {(7, 4):'ScSm', (7, 8):'IgSm', (7, 12):'PhSm', (11, 4):'ScRf', (11, 8):'IgRf', (11, 12):'PhRf'}
+    #single channel spectra, by (data type, channel type): the spectrum, interferogram & phase of the sample & the reference
+
+    SPC_HEADER = struct.Struct('<BBBbIddIBBBBI9s9sH32s130s30sIIBBHf48sfIfB187s') #the 512 byte main header
+    SPC_SUBHEADER = struct.Struct('<BbHfffIIf4s')
+    SPC_NEW_LSB = 0x4b
+    SPC_TSPREC, SPC_TMULTI, SPC_TXYXYS, SPC_TXVALS = 0x01, 0x04, 0x40, 0x80
+
+    @classmethod
+    def filetype(cls, filename):
+        #@return the vendor file type of the filename, judged by its extension
+        extension = os.path.splitext(filename)[1].lower()
+        if extension[1:].isdigit():
+            return 'opus'
+        return cls.EXTENSIONS.get(extension)
+
+    @staticmethod
+    def values(filename, data, dtype, count, offset):
+        #@return count values of dtype from the data at offset. A file which is cut short (e.g. copied while it was still
+        #being written) is not read past its end
+        if count < 0 or offset < 0 or offset + count*np.dtype(dtype).itemsize > len(data):
+            raise UnsupportedFileTypeException(filename)
+        return np.frombuffer(data, dtype, count, offset)
+
+    @classmethod
+    def read_opus(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if data[:4] != cls.OPUS_MAGIC:
+            raise UnsupportedFileTypeException(filename)
+        directory, _, numBlocks = struct.unpack_from('<iii', data, 12)
+        blocks = [struct.unpack_from('<BBBBii', data, directory + 12*i) for i in range(numBlocks)]
+
+        status = {} #the parameters of each data status block, by its data type & channel type
+        for dataType, channel, _, _, length, offset in blocks:
+            if dataType - cls.OPUS_STATUS_OFFSET in (cls.OPUS_AB, cls.OPUS_SAMPLE, cls.OPUS_REFERENCE):
+                status[dataType, channel] = cls.opus_parameters(data, offset, offset + 4*length)
+
+        columns = {}
+        for dataType, channel, _, _, length, offset in blocks:
+            parameters = status.get((dataType + cls.OPUS_STATUS_OFFSET, channel))
+            if parameters is not None and dataType in (cls.OPUS_AB, cls.OPUS_SAMPLE, cls.OPUS_REFERENCE):
+                npt = min(int(parameters['NPT']), length)
+                name = 'AB' if dataType == cls.OPUS_AB else cls.OPUS_CHANNELS.get((dataType, channel), "%i.%i" %(dataType, channel))
+                columns[name + " x"] = pd.Series(np.linspace(parameters['FXV'], parameters['LXV'], npt))
+                columns[name] = pd.Series(cls.values(filename, data, '<f4', npt, offset).astype(float)*parameters.get('CSF', 1.0))
+        if not columns:
+            raise UnsupportedFileTypeException(filename)
+        return pd.DataFrame(columns)
+
+    @classmethod
+    def opus_parameters(cls, data, start, stop):
+        #parameter blocks are a sequence of (3 letter name, type, size in 2 byte words, value), ending with END
+        parameters = {}
+        cursor = start
+        while cursor < stop:
+            name = data[cursor:cursor + 3].decode('ascii', 'replace')
+            if name == 'END':
+                break
+            valueType, size = struct.unpack_from('<HH', data, cursor + 4)
+            value = data[cursor + 8:cursor + 8 + 2*size]
+            if valueType == 0:
+                parameters[name] = struct.unpack_from('<i', value)[0]
+            elif valueType == 1:
+                parameters[name] = struct.unpack_from('<d', value)[0]
+            else:
+                parameters[name] = value.split(b'\x00')[0].decode('latin-1')
+            cursor += 8 + 2*size
+        return parameters
+
+    @classmethod
+    def read_spc(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        header = cls.SPC_HEADER.unpack_from(data, 0)
+        flags, version, exponent, npts, first, last, nsub = header[0], header[1], header[3], header[4], header[5], header[6], header[7]
+        if version != cls.SPC_NEW_LSB: #the old & big-endian formats are not supported
+            raise UnsupportedFileTypeException(filename)
+
+        cursor = cls.SPC_HEADER.size
+        x = None
+        if flags & cls.SPC_TXVALS and not flags & cls.SPC_TXYXYS: #one x array shared by all subfiles
+            x = cls.values(filename, data, '<f4', npts, cursor).astype(float)
+            cursor += 4*npts
+        elif not flags & cls.SPC_TXYXYS: #evenly spaced x values
+            x = np.linspace(first, last, npts)
+
+        columns = {}
+        nsub = max(nsub, 1) if flags & cls.SPC_TMULTI else 1
+        for i in range(nsub):
+            subheader = cls.SPC_SUBHEADER.unpack_from(data, cursor)
+            cursor += cls.SPC_SUBHEADER.size
+            subexponent, subnpts = subheader[1], subheader[6]
+            points = npts
+            suffix = "" if nsub == 1 else str(i)
+            if flags & cls.SPC_TXYXYS: #each subfile has its own x array
+                points = subnpts
+                columns["x" + suffix] = pd.Series(cls.values(filename, data, '<f4', points, cursor).astype(float))
+                cursor += 4*points
+            elif i == 0:
+                columns["x"] = pd.Series(x)
+
+            if subexponent == -128 or (nsub == 1 and exponent == -128): #IEEE floats
+                y = cls.values(filename, data, '<f4', points, cursor).astype(float)
+                cursor += 4*points
+            elif flags & cls.SPC_TSPREC: #16 bit fixed point
+                y = cls.values(filename, data, '<i2', points, cursor)*2.0**(subexponent - 16)
+                cursor += 2*points
+            else: #32 bit fixed point
+                y = cls.values(filename, data, '<i4', points, cursor)*2.0**(subexponent - 32)
+                cursor += 4*points
+            columns["y" + suffix] = pd.Series(y)
+        return pd.DataFrame(columns)
+
+    JCAMP_TOKEN = re.compile(r'([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|([@A-Ia-i]\d*\.?\d*)|([%J-Rj-r]\d*\.?\d*)|([S-Zs]\d*)|[\s,;]+')
+    JCAMP_SQZ = {c:v for v, c in enumerate('@ABCDEFGHI')}
+    JCAMP_SQZ.update({c:-v for v, c in enumerate('abcdefghi', 1)})
+    JCAMP_DIF = {c:v for v, c in enumerate('%JKLMNOPQR')}
+    JCAMP_DIF.update({c:-v for v, c in enumerate('jklmnopqr', 1)})
+    JCAMP_DUP = {c:v for v, c in enumerate('STUVWXYZs', 1)}
+
+    @classmethod
+    def read_jcamp(cls, filename):
+        #JCAMP-DX is a text format, so it is decoded line by line. Both (X++(Y..Y)) tables, in any of the ASDF
+        #compressed forms, and (XY..XY) point tables are supported
+        labels = {}
+        table, rows = None, []
+        with open(filename, 'r', encoding='latin-1') as f:
+            for line in f:
+                line = line.split('$$')[0].strip() #drop comments
+                if line.startswith('##'):
+                    label, _, value = line[2:].partition('=')
+                    label = re.sub(r'[\s\-/_]', '', label).upper()
+                    labels[label] = value.strip()
+                    table = value.strip().upper().replace(' ', '') if label in ('XYDATA', 'XYPOINTS', 'PEAKTABLE') else None
+                elif table and line:
+                    rows.append(line)
+
+        xfactor = float(labels.get('XFACTOR', 1))
+        yfactor = float(labels.get('YFACTOR', 1))
+        xname = labels.get('XUNITS') or 'x'
+        yname = labels.get('YUNITS') or 'y'
+        if yname == xname:
+            yname = yname + " y"
+
+        if table is None and not rows:
+            raise UnsupportedFileTypeException(filename)
+        if 'XYDATA' in labels and labels['XYDATA'].upper().replace(' ', '') == '(X++(Y..Y))':
+            y = np.array(cls.jcamp_decode(rows))*yfactor
+            npoints = int(float(labels.get('NPOINTS', y.size)))
+            if y.size < npoints: #cut short
+                raise UnsupportedFileTypeException(filename)
+            y = y[:npoints]
+            if 'FIRSTX' in labels and 'LASTX' in labels:
+                x = np.linspace(float(labels['FIRSTX']), float(labels['LASTX']), npoints)[:y.size]
+            else:
+                x = np.arange(y.size)*float(labels.get('DELTAX', 1))*xfactor
+        else: #(XY..XY) pairs
+            values = np.array([float(token) for row in rows for token in re.split(r'[\s,;]+', row) if token], dtype=float)
+            if values.size % 2 or values.size < 2*int(float(labels.get('NPOINTS', 0))): #cut short
+                raise UnsupportedFileTypeException(filename)
+            x, y = values[0::2]*xfactor, values[1::2]*yfactor
+        return pd.DataFrame({xname:x, yname:y})
+
+    @staticmethod
+    def jcamp_number(digit, rest):
+        #the pseudo-digit character of a SQZ or DIF token stands for its first digit & its sign
+        return float(str(abs(digit)) + rest)*(1 if digit >= 0 else -1)
+
+    @classmethod
+    def jcamp_decode(cls, rows):
+        #decode (X++(Y..Y)) rows in AFFN, SQZ, DIF & DUP forms. @return the list of y values
+        ys = []
+        previousDif = False #whether the last row ended in DIF form; if so, the next row repeats its last y as a check value
+        for row in rows:
+            values = []
+            lastDelta = None
+            for match in cls.JCAMP_TOKEN.finditer(row):
+                affn, sqz, dif, dup = match.groups()
+                if affn is not None:
+                    values.append(float(affn))
+                    lastDelta = None
+                elif sqz is not None:
+                    values.append(cls.jcamp_number(cls.JCAMP_SQZ[sqz[0]], sqz[1:]))
+                    lastDelta = None
+                elif dif is not None:
+                    lastDelta = cls.jcamp_number(cls.JCAMP_DIF[dif[0]], dif[1:])
+                    values.append(values[-1] + lastDelta)
+                elif dup is not None:
+                    count = int(str(cls.JCAMP_DUP[dup[0]]) + dup[1:])
+                    for _ in range(count - 1):
+                        values.append(values[-1] + lastDelta if lastDelta is not None else values[-1])
+            if not values:
+                continue
+            yvalues = values[1:] #the first value of each row is its x value
+            if previousDif and ys and yvalues:
+                yvalues = yvalues[1:]
+            ys.extend(yvalues)
+            previousDif = lastDelta is not None
+        return ys
+
+#==========================================================================================================================================================================================
+class DirectoryWatcher:
+    #Polls a directory for new files, e.g. from a spectrometer during a measurement campaign, and loads each one through
+    #App.load once it has stopped changing, so that files which are still being written are never parsed.
+    #If x & y columns are given, a Spectrum is made from every new file, and it can also be added to a plot
+    def __init__(self, app, directory, x=None, y=None, plot=None, axis=0, interval=2000, settle=2, includeExisting=False, onIngest=None):
+        #@param interval the time between polls, in ms
+        #@param settle the number of consecutive polls for which a file's size & modification time must not change
+        #@param onIngest called with the filename & the new Spectrum (or None) after each file is loaded. The spectrum is named
+        #after the file, numbered if the name is taken, so its name tells which spectrum the file became
+        self.app = app
+        self.directory = directory
+        self.x, self.y = x, y
+        self.plot, self.axis = plot, axis
+        self.interval = interval
+        self.settle = settle
+        self.onIngest = onIngest
+        self.pending = {} #filename -> ((size, mtime), number of polls unchanged)
+        self.seen = set() if includeExisting else {entry.path for entry in os.scandir(directory) if entry.is_file()}
+        self.errors = {} #filenames which could not be loaded, and why
+        self.afterId = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.poll()
+
+    def stop(self):
+        self.running = False #also stops a poll in progress, e.g. when onIngest stops the watcher, from rescheduling
+        if self.afterId is not None:
+            self.app.after_cancel(self.afterId)
+            self.afterId = None
+
+    def poll(self):
+        #the next poll is always scheduled, so an unreadable directory or file (e.g. a network share dropping out, or a file
+        #deleted between listing & stat) is recorded in errors rather than stopping the watcher
+        try:
+            try:
+                entries = list(os.scandir(self.directory))
+            except OSError as inst:
+                self.errors[self.directory] = "Could not list %s: %s" %(self.directory, inst.strerror or inst)
+                return
+            self.errors.pop(self.directory, None)
+            for entry in entries:
+                try:
+                    if not entry.is_file() or entry.path in self.seen or entry.name.startswith('.'):
+                        continue
+                    stat = entry.stat()
+                except OSError: #removed or renamed since the listing; picked up again if it reappears
+                    self.pending.pop(entry.path, None)
+                    continue
+                signature = (stat.st_size, stat.st_mtime)
+                previous, unchanged = self.pending.get(entry.path, (None, 0))
+                unchanged = unchanged + 1 if signature == previous and stat.st_size > 0 else 0
+                if unchanged >= self.settle:
+                    del self.pending[entry.path]
+                    self.seen.add(entry.path)
+                    self.ingest(entry.path)
+                else:
+                    self.pending[entry.path] = (signature, unchanged)
+        finally:
+            if self.running:
+                self.afterId = self.app.after(self.interval, self.poll)
+
+    def name(self, filename):
+        #@return the file's name without its extension, numbered if a spectrum already has it (e.g. run.csv & run.txt, or
+        #a file which reuses the name of one renamed away), so that no spectrum is replaced
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        name, number = stem, 1
+        while name in self.app.spectra:
+            number += 1
+            name = "%s (%i)" %(stem, number)
+        return name
+
+    def ingest(self, filename):
+        spectrum = None
+        try:
+            self.app.load(filename, VendorReaders.filetype(filename) or 'csv')
+            if self.x and self.y:
+                spectrum = self.app.make_spectrum(self.name(filename), self.app.dfs[filename], self.x, self.y, source=filename)
+                if self.plot in self.app.plots:
+                    fig = self.app.plots[self.plot]
+                    self.app.graph(fig.axes[self.axis], spectrum)
+                    fig.canvas.draw_idle()
+        except (UnsupportedFileTypeException, NoPathNameException, BadAxisSymmetryException) as inst:
+            self.errors[filename] = inst.message
+        except KeyError as missing: #the configured columns are not in the file
+            self.errors[filename] = "Column %s not found" %missing
+        except ValueError: #the file or the configured columns are not numeric
+            self.errors[filename] = "Could not read numeric data from " + filename
+        except OSError as inst: #e.g. permission denied, or the file was removed after it settled
+            self.errors[filename] = "Could not read %s: %s" %(filename, inst.strerror or inst)
+        if self.onIngest is not None:
+            self.onIngest(filename, spectrum)
+
+#==========================================================================================================================================================================================
+class ProjectFile:
+    #Saves & restores a whole session (files, spectra, plots & trace styles) as a single zip archive, holding a json manifest
+    #and one compressed .npy member per array. Members are named by content hash, so data shared by several spectra
+    #(duplicates, copy-on-write results) is stored once. Spectra are restored lazily: their arrays are only read from the
+    #archive when they are first needed
+    FORMAT_VERSION = 1
+    EXTENSION = ".spectacular"
+    archives = {} #the open project files, by path, which lazily restored spectra & evicted files are read from
+
+    @classmethod
+    def archive(cls, path):
+        if path not in cls.archives:
+            cls.archives[path] = zipfile.ZipFile(path)
+        return cls.archives[path]
+
+    @classmethod
+    def close(cls, path):
+        archive = cls.archives.pop(path, None)
+        if archive is not None:
+            archive.close()
+
+    @classmethod
+    def save(cls, app, filename):
+        #the project is written to a temporary file beside the target, which then replaces it, so saving over the project
+        #the session was opened from neither truncates the data still to be read from it, nor loses it if saving fails
+        path = os.path.realpath(filename)
+        handle, temporary = tempfile.mkstemp(suffix=cls.EXTENSION, dir=os.path.dirname(path))
+        os.close(handle)
+        try:
+            if os.path.exists(path): #mkstemp makes the file private to the user, so give it the mode the file would have had
+                os.chmod(temporary, os.stat(path).st_mode & 0o777)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(temporary, 0o666 & ~umask)
+            cls.write(app, temporary)
+            for stored in list(StoredCowArray.unread): #e.g. spectra kept only by a lazy operation
+                if stored.path == path:
+                    stored.base
+            cls.close(path) #evicted files are read again from the new file, which holds the same members
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    @classmethod
+    def write(cls, app, filename):
+        import matplotlib.colors as mcolors
+        manifest = {'version':cls.FORMAT_VERSION, 'files':{}, 'spectra':{}, 'plots':{}}
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            written = set()
+            for name, df in app.dfs.items():
+                manifest['files'][name] = {'columns':[str(column) for column in df.columns],
+                                           'members':[cls.writeArray(archive, written, df[column].to_numpy()) for column in df.columns]}
+
+            for name, spectrum in app.spectra.items():
+                index = spectrum.index
+                manifest['spectra'][name] = {'xname':str(spectrum.xname), 'yname':str(spectrum.yname), 'length':len(spectrum.x),
+                                             'x':cls.writeArray(archive, written, spectrum.x.array, spectrum.x.digest),
+                                             'y':cls.writeArray(archive, written, spectrum.y.array, spectrum.y.digest),
+                                             'index':[index.start, index.stop, index.step] if isinstance(index, pd.RangeIndex) else cls.writeArray(archive, written, index.to_numpy()),
+                                             'source':app.index.source(name), 'op':app.index.op(name), 'tags':sorted(app.index.tags(name))}
+
+            for name, fig in app.plots.items():
+                axes = []
+                for ax in fig.axes:
+                    traces = [{'label':line.get_label(), 'color':mcolors.to_hex(line.get_color()), 'linewidth':line.get_linewidth(), 'linestyle':line.get_linestyle(),
+                               'marker':line.get_marker(), 'markersize':line.get_markersize(),
+                               'x':cls.writeArray(archive, written, np.asarray(line.get_xdata(), dtype=float)),
+                               'y':cls.writeArray(archive, written, np.asarray(line.get_ydata(), dtype=float))} for line in ax.lines]
+                    axes.append({'title':ax.get_title(), 'xlabel':ax.get_xlabel(), 'ylabel':ax.get_ylabel(),
+                                 'xlim':list(ax.get_xlim()), 'ylim':list(ax.get_ylim()), 'legend':ax.get_legend() is not None, 'traces':traces})
+                manifest['plots'][name] = {'axes':axes}
+
+            archive.writestr('manifest.json', json.dumps(manifest))
+
+    @classmethod
+    def writeArray(cls, archive, written, array, digest=None):
+        #write an array as an .npy member, unless the same content has already been written. @return the member name
+        if array.dtype == object:
+            array = array.astype(str)
+        if digest is None:
+            digest = CowArray.contentDigest(array)
+        member = "arrays/" + digest + ".npy"
+        if member not in written:
+            with archive.open(member, 'w') as stream:
+                np.save(stream, array, allow_pickle=False)
+            written.add(member)
+        return member
+
+    @classmethod
+    def readArray(cls, archive, member):
+        with archive.open(member) as stream:
+            return np.load(stream, allow_pickle=False)
+
+    @classmethod
+    def open(cls, app, filename):
+        #@return the names of the restored (files, spectra, plots)
+        import matplotlib
+        path = os.path.realpath(filename)
+        archive = cls.archive(path) #stays open, for the spectra to read their arrays from later
+        try:
+            manifest = json.loads(archive.read('manifest.json'))
+        except KeyError:
+            cls.close(path)
+            raise
+
+        for name, entry in manifest['files'].items():
+            read = lambda entry=entry:pd.DataFrame({column:cls.readArray(cls.archive(path), member) for column, member in zip(entry['columns'], entry['members'])})
+            app.dfs.add(name, read(), reload=read) #an evicted file is read again from the project file
+
+        for name, entry in manifest['spectra'].items():
+            spectrum = Spectrum.__new__(Spectrum)
+            spectrum.name = name
+            spectrum.xname = entry['xname']
+            spectrum.yname = entry['yname']
+            spectrum.x = StoredCowArray(path, entry['x'], entry['length'])
+            spectrum.y = StoredCowArray(path, entry['y'], entry['length'], Spectrum.dtype)
+            if isinstance(entry['index'], list):
+                spectrum.index = pd.RangeIndex(*entry['index'])
+            else:
+                spectrum.index = pd.Index(cls.readArray(archive, entry['index']))
+            app.spectra[name] = spectrum
+            app.index.add(spectrum, entry.get('source'), entry.get('op'), entry.get('tags', ()))
+
+        for name, entry in manifest['plots'].items():
+            if name in app.plots:
+                app.delete_plot(name)
+            app.make_plot(name, len(entry['axes']))
+            for ax, axisEntry in zip(app.plots[name].axes, entry['axes']):
+                for trace in axisEntry['traces']:
+                    ax.plot(cls.readArray(archive, trace['x']), cls.readArray(archive, trace['y']), label=trace['label'],
+                            color=trace['color'], linewidth=trace['linewidth'], linestyle=trace['linestyle'],
+                            marker=trace.get('marker', 'None'), markersize=trace.get('markersize', matplotlib.rcParams['lines.markersize']))
+                ax.set(title=axisEntry['title'], xlabel=axisEntry['xlabel'], ylabel=axisEntry['ylabel'],
+                       xlim=axisEntry['xlim'], ylim=axisEntry['ylim'])
+                if axisEntry['legend']:
+                    ax.legend().set_draggable(True)
+
+        return (list(manifest['files']), list(manifest['spectra']), list(manifest['plots']))
+
+#==========================================================================================================================================================================================
+class SpectrumExporter:
+    #Writes many spectra at once, to csv, parquet or npz files, either as a wide matrix (one column per spectrum on their
+    #shared x axis) or in long format (one row per point: spectrum name, x, y). Rows are written in chunks through a
+    #buffered stream, so no file is ever held in memory as text. Each export returns its throughput
+    FORMATS = ('csv', 'parquet', 'npz')
+    LAYOUTS = ('wide', 'long')
+    CHUNK_ROWS = 65536
+    BUFFER_SIZE = 1 << 20
+
+    @classmethod
+    def export(cls, spectra, filename, layout='wide', fmt='csv'):
+        #@return a dict of the number of spectra & bytes written, the time taken and the throughput in MB/s
+        start = time.perf_counter()
+        getattr(cls, "write_%s_%s" %(layout, fmt))(spectra, filename)
+        return cls.throughput(len(spectra), os.path.getsize(filename), time.perf_counter() - start)
+
+    @classmethod
+    def export_each(cls, spectra, directory, fmt='csv', workers=4):
+        #write one file per spectrum, named after the spectrum, using a pool of writer threads
+        start = time.perf_counter()
+        filenames = [os.path.join(directory, name) for name in cls.filenames([spectrum.name for spectrum in spectra], fmt)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(lambda job:getattr(cls, "write_wide_" + fmt)([job[0]], job[1]), zip(spectra, filenames)))
+        return cls.throughput(len(spectra), sum(os.path.getsize(filename) for filename in filenames), time.perf_counter() - start)
+
+    @staticmethod
+    def filenames(names, fmt):
+        #@return a file name for each spectrum name which is safe on any platform & stays inside the directory: path
+        #separators & reserved characters are replaced, as are reserved Windows names. Names which then collide (ignoring
+        #case, for case-insensitive file systems) are numbered
+        filenames, taken = [], set()
+        for name in names:
+            name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", str(name)).strip().rstrip(".") or "_"
+            if re.fullmatch(r"(CON|PRN|AUX|NUL|COM\d|LPT\d)(\..*)?", name, re.IGNORECASE):
+                name = "_" + name
+            filename, number = name + "." + fmt, 1
+            while filename.lower() in taken:
+                number += 1
+                filename = "%s (%i).%s" %(name, number, fmt)
+            taken.add(filename.lower())
+            filenames.append(filename)
+        return filenames
+
+    @staticmethod
+    def throughput(count, nbytes, seconds):
+        return {'spectra':count, 'bytes':nbytes, 'seconds':seconds, 'MBps':nbytes/1e6/seconds if seconds else float('inf')}
+
+    @classmethod
+    def wide_matrix(cls, spectra):
+        #@return (x, names, matrix) where column i of the matrix is the y data of spectra[i]
+        x = spectra[0].x.array
+        if not all(np.array_equal(spectrum.x.array, x, equal_nan=True) for spectrum in spectra):
+            raise BadAxisSymmetryException
+        return x, [spectrum.name for spectrum in spectra], np.column_stack([spectrum.y.array for spectrum in spectra])
+
+    @classmethod
+    def long_chunks(cls, spectra):
+        #yield the long format table as DataFrames of at most CHUNK_ROWS rows
+        for spectrum in spectra:
+            for start in range(0, len(spectrum.x), cls.CHUNK_ROWS):
+                stop = start + cls.CHUNK_ROWS
+                yield pd.DataFrame({'spectrum':spectrum.name, 'x':spectrum.x.array[start:stop], 'y':spectrum.y.array[start:stop]})
+
+    @classmethod
+    def wide_chunks(cls, spectra):
+        x, names, matrix = cls.wide_matrix(spectra)
+        xname = str(spectra[0].xname)
+        for start in range(0, x.size, cls.CHUNK_ROWS):
+            stop = start + cls.CHUNK_ROWS
+            chunk = pd.DataFrame(matrix[start:stop], columns=names)
+            chunk.insert(0, xname if xname not in names else 'x', x[start:stop])
+            yield chunk
+
+    @classmethod
+    def write_csv(cls, chunks, filename):
+        with open(filename, 'w', buffering=cls.BUFFER_SIZE, newline='') as stream:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(stream, header=(i == 0), index=False)
+
+    @classmethod
+    def write_parquet(cls, chunks, filename):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise MissingDependencyException("pyarrow", "Parquet export")
+        writer = None
+        try:
+            for chunk in chunks: #each chunk becomes a row group
+                table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(filename, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    @classmethod
+    def write_wide_csv(cls, spectra, filename):
+        cls.write_csv(cls.wide_chunks(spectra), filename)
+
+    @classmethod
+    def write_long_csv(cls, spectra, filename):
+        cls.write_csv(cls.long_chunks(spectra), filename)
+
+    @classmethod
+    def write_wide_parquet(cls, spectra, filename):
+        cls.write_parquet(cls.wide_chunks(spectra), filename)
+
+    @classmethod
+    def write_long_parquet(cls, spectra, filename):
+        cls.write_parquet(cls.long_chunks(spectra), filename)
+
+    @classmethod
+    def write_wide_npz(cls, spectra, filename):
+        x, names, matrix = cls.wide_matrix(spectra)
+        with open(filename, 'wb', buffering=cls.BUFFER_SIZE) as stream:
+            np.savez(stream, x=x, y=matrix.T, names=np.array(names, dtype=str))
+
+    @classmethod
+    def write_long_npz(cls, spectra, filename):
+        #the spectra are concatenated; spectrum i is x[offsets[i]:offsets[i+1]], y[offsets[i]:offsets[i+1]]
+        offsets = np.cumsum([0] + [len(spectrum.x) for spectrum in spectra])
+        with open(filename, 'wb', buffering=cls.BUFFER_SIZE) as stream:
+            np.savez(stream, x=np.concatenate([spectrum.x.array for spectrum in spectra]),
+                             y=np.concatenate([spectrum.y.array for spectrum in spectra]),
+                             offsets=offsets, names=np.array([spectrum.name for spectrum in spectra], dtype=str))
+
+#==========================================================================================================================================================================================
+class Profiler:
+    #Records call counts, wall times and memory allocated on the app's hot paths. The hot paths are instrumented by
+    #replacing them with timing wrappers when profiling is enabled, and the original methods are put back when it is
+    #disabled, so profiling costs nothing while it is off. Other code can be timed with the measure context manager
+    HOT_PATHS = ['App.load', 'App.operation', 'App.make_spectrum', 'Spectrum.__init__', 'App.graph', 'FigureCanvasTkAgg.draw']
+    enabled = False
+    records = {} #name -> {'code':(file, line, function), 'calls', 'total', 'own', 'max', 'bytes', 'callers':{name:[calls, own, total]}}
+    originals = {} #name -> (class, attribute, original method or None if it was inherited)
+    stack = [] #[name, time spent in instrumented callees] of the calls in progress
+
+    @staticmethod
+    def owner(className):
+        #the matplotlib backend is only imported when it is first needed, so its canvas is not one of this module's globals
+        if className == 'FigureCanvasTkAgg':
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            return FigureCanvasTkAgg
+        return globals()[className]
+
+    @classmethod
+    def enable(cls, traceMemory=False):
+        if not cls.enabled:
+            for path in cls.HOT_PATHS:
+                className, attribute = path.split('.')
+                owner = cls.owner(className)
+                original = getattr(owner, attribute)
+                cls.originals[path] = (owner, attribute, owner.__dict__.get(attribute))
+                setattr(owner, attribute, cls.wrap(path, original))
+            cls.enabled = True
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not traceMemory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @classmethod
+    def disable(cls):
+        for path, (owner, attribute, original) in cls.originals.items():
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        cls.originals.clear()
+        cls.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @classmethod
+    def reset(cls):
+        cls.records.clear()
+
+    @classmethod
+    def wrap(cls, name, func):
+        code = func.__code__
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        def wrapper(*args, **kwargs):
+            with cls.timing(name, key):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    @classmethod
+    @contextmanager
+    def measure(cls, name):
+        #time a block of code. Does nothing while profiling is disabled
+        if not cls.enabled:
+            yield
+        else:
+            with cls.timing(name, ('~', 0, name)):
+                yield
+
+    @classmethod
+    @contextmanager
+    def timing(cls, name, key):
+        caller = cls.stack[-1][0] if cls.stack else None
+        cls.stack.append([name, 0.0])
+        memoryBefore = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[0] - memoryBefore if tracemalloc.is_tracing() else 0
+            own = elapsed - cls.stack.pop()[1]
+            if cls.stack:
+                cls.stack[-1][1] += elapsed
+            record = cls.records.setdefault(name, {'code':key, 'calls':0, 'total':0.0, 'own':0.0, 'max':0.0, 'bytes':0, 'callers':{}})
+            record['calls'] += 1
+            record['total'] += elapsed
+            record['own'] += own
+            record['max'] = max(record['max'], elapsed)
+            record['bytes'] += allocated
+            if caller is not None:
+                callerRecord = record['callers'].setdefault(caller, [0, 0.0, 0.0])
+                callerRecord[0] += 1
+                callerRecord[1] += own
+                callerRecord[2] += elapsed
+
+    @classmethod
+    def summary(cls):
+        #@return the records as a table, slowest first
+        lines = ["%-28s %8s %12s %12s %12s %14s" %("", "calls", "total (s)", "mean (ms)", "max (ms)", "net bytes")]
+        for name, record in sorted(cls.records.items(), key=lambda item:-item[1]['total']):
+            lines.append("%-28s %8i %12.4f %12.3f %12.3f %14i" %(name, record['calls'], record['total'], 1000*record['total']/record['calls'], 1000*record['max'], record['bytes']))
+        return "\n".join(lines)
+
+    @classmethod
+    def export_json(cls, filename):
+        with open(filename, 'w') as f:
+            json.dump({name:{key:value for key, value in record.items() if key != 'code'} for name, record in cls.records.items()}, f, indent=2)
+
+    @classmethod
+    def export_pstats(cls, filename):
+        #write the records in the marshalled format written by cProfile, so they can be read with pstats.Stats(filename)
+        stats = {}
+        for name, record in cls.records.items():
+            callers = {cls.records[caller]['code']:(calls, calls, own, total) for caller, (calls, own, total) in record['callers'].items()}
+            stats[record['code']] = (record['calls'], record['calls'], record['own'], record['total'], callers)
+        with open(filename, 'wb') as f:
+            marshal.dump(stats, f)
+
+#==========================================================================================================================================================================================
+class SpectrumServer:
+    #Headless service mode, so that other programs (e.g. a LIMS) can load files & run operations. The protocol is JSON lines
+    #over TCP: each request is one line, {"id":..., "method":..., "params":{...}}, answered by one line {"id":..., "ok":...,
+    #"result" or "error":..., "elapsed":seconds}. The requests of a connection are handled concurrently, so their responses
+    #can arrive out of order. Reading files & computing operations run on a pool of worker threads, so the event loop is
+    #never blocked, while the session's dictionaries are only changed on the event loop. At most `limit` requests run at a
+    #time, and requests beyond `queue` waiting ones are refused. Methods with many results (loading many files, mapping an
+    #operation over many spectra) stream a {"id":..., "partial":...} line for each result as soon as it is ready, before the
+    #final response. Arrays are sent as JSON lists, or as {"dtype":"<f8", "data":base64} if the "encoding" is "binary", and
+    #requests may use either form. See the do_ methods for the parameters of each method
+    OPERATIONS = {'add':SpectrumOperations, 'subtract':SpectrumOperations, 'multiply':SpectrumOperations, 'divide':SpectrumOperations,
+                  'to_transmittance':SpectrumOperations, 'to_absorption':SpectrumOperations,
+                  'zero':ParameterisedOperations, 'clip':ParameterisedOperations, 'mask':ParameterisedOperations,
+                  'crop':ParameterisedOperations, 'grinding_curve':ParameterisedOperations}
+    LINE_LIMIT = 2**28 #bytes in one request, which can hold large spectra
+    LATENCIES = 1000 #latencies kept for each method, for the percentiles
+
+    def __init__(self, session=None, host='127.0.0.1', port=8765, workers=4, limit=8, queue=64):
+        self.session = HeadlessApp() if session is None else session
+        self.host = host
+        self.port = port
+        self.pool = ThreadPoolExecutor(workers)
+        self.limit = limit
+        self.queue = queue
+        self.semaphore = None #made on the event loop, by start
+        self.server = None
+        self.waiting = 0
+        self.running = 0
+        self.refused = 0
+        self.latencies = {} #method -> deque of recent latencies in seconds
+        self.counts = {} #method -> [requests, errors]
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.limit)
+        self.server = await asyncio.start_server(self.connection, self.host, self.port, limit=self.LINE_LIMIT)
+        self.port = self.server.sockets[0].getsockname()[1] #the port chosen by the system, if port 0 was asked for
+        return self.server
+
+    def serve_forever(self):
+        async def serve():
+            await self.start()
+            print("%s serving on %s:%i" %(SOFTWARE_NAME, self.host, self.port))
+            async with self.server:
+                await self.server.serve_forever()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.pool.shutdown()
+
+    async def connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        async def send(message):
+            async with lock:
+                if not writer.is_closing():
+                    writer.write(json.dumps(message).encode() + b"\n")
+                    try:
+                        await writer.drain()
+                    except ConnectionError: #the client has gone
+                        pass
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.request(line, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError): #ValueError if a request is longer than LINE_LIMIT
+            pass
+        finally:
+            await asyncio.gather(*tasks)
+            writer.close()
+
+    async def request(self, line, send):
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+            requestId, method, params = request.get('id'), request['method'], request.get('params', {})
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return await send({'id':None, 'ok':False, 'error':"Requests must be JSON objects with a method."})
+        handler = getattr(self, 'do_' + method, None) if isinstance(method, str) else None
+        if handler is None:
+            return await send({'id':requestId, 'ok':False, 'error':"Unknown method %r." %method})
+        if self.waiting >= self.queue:
+            self.refused += 1
+            return await send({'id':requestId, 'ok':False, 'error':"The server is busy."})
+        self.waiting += 1
+        async with self.semaphore:
+            self.waiting -= 1
+            self.running += 1
+            try:
+                response = {'id':requestId, 'ok':True, 'result':await handler(params, lambda partial:send({'id':requestId, 'partial':partial}))}
+            except Exception as inst: #reported to the client, whatever went wrong, so that the server keeps serving
+                response = {'id':requestId, 'ok':False, 'error':self.describe(inst)}
+            finally:
+                self.running -= 1
+        response['elapsed'] = time.perf_counter() - start
+        self.latencies.setdefault(method, deque(maxlen=self.LATENCIES)).append(response['elapsed'])
+        counts = self.counts.setdefault(method, [0, 0])
+        counts[0] += 1
+        counts[1] += not response['ok']
+        await send(response)
+
+    @staticmethod
+    def describe(inst):
+        #@return the message of an exception, for the client
+        return type(inst).__name__ + ":" + (getattr(inst, 'message', None) or " " + str(inst))
+
+    async def run(self, function, *args, **kwargs):
+        #call a function on a worker thread, without blocking the event loop
+        return await asyncio.get_running_loop().run_in_executor(self.pool, partial(function, *args, **kwargs))
+
+    async def stream(self, coroutines, send):
+        #send each result as a partial as soon as it is ready. A failed item is sent as {"error":...}, & the rest carry on
+        results = []
+        for future in asyncio.as_completed(coroutines):
+            try:
+                result = await future
+            except Exception as inst:
+                result = {'error':self.describe(inst)}
+            await send(result)
+            results.append(result)
+        return {'count':len(results), 'errors':sum('error' in result for result in results)}
+
+    @staticmethod
+    def encode(array, encoding=None):
+        if encoding == 'binary':
+            return {'dtype':'<f8', 'data':base64.b64encode(np.ascontiguousarray(array, dtype='<f8').tobytes()).decode('ascii')}
+        return np.asarray(array, dtype=float).tolist()
+
+    @staticmethod
+    def decode(value):
+        if isinstance(value, dict):
+            return np.frombuffer(base64.b64decode(value['data']), dtype=value.get('dtype', '<f8')).astype(float)
+        return np.asarray(value, dtype=float)
+
+    @classmethod
+    def from_arrays(cls, name, x, y, xname, yname):
+        #run on a worker thread. @return a Spectrum of the decoded arrays
+        return Spectrum(name, pd.DataFrame({xname:cls.decode(x), yname:cls.decode(y)}), xname, yname)
+
+    async def frame(self, name):
+        #@return a file's DataFrame. One which was evicted is loaded again on a worker thread, & put back in the store here,
+        #on the event loop, as the store is not thread safe
+        dfs = self.session.dfs
+        if not dfs.isResident(name):
+            df = await self.run(dfs.reloaders[name])
+            if name in dfs:
+                dfs.restore(name, df)
+        return dfs[name]
+
+    def summarise(self, spectrum, encoding=None):
+        #@return the spectrum's name, length & axis names, & its data if an encoding is given
+        summary = {'name':spectrum.name, 'points':len(spectrum.x), 'xname':str(spectrum.xname), 'yname':str(spectrum.yname)}
+        if encoding is not None:
+            summary['x'] = self.encode(spectrum.x.array, encoding)
+            summary['y'] = self.encode(spectrum.y.array, encoding)
+        return summary
+
+    @staticmethod
+    def compute(Class, operationName, operands, kwargs):
+        #run on a worker thread. @return the result of the operation, as a Spectrum with no name
+        if not all(operand.xdata.equals(operands[0].xdata) for operand in operands):
+            raise BadAxisSymmetryException
+        result = getattr(Class, operationName)(*operands, **kwargs)
+        return result if isinstance(result, Spectrum) else Spectrum.from_frame(None, result)
+
+    async def apply(self, operationName, name, operandNames, kwargs):
+        if operationName not in self.OPERATIONS:
+            raise ValueError("Unknown operation %r." %operationName)
+        operands = [self.session.spectra[operandName] for operandName in operandNames]
+        if 'mineral' in kwargs:
+            kwargs = dict(kwargs, mineral=Minerals[kwargs['mineral']])
+        result = await self.run(self.compute, self.OPERATIONS[operationName], operationName, operands, kwargs)
+        return self.session.add_spectrum(result.derive(name), self.session.index.source(operandNames[0]),
+                                         "%s(%s)" %(operationName, ", ".join(operandNames)))
+
+    async def do_load(self, params, send):
+        #{"path" (or "paths"), "filetype":"csv", "delimiter"} -> the file's name (its path), columns & rows. Many paths are
+        #loaded in parallel, & each file's result is streamed
+        filetype, delimiter = params.get('filetype', 'csv'), params.get('delimiter')
+        async def load(path):
+            df = await self.run(self.session.read, path, filetype, delimiter)
+            self.session.dfs.add(path, df, reload=partial(self.session.read, path, filetype, delimiter))
+            return {'name':path, 'columns':[str(column) for column in df.columns], 'rows':len(df)}
+        if 'paths' in params:
+            return await self.stream([load(path) for path in params['paths']], send)
+        return await load(params['path'])
+
+    async def do_spectrum(self, params, send):
+        #{"name", & either "file" with the names of its "x" & "y" columns, or "x" & "y" arrays} -> the new spectrum's summary
+        if 'file' in params:
+            spectrum = await self.run(Spectrum, params['name'], await self.frame(params['file']), params['x'], params['y'])
+            return self.summarise(self.session.add_spectrum(spectrum, source=params['file']))
+        spectrum = await self.run(self.from_arrays, params['name'], params['x'], params['y'], params.get('xname', 'x'), params.get('yname', 'y'))
+        return self.summarise(self.session.add_spectrum(spectrum))
+
+    async def do_get(self, params, send):
+        #{"name", "encoding":"json" or "binary"} -> the spectrum's summary & data
+        return self.summarise(self.session.spectra[params['name']], params.get('encoding', 'json'))
+
+    async def do_list(self, params, send):
+        #{} -> the names of the files & spectra
+        return {'files':list(self.session.dfs), 'spectra':list(self.session.spectra)}
+
+    async def do_delete(self, params, send):
+        #{"names":[spectrum names]} -> the number deleted
+        for name in params['names']:
+            self.session.delete_spectrum(name)
+        return len(params['names'])
+
+    async def do_operation(self, params, send):
+        #{"operation", "name", "operands":[spectrum names], "kwargs":{}, "encoding"} -> the result's summary, & its data if
+        #an encoding is given
+        result = await self.apply(params['operation'], params['name'], params['operands'], params.get('kwargs', {}))
+        return self.summarise(result, params.get('encoding'))
+
+    async def do_grinding_curve(self, params, send):
+        #{"name", "spectra":[spectrum names], "mineral":"CALCITE", "encoding"} -> the curve's summary, & its data if an encoding is given
+        return await self.do_operation({'operation':'grinding_curve', 'name':params['name'], 'operands':params['spectra'],
+                                        'kwargs':{'mineral':params.get('mineral', 'CALCITE')}, 'encoding':params.get('encoding')}, send)
+
+    async def do_map(self, params, send):
+        #{"operation", "spectra":[spectrum names], "suffix", "kwargs":{}, "encoding"}: apply a one-operand operation to each
+        #spectrum in parallel. Each result is named after its operand plus the suffix, and streamed as soon as it is ready
+        suffix, kwargs, encoding = params.get('suffix', " " + params['operation']), params.get('kwargs', {}), params.get('encoding')
+        async def apply(operandName):
+            return self.summarise(await self.apply(params['operation'], operandName + suffix, [operandName], kwargs), encoding)
+        return await self.stream([apply(operandName) for operandName in params['spectra']], send)
+
+    async def do_metrics(self, params, send):
+        #{} -> the requests running, waiting & refused, & the count, errors & latency percentiles (ms) of each method
+        methods = {}
+        for method, latencies in self.latencies.items():
+            milliseconds = 1000*np.asarray(latencies)
+            methods[method] = {'requests':self.counts[method][0], 'errors':self.counts[method][1], 'mean':milliseconds.mean(),
+                               **{'p%i' %q:np.percentile(milliseconds, q) for q in (50, 95, 99)}, 'max':milliseconds.max()}
+        return {'running':self.running, 'waiting':self.waiting, 'refused':self.refused, 'methods':methods}
+
+#==========================================================================================================================================================================================
+class SpectrumClient:
+    #A blocking client of the SpectrumServer, for scripts & testing. call returns a request's result; stream yields its
+    #partial results as they arrive. A failed request raises ServiceException
+    def __init__(self, host='127.0.0.1', port=8765, timeout=None):
+        self.socket = socket.create_connection((host, port), timeout)
+        self.file = self.socket.makefile('rwb')
+        self.ids = itertools.count(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def messages(self, method, params):
+        #send a request & yield the messages which answer it, up to the final response
+        requestId = next(self.ids)
+        self.file.write(json.dumps({'id':requestId, 'method':method, 'params':params}).encode() + b"\n")
+        self.file.flush()
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ServiceException("The server closed the connection.")
+            message = json.loads(line)
+            if message.get('id') == requestId or message.get('id') is None:
+                yield message
+                if 'ok' in message:
+                    return
+
+    def stream(self, method, **params):
+        for message in self.messages(method, params):
+            if 'partial' in message:
+                yield message['partial']
+            elif not message['ok']:
+                raise ServiceException(message['error'])
+
+    def call(self, method, **params):
+        for message in self.messages(method, params):
+            if 'ok' in message:
+                if not message['ok']:
+                    raise ServiceException(message['error'])
+                return message['result']
+
 #==========================================================================================================================================================================================
 class AppPage(tk.Frame):
     HOMEPAGE_TEXT = "Back to Home"
@@ -228,6 +2681,13 @@ class AppPage(tk.Frame):
     def makeNavigationButtons(self):
         pass
 
+    @staticmethod
+    def refreshCombobox(combobox, values):
+        #change a combobox's list, keeping its selection unless the selected item is gone
+        combobox.configure(values=values)
+        if combobox.get() and combobox.get() not in values:
+            combobox.set('')
+
 #==========================================================================================================================================================================================
 class HomePage(AppPage): #### The homepage of the application
     def __init__(self, parent, controller):
@@ -243,10 +2703,26 @@ class HomePage(AppPage): #### The homepage of the application
         loadCSVButton = ttk.Button(self.widgetFrame, text="Load delimited file", command=self.loadDelimited)
         loadCSVButton.grid(row=0, column=0, sticky='ew')
 
-        loadFWFButton = ttk.Button(self.widgetFrame, text="Load Fixed Width", command=lambda:1+1)
+        loadFWFButton = ttk.Button(self.widgetFrame, text="Load Fixed Width", command=self.loadFixedWidth)
+        loadFWFButton.grid(row=1, column=0, sticky='ew')
+
+        loadInstrumentButton = ttk.Button(self.widgetFrame, text="Load Instrument File", command=self.loadInstrumentFile)
+        loadInstrumentButton.grid(row=2, column=0, sticky='ew')
         
         makeSpectrumPageButton = ttk.Button(self.widgetFrame, text=AppPage.MAKESPECTRUMPAGE_TEXT, command=lambda:self.controller.show_frame(MakeSpectrumPage))
-        makeSpectrumPageButton.grid(row=2, column=0, sticky='ew')
+        makeSpectrumPageButton.grid(row=3, column=0, sticky='ew')
+
+        saveProjectButton = ttk.Button(self.widgetFrame, text="Save Project", command=self.saveProject)
+        saveProjectButton.grid(row=4, column=0, sticky='ew')
+
+        openProjectButton = ttk.Button(self.widgetFrame, text="Open Project", command=self.openProject)
+        openProjectButton.grid(row=5, column=0, sticky='ew')
+
+        watchButton = ttk.Button(self.widgetFrame, text="Watch Folder", command=lambda:WatchDirectoryPopup(self))
+        watchButton.grid(row=6, column=0, sticky='ew')
+
+        diagnosticsButton = ttk.Button(self.widgetFrame, text="Diagnostics", command=lambda:DiagnosticsPopup(self))
+        diagnosticsButton.grid(row=7, column=0, sticky='ew')
 
     def makeNavigationButtons(self):
         tutorialButton = ttk.Button(self.navigationTray, text="Tutorial", command=lambda:self.controller.show_frame(TutorialPage))
@@ -269,6 +2745,61 @@ class HomePage(AppPage): #### The homepage of the application
         finally:
             self.after(5000, lambda:self.alertBox.configure(text=""))
 
+    def loadFixedWidth(self):
+        try:
+            self.controller.load(askopenfilename(), 'fwf')
+            self.alertBox.configure(text="File loaded successfully")
+
+        except (NoPathNameException, UnsupportedFileTypeException) as inst:
+            self.alertBox.configure(text=inst.message)
+
+        finally:
+            self.after(5000, lambda:self.alertBox.configure(text=""))
+
+    def loadInstrumentFile(self):
+        #load a Bruker OPUS, Thermo SPC or JCAMP-DX file, recognised by its extension
+        try:
+            filename = askopenfilename(filetypes=[("Instrument files", "*.0 *.1 *.2 *.3 *.spc *.jdx *.dx *.jcamp"), ("All files", "*")])
+            filetype = VendorReaders.filetype(filename)
+            if filetype is None:
+                raise UnsupportedFileTypeException(filename)
+            self.controller.load(filename, filetype)
+            self.alertBox.configure(text="File loaded successfully")
+
+        except (NoPathNameException, UnsupportedFileTypeException) as inst:
+            self.alertBox.configure(text=inst.message)
+
+        finally:
+            self.after(5000, lambda:self.alertBox.configure(text=""))
+
+    def fileWatched(self, filename, spectrum):
+        #called by a DirectoryWatcher when it has loaded a new file
+        if filename in self.controller.dfs:
+            self.alertBox.configure(text="Loaded " + filename + ("" if spectrum is None else " as " + spectrum.name))
+        else:
+            self.alertBox.configure(text="Could not load " + filename)
+        self.after(5000, lambda:self.alertBox.configure(text=""))
+
+    def saveProject(self):
+        filename = asksaveasfilename(defaultextension=ProjectFile.EXTENSION, filetypes=[("Spectacular project", "*" + ProjectFile.EXTENSION)])
+        if filename:
+            self.controller.save_project(filename)
+            self.alertBox.configure(text="Project saved to " + filename)
+            self.after(5000, lambda:self.alertBox.configure(text=""))
+
+    def openProject(self):
+        try:
+            files, spectra, plots = self.controller.open_project(askopenfilename(filetypes=[("Spectacular project", "*" + ProjectFile.EXTENSION)]))
+            if plots:
+                self.controller.page(GraphPage).showFigure(self.controller.plots[plots[0]])
+            self.alertBox.configure(text="Opened %i files, %i spectra and %i plots" %(len(files), len(spectra), len(plots)))
+
+        except (NoPathNameException, UnsupportedFileTypeException) as inst:
+            self.alertBox.configure(text=inst.message)
+
+        finally:
+            self.after(5000, lambda:self.alertBox.configure(text=""))
+
 #=================================================================================================================================================
 class MakeSpectrumPage(AppPage):
 ###Page which allows the user to make a new Spectrum object from one of the loaded files.
@@ -282,6 +2813,8 @@ class MakeSpectrumPage(AppPage):
         self.yVar = tk.StringVar()
 
         super().__init__(parent, controller)
+        self.controller.subscribe(self.insertItems, 'files')
+        self.insertItems() #pages are built on first use, when there may already be files
 
         self.filenameVar.trace('w', self.filenameSelected)
         self.nameVar.trace('w', self.activateCreate)
@@ -348,9 +2881,9 @@ class MakeSpectrumPage(AppPage):
         graphPageButton = ttk.Button(self.navigationTray, text=AppPage.GRAPHPAGE_TEXT, command=lambda: self.controller.show_frame(GraphPage))
         graphPageButton.grid(row=3, column=0, padx=10, sticky='nsew')
 
-    def insertItems(self):
+    def insertItems(self, changed=('files',)):
         #Populate the file list with keys from the App's file/dataframe dictionary
-        self.fileCombobox.configure(values=list(self.controller.dfs.keys()))
+        AppPage.refreshCombobox(self.fileCombobox, list(self.controller.dfs.keys()))
 
     def filenameSelected(self, *args):
         if self.filenameVar.get():
@@ -374,7 +2907,7 @@ class MakeSpectrumPage(AppPage):
     def makeSpectrum(self):
         #make a Spectrum object
         try:
-            self.controller.make_spectrum(self.nameVar.get(), self.controller.dfs[self.filenameVar.get()], self.xVar.get(), self.yVar.get())
+            self.controller.make_spectrum(self.nameVar.get(), self.controller.dfs[self.filenameVar.get()], self.xVar.get(), self.yVar.get(), source=self.filenameVar.get())
             self.alertBox.config(text="Spectrum added to list.")
 
         except KeyError:
@@ -389,11 +2922,15 @@ class SpectraPage(AppPage):
     def __init__(self, parent, controller):
         self.spectrumVar = tk.StringVar()
         self.dfVar = tk.StringVar()
+        self.lazyVar = tk.BooleanVar()
 
         super().__init__(parent, controller)
+        self.controller.subscribe(self.insertItems, 'spectra', 'files')
+        self.insertItems() #pages are built on first use, when there may already be files & spectra
         
         self.spectrumVar.trace('w', self.updateTableViewer)
         self.dfVar.trace('w', self.updateTableViewer)
+        self.lazyVar.trace('w', lambda *args:setattr(self.controller, 'lazy', self.lazyVar.get()))
 
         self.pageLabel.configure(text="Spectra Page")
 
@@ -413,6 +2950,8 @@ class SpectraPage(AppPage):
         spectraLabel.grid(row=1, column=0, sticky='ew', padx=3, pady=10)
         self.spectraCombobox = ttk.Combobox(spectraTray, state='readonly', textvariable=self.spectrumVar)
         self.spectraCombobox.grid(row=2, column=0, columnspan=2, sticky='ew', padx=3, pady=10)
+        self.spectraSearch = SpectrumSearchEntry(spectraTray, self.controller, self.spectraCombobox)
+        self.spectraSearch.grid(row=1, column=1, sticky='e', padx=3, pady=10)
 
         #make the container for spectra buttons
         buttonTray = tk.Frame(spectraTray)
@@ -434,14 +2973,40 @@ class SpectraPage(AppPage):
         grindingCurveButton = ttk.Button(buttonTray, text="Grinding Curve", command=lambda:GrindingCurvePopup(self))
         grindingCurveButton.grid(row=1, column=1, sticky='nsew')
 
-        zeroButton = ttk.Button(buttonTray, text="Zero Spectrum", command=lambda:ZeroSpectrumPopup(self))
-        zeroButton.grid(row=2, column=1, sticky='nsew')
+        rangeButton = ttk.Button(buttonTray, text="Edit Range", command=lambda:RangeEditPopup(self))
+        rangeButton.grid(row=2, column=1, sticky='nsew')
+
+        smoothButton = ttk.Button(buttonTray, text="Smooth/Derivative", command=lambda:SmoothSpectraPopup(self))
+        smoothButton.grid(row=3, column=0, sticky='nsew')
+
+        exportButton = ttk.Button(buttonTray, text="Export Many", command=lambda:ExportSpectraPopup(self))
+        exportButton.grid(row=3, column=1, sticky='nsew')
+
+        tagButton = ttk.Button(buttonTray, text="Tags", command=lambda:TagSpectrumPopup(self))
+        tagButton.grid(row=4, column=0, sticky='nsew')
+
+        libraryButton = ttk.Button(buttonTray, text="Library Search", command=lambda:LibrarySearchPopup(self))
+        libraryButton.grid(row=4, column=1, sticky='nsew')
+
+        bandButton = ttk.Button(buttonTray, text="Band Ratios", command=lambda:BandRatioPopup(self))
+        bandButton.grid(row=5, column=0, sticky='nsew')
+
+        chemometricsButton = ttk.Button(buttonTray, text="PCA/PLS", command=lambda:ChemometricsPopup(self))
+        chemometricsButton.grid(row=5, column=1, sticky='nsew')
+
+        undoButton = ttk.Button(buttonTray, text="Undo", command=self.controller.undo)
+        undoButton.grid(row=6, column=0, sticky='nsew')
+        redoButton = ttk.Button(buttonTray, text="Redo", command=self.controller.redo)
+        redoButton.grid(row=6, column=1, sticky='nsew')
 
         #make df list
         tk.Label(spectraTray, text="Files").grid(row=4, column=0, sticky='ew', padx=3, pady=10)
         self.dfCombobox = ttk.Combobox(spectraTray, state='readonly', textvariable=self.dfVar)
         self.dfCombobox.grid(row=5, column=0, sticky='ew', columnspan=2, padx=3, pady=10)
 
+        lazyCheckbutton = ttk.Checkbutton(spectraTray, text="Lazy evaluation", variable=self.lazyVar)
+        lazyCheckbutton.grid(row=6, column=0, sticky='w', padx=3, pady=10)
+
         #make widget to view data
         tableViewerContainer = tk.Frame(self.widgetFrame)
         tableViewerContainer.grid(row=0, column=2, padx=10, pady=10, sticky='nsew')
@@ -471,19 +3036,23 @@ class SpectraPage(AppPage):
             self.dfCombobox.set('')
         self.tableViewer.configure(state='disabled')
 
-    def insertItems(self):
-        self.spectraCombobox.set('')
-        self.spectraCombobox.configure(values=list(self.controller.spectra.keys()))
-        self.dfCombobox.set('')
-        self.dfCombobox.configure(values=list(self.controller.dfs.keys()))
+    def insertItems(self, changed=('spectra', 'files')):
+        #only the lists whose dictionaries changed are rebuilt
+        if 'spectra' in changed:
+            self.spectraSearch.filter()
+        if 'files' in changed:
+            AppPage.refreshCombobox(self.dfCombobox, list(self.controller.dfs.keys()))
 
 #===================================================================================================================================
 class GraphPage(AppPage):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
         
-        self.controller.make_plot('Plot 1')
-        self.showFigure(self.controller.plots['Plot 1'])
+        if not self.controller.plots: #plots may have been made (e.g. by a PCA or a project) before the page was first shown
+            self.controller.setPlot('Plot 1', self.controller.new_figure('Plot 1')) #not an action, so not in the history
+            self.controller.notify('plots')
+        self.showFigure(next(iter(self.controller.plots.values())))
+        self.controller.subscribe(self.refreshFigure, 'plots')
         self.pageLabel.configure(text="Graph Page")
 
     def makeWidgets(self):
@@ -509,10 +3078,18 @@ class GraphPage(AppPage):
         modifyPlotButton.grid(row=2, column=1, sticky='nsew')
         showPlotButton = ttk.Button(self.graphTray, text="Show Plot", command=lambda:ShowPlotPopup(self))
         showPlotButton.grid(row=3, column=1, sticky='nsew')
+        mapViewerButton = ttk.Button(self.graphTray, text="Map Viewer", command=lambda:MapViewer(self))
+        mapViewerButton.grid(row=3, column=0, sticky='nsew')
+
+        undoButton = ttk.Button(self.graphTray, text="Undo", command=self.controller.undo)
+        undoButton.grid(row=5, column=0, sticky='nsew')
+        redoButton = ttk.Button(self.graphTray, text="Redo", command=self.controller.redo)
+        redoButton.grid(row=5, column=1, sticky='nsew')
 
         super().makeWidgets()
             
     def showFigure(self, fig):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
         if hasattr(self, 'toolbar_frame'):
             self.toolbar_frame.destroy()
 
@@ -531,6 +3108,15 @@ class GraphPage(AppPage):
         spectraPageButton = ttk.Button(self.navigationTray, text=AppPage.SPECTRAPAGE_TEXT, command=lambda:self.controller.show_frame(SpectraPage))
         spectraPageButton.grid(row=2, column=0, padx=10, sticky='nsew')
 
+    def refreshFigure(self, changed):
+        #redraw after plots were changed elsewhere, e.g. undone. If the figure shown is gone, show another
+        if any(fig is self.canvas.figure for fig in self.controller.plots.values()):
+            self.canvas.draw_idle()
+        elif self.controller.plots:
+            self.showFigure(next(iter(self.controller.plots.values())))
+        else:
+            self.canvas.get_tk_widget().delete('all')
+
     def updateLegend(self):
         for ax in self.canvas.figure.axes:
             ax.legend().set_draggable(True)
@@ -544,13 +3130,13 @@ class TutorialPage(AppPage):
 
         self.pageLabel.configure(text="Tutorial")
 
-        self.pages = [("Overview", open("overview.html", 'r').read()),
-                      ("Homepage", open("homepage.html", 'r').read()),
-                      ("Make Spectrum Page", open("makespectrumpage.html", 'r').read()),
-                      ("Spectra Page", open("spectrapage.html", 'r').read()),
-                      ("Graph Page", open("graphpage.html", 'r').read())
+        self.pages = [("Overview", "overview.html"),
+                      ("Homepage", "homepage.html"),
+                      ("Make Spectrum Page", "makespectrumpage.html"),
+                      ("Spectra Page", "spectrapage.html"),
+                      ("Graph Page", "graphpage.html")
                       ]
-        # list of two tuples containing the name of the page and the function call to open and read the html file for each page of the tutorial.
+        # list of two tuples containing the name of the page and the html file for each page of the tutorial, which is read when the page is shown.
 
         self.currentPage = 0 #send the landing page to be the overview
         self.displayPage() 
@@ -558,6 +3144,7 @@ class TutorialPage(AppPage):
     def makeWidgets(self):
         self.tutorialLabel = tk.Label(self.widgetFrame) #this label displays the name of the current page of the tutorial
         self.tutorialLabel.grid(row=0, column=0, padx=10, pady=10, sticky='nsew')
+        from tk_html_widgets import HTMLScrolledText
         self.tutorialText = HTMLScrolledText(self.widgetFrame, width=120, height=30) # this widget renders and displays the HTML text of the tutorial
         self.tutorialText.grid(row=1, column=0, padx=10, pady=10, sticky='nsew')
         
@@ -588,7 +3175,8 @@ class TutorialPage(AppPage):
             raise IndexError #avoid backward indexing
         self.tutorialLabel.configure(text=self.pages[self.currentPage][0])
         self.tutorialText.configure(state='normal')
-        self.tutorialText.set_html(self.pages[self.currentPage][1])
+        with open(self.pages[self.currentPage][1], 'r') as f:
+            self.tutorialText.set_html(f.read())
         self.tutorialText.configure(state='disabled')
 
     def previousPage(self):
@@ -612,14 +3200,326 @@ class TutorialPage(AppPage):
             self.nextButton.configure(state='disabled')
         
 #=======================================================================================================================================================================================================================
-class Spectrum: #Objects of this class are two-column structures.
-    def __init__(self, name, sourcedf, x, y):
-        self.xdata = sourcedf[x]
-        self.ydata = sourcedf[y]
-        self.df = pd.concat([self.xdata, self.ydata], axis=1)
-        self.name = name
-        if self.xdata.dropna().size != self.ydata.dropna().size:
-            raise BadAxisSymmetryException()
+class Spectrum: #Objects of this class are two-column structures.
+    #The data are held in read-only CowArrays, so spectra derived from one another can safely share memory.
+    #The y data is stored at the session's precision, dtype. float32 halves the memory & bandwidth of large stacks of
+    #spectra, while the x data stays float64, so axes still compare & index exactly. Reductions over y (means, integrals,
+    #variances) accumulate in float64 whatever the precision
+    PRECISIONS = ('float64', 'float32')
+    dtype = np.dtype('float64') #set for the session by App.set_precision
+
+    def __init__(self, name, sourcedf, x, y):
+        xdata = sourcedf[x]
+        ydata = sourcedf[y]
+        if xdata.count() != ydata.count(): #the number of points which are not NaN, counted without copying
+            raise BadAxisSymmetryException()
+        self.name = name
+        self.x = CowArray(xdata.to_numpy(dtype=float, copy=True)) #private copies, so the source file's DataFrame is never changed
+        self.y = CowArray(ydata.to_numpy(dtype=Spectrum.dtype, copy=True))
+        self.index = xdata.index
+        self.xname = xdata.name
+        self.yname = ydata.name
+
+    @classmethod
+    def from_arrays(cls, name, x, y, index=None, xname='x', yname='y'):
+        #Fast construction from arrays which are already valid, such as the results of operations. The arrays are not
+        #checked for NaNs or copied: they are made read-only and used as they are, so the caller must not keep writing to them
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=cls.dtype)
+        if x.shape != y.shape:
+            raise BadAxisSymmetryException()
+        spectrum = Spectrum.__new__(Spectrum)
+        spectrum.name = name
+        spectrum.x = CowArray(x)
+        spectrum.y = CowArray(y)
+        spectrum.index = pd.RangeIndex(x.size) if index is None else index
+        spectrum.xname = xname
+        spectrum.yname = yname
+        return spectrum
+
+    @classmethod
+    def from_frame(cls, name, df):
+        #Fast construction from a new two-column (x, y) DataFrame, such as an operation returns. The Spectrum uses the
+        #DataFrame's memory, so the DataFrame must not be edited afterwards
+        xname, yname = df.columns
+        return cls.from_arrays(name, df[xname].to_numpy(dtype=float, copy=False), df[yname].to_numpy(dtype=cls.dtype, copy=False), df.index, xname, yname)
+
+    def derive(self, name=None, x=None, y=None, index=None):
+        #make a new Spectrum which shares any data not given with this one
+        spectrum = Spectrum.__new__(Spectrum)
+        spectrum.name = self.name if name is None else name
+        spectrum.x = self.x if x is None else x
+        spectrum.y = self.y if y is None else y
+        spectrum.index = self.index if index is None else index
+        spectrum.xname = self.xname
+        spectrum.yname = self.yname
+        return spectrum
+
+    @classmethod
+    @contextmanager
+    def precision(cls, precision):
+        #store the y data of the spectra made inside at another precision, e.g. to compare the two
+        dtype, cls.dtype = cls.dtype, np.dtype(precision)
+        try:
+            yield
+        finally:
+            cls.dtype = dtype
+
+    @property
+    def xdata(self):
+        return pd.Series(self.x.array, index=self.index, name=self.xname, copy=False)
+
+    @property
+    def ydata(self):
+        return pd.Series(self.y.array, index=self.index, name=self.yname, copy=False)
+
+    @property
+    def df(self):
+        return pd.concat([self.xdata, self.ydata], axis=1)
+
+    def buffers(self): #the arrays which hold this spectrum's data
+        return self.x.buffers() + self.y.buffers() + ([] if isinstance(self.index, pd.RangeIndex) else [self.index.to_numpy()])
+
+#=======================================================================================================================================================================================================================
+class LazySpectrum(Spectrum):
+    #A Spectrum whose data is the result of a pending OperationNode. Nothing is computed until the y data is first read.
+    #The x data of element-wise operations is known without evaluating anything, so axis checks stay cheap
+    def __init__(self, name, node):
+        self.name = name
+        self.node = node
+
+    def derive(self, name=None, x=None, y=None, index=None):
+        if x is None and y is None and index is None: #a renamed copy can stay lazy
+            return LazySpectrum(self.name if name is None else name, self.node)
+        return super().derive(name, x, y, index)
+
+    @property
+    def x(self):
+        return self.node.x
+
+    @property
+    def y(self):
+        return self.node.evaluate().y
+
+    @property
+    def index(self):
+        return self.node.index
+
+    @property
+    def xname(self):
+        return self.node.xname
+
+    @property
+    def yname(self):
+        return self.node.yname
+
+    def buffers(self): #a pending spectrum holds no data
+        return [] if self.node.result is None else self.node.result.buffers()
+
+#=======================================================================================================================================================================================================================
+class OperationNode:
+    #A pending operation in a graph of lazy spectra. Chains of element-wise operations are fused: they are evaluated in
+    #a single buffer with in-place ufuncs, instead of allocating an intermediate result for every step.
+    #Evaluated nodes cache their result. The second last step of a fused chain is cached too, so that replacing only
+    #the last step of a chain reuses everything before it
+    KERNELS = {'add': lambda buffer, source, other: np.add(buffer, other, out=buffer),
+               'subtract': lambda buffer, source, other: np.subtract(buffer, other, out=buffer),
+               'multiply': lambda buffer, source, other: np.multiply(buffer, other, out=buffer),
+               'divide': lambda buffer, source, other: np.divide(buffer, other, out=buffer),
+               'to_transmittance': lambda buffer, source: np.multiply(np.power(10.0, np.negative(buffer, out=buffer), out=buffer), 100, out=buffer),
+               'to_absorption': lambda buffer, source: np.negative(np.log10(buffer, out=buffer), out=buffer),
+               'zero': lambda buffer, source, low=0, high=0: OperationNode.fillRange(buffer, source, low, high, 0),
+               'mask': lambda buffer, source, low=0, high=0: OperationNode.fillRange(buffer, source, low, high, np.nan),
+               'clip': lambda buffer, source, low=0, high=0, ymin=None, ymax=None: OperationNode.clipRange(buffer, source, low, high, ymin, ymax)}
+    #the kernels of element-wise operations, keyed by operation name. Each one edits the buffer in place
+
+    def __init__(self, Class, operationName, operands, kwargs):
+        self.Class = Class
+        self.operationName = operationName
+        self.operands = operands #Spectrum or LazySpectrum objects
+        self.kwargs = kwargs
+        self.result = None #the evaluated Spectrum
+
+    @staticmethod
+    def fillRange(buffer, source, low, high, value):
+        start, stop = ParameterisedOperations.wavenumber_range(source, low, high)
+        buffer[start:stop] = value
+
+    @staticmethod
+    def clipRange(buffer, source, low, high, ymin, ymax):
+        start, stop = ParameterisedOperations.wavenumber_range(source, low, high)
+        np.clip(buffer[start:stop], ymin, ymax, out=buffer[start:stop])
+
+    @property
+    def fusable(self):
+        return self.Class in (SpectrumOperations, ParameterisedOperations) and self.operationName in OperationNode.KERNELS
+
+    @property
+    def parent(self): #the pending node which this node's first operand is the result of
+        if isinstance(self.operands[0], LazySpectrum):
+            return self.operands[0].node
+
+    @property
+    def x(self): #element-wise operations keep the x data of their first operand
+        return self.operands[0].x if self.fusable else self.evaluate().x
+
+    @property
+    def index(self):
+        return self.operands[0].index if self.fusable else self.evaluate().index
+
+    @property
+    def xname(self):
+        return self.operands[0].xname if self.fusable else self.evaluate().xname
+
+    @property
+    def yname(self):
+        return self.operands[0].yname if self.fusable else self.evaluate().yname
+
+    def apply(self, buffer, source):
+        others = [operand.y.array for operand in self.operands[1:]]
+        OperationNode.KERNELS[self.operationName](buffer, source, *others, **self.kwargs)
+
+    def evaluate(self):
+        if self.result is None:
+            if not self.fusable:
+                result = getattr(self.Class, self.operationName)(*self.operands, **self.kwargs)
+                self.result = result if isinstance(result, Spectrum) else Spectrum.from_frame('', result)
+            else:
+                chain = [self] #the unevaluated element-wise steps leading to this node
+                while chain[-1].parent is not None and chain[-1].parent.result is None and chain[-1].parent.fusable:
+                    chain.append(chain[-1].parent)
+                chain.reverse()
+                source = chain[0].operands[0]
+                if isinstance(source, LazySpectrum):
+                    source = source.node.evaluate()
+
+                buffer = np.array(source.y.array, dtype=Spectrum.dtype) #the only allocation for all the fused steps
+                for node in chain[:-1]:
+                    node.apply(buffer, source)
+                if len(chain) > 1:
+                    chain[-2].result = source.derive(y=CowArray(buffer))
+                    buffer = buffer.copy()
+                self.apply(buffer, source)
+                self.result = source.derive(y=CowArray(buffer))
+        return self.result
+
+#=======================================================================================================================================================================================================================
+class CowArray:
+    #A read-only 1-D array which can be shared between spectra. Patching a range returns a new CowArray which shares
+    #the unpatched data with its source, and only holds the values of the patched ranges. Once the patched data is
+    #needed whole, it is materialised & replaces the base & patches, so the array no longer keeps the shared base alive
+    def __init__(self, base, patches=()):
+        base.setflags(write=False)
+        self.base = base
+        self.patches = tuple(patches) #((start, stop, values), ...), applied in order. values may be a scalar
+        self._array = None if self.patches else base
+        self._digest = None
+        self.owned = False #whether the base is this array's own materialised copy
+
+    def __len__(self):
+        return self.base.size
+
+    @property
+    def array(self): #the patched data, materialised the first time it is needed
+        if self._array is None:
+            array = self.base.copy()
+            for start, stop, values in self.patches:
+                array[start:stop] = values
+            array.setflags(write=False)
+            self.base, self.patches, self._array, self.owned = array, (), array, True
+        return self._array
+
+    @property
+    def digest(self): #a hash of the content, computed once since the array never changes
+        if self._digest is None:
+            self._digest = CowArray.contentDigest(self.array)
+        return self._digest
+
+    @staticmethod
+    def contentDigest(array):
+        array = np.ascontiguousarray(array)
+        return hashlib.blake2b(array.tobytes() + str(array.dtype).encode(), digest_size=16).hexdigest()
+
+    @property
+    def nbytes(self): #memory held privately by this array, i.e. not counting the shared base
+        if self.owned:
+            return self.base.nbytes
+        return sum(np.size(values) for (start, stop, values) in self.patches)*self.base.itemsize
+
+    def buffers(self): #the arrays which hold this array's data, some of which may be shared with other CowArrays
+        return [self.base] + [values for (start, stop, values) in self.patches if np.ndim(values)]
+
+    def patch(self, start, stop, values):
+        if np.ndim(values):
+            values = np.array(values, dtype=self.base.dtype)
+            values.setflags(write=False)
+        return CowArray(self.base, self.patches + ((start, stop, values),))
+
+    def astype(self, dtype, converted=None):
+        #@return this array stored as dtype, or itself if it already is
+        #@param converted a dict of the bases converted so far, so arrays which shared a base still share the converted one
+        if self.base.dtype == dtype:
+            return self
+        converted = {} if converted is None else converted
+        if id(self.base) not in converted:
+            converted[id(self.base)] = (self.base, self.base.astype(dtype)) #the base is kept, so its id is not reused
+        return CowArray(converted[id(self.base)][1], [(start, stop, values.astype(dtype) if np.ndim(values) else values) for start, stop, values in self.patches])
+
+    def slice(self, start, stop):
+        #a zero-copy view of [start:stop], keeping whichever patches overlap it
+        patches = []
+        for (pstart, pstop, values) in self.patches:
+            left, right = max(pstart, start), min(pstop, stop)
+            if left < right:
+                patches.append((left - start, right - start, values[left - pstart:right - pstart] if np.ndim(values) else values))
+        return CowArray(self.base[start:stop], patches)
+
+#=======================================================================================================================================================================================================================
+class StoredCowArray(CowArray):
+    #A CowArray whose data stays in a project file until it is first needed. The member name is the content hash,
+    #so the digest is known without reading anything. The data is converted to dtype, if given, when it is read
+    unread = weakref.WeakSet() #the arrays not yet read, which must be read before their project file is overwritten
+
+    def __init__(self, path, member, length, dtype=None):
+        self.path = path #of the project file
+        self.member = member
+        self.length = length
+        self.dtype = dtype
+        self.patches = ()
+        self._base = None
+        self._digest = member.split('/')[-1].split('.')[0]
+        StoredCowArray.unread.add(self)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def base(self):
+        if self._base is None:
+            base = ProjectFile.readArray(ProjectFile.archive(self.path), self.member)
+            if self.dtype is not None and base.dtype != self.dtype: #the content, & so its hash, is no longer the member's
+                base = base.astype(self.dtype)
+                self._digest = None
+            base.setflags(write=False)
+            self._base = base
+            StoredCowArray.unread.discard(self)
+        return self._base
+
+    @property
+    def array(self):
+        return self.base
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def astype(self, dtype, converted=None): #stays unread
+        if self._base is not None:
+            return super().astype(dtype, converted)
+        return self if self.dtype == dtype else StoredCowArray(self.path, self.member, self.length, dtype)
+
+    def buffers(self): #nothing is held until the array has been read from the project file
+        return [] if self._base is None else [self._base]
 
 #=======================================================================================================================================================================================================================
 class ConditionalPopup(tk.Toplevel):
@@ -664,6 +3564,35 @@ class ConditionalPopup(tk.Toplevel):
     def okPressed(self, *args):
         self.destroy()
 
+#===========================================================================================================================================================================================================================
+class SpectrumSearchEntry(tk.Frame):
+    #a search box which narrows the spectra listed by a Combobox or Listbox as the search is typed. See SpectrumIndex.search
+    def __init__(self, master, app, picker):
+        super().__init__(master)
+        self.app = app
+        self.picker = picker
+        self.searchVar = tk.StringVar()
+
+        tk.Label(self, text="Search:").grid(row=0, column=0, sticky='e')
+        ttk.Entry(self, textvariable=self.searchVar, width=24).grid(row=0, column=1, padx=5, sticky='w')
+        self.searchVar.trace('w', self.filter)
+
+    def results(self):
+        return self.app.search_spectra(self.searchVar.get())
+
+    def filter(self, *args):
+        names = self.results()
+        if isinstance(self.picker, tk.Listbox): #refill the list, keeping the selected names which are still listed selected
+            selected = {self.picker.get(i) for i in self.picker.curselection()}
+            self.picker.delete(0, 'end')
+            self.picker.insert('end', *names)
+            for i, name in enumerate(names):
+                if name in selected:
+                    self.picker.selection_set(i)
+            self.picker.event_generate('<<ListboxSelect>>')
+        else: #the current choice is kept, even if the search hides it
+            self.picker.configure(values=names)
+
 #===========================================================================================================================================================================================================================
 class GraphPopup(ConditionalPopup):
     def okPressed(self, *args):
@@ -673,38 +3602,275 @@ class GraphPopup(ConditionalPopup):
 #===========================================================================================================================================================================================================================
 class LoadDelimitedFilePopup(ConditionalPopup):
     def __init__(self, master):
-        self.delimiters={'comma':',',
+        self.delimiters={'auto':None,
+                         'comma':',',
                          'tab':'\t',
                          'space':' ',
-                         'newline':'\n'} #map delimiter names to their str representations
+                         'semicolon':';'} #map delimiter names to their str representations. 'auto' sniffs each file
+        self.filenames = ()
 
         super().__init__(master, "Load Delimited File", filenameVar=tk.StringVar(),
                                                            delimiterVar=tk.StringVar())
         
     def makeWidgets(self):
-        fileChooserButton = ttk.Button(self.widgetFrame, text="Choose File", command=self.getfilename)
+        fileChooserButton = ttk.Button(self.widgetFrame, text="Choose Files", command=self.getfilename)
         fileChooserButton.grid(row=0, column=0, padx=10, pady=10, sticky='nsew')
 
         delimiterCombobox = ttk.Combobox(self.widgetFrame, values=list(self.delimiters.keys()), textvariable=self.delimiterVar)
         delimiterCombobox.configure(state='readonly')
         delimiterCombobox.grid(row=0, column=1, padx=10, pady=10, sticky='nsew')
+        delimiterCombobox.set('auto')
 
         self.makeAlertBox()
         super().makeWidgets()
 
     def getfilename(self):
-        self.filenameVar.set(askopenfilename())
+        self.filenames = askopenfilenames()
+        self.filenameVar.set("\n".join(self.filenames))
         self.alertBox.configure(text=self.filenameVar.get())
 
     def okPressed(self, *args):
         try:
-            self.master.controller.load(self.filenameVar.get(), 'csv', delimiter=self.delimiters[self.delimiterVar.get()])
+            with self.master.controller.bulk():
+                for filename in self.filenames:
+                    self.master.controller.load(filename, 'csv', delimiter=self.delimiters[self.delimiterVar.get()])
             super().okPressed()
 
-        except UnsupportedFileTypeException as inst:
+        except (UnsupportedFileTypeException, NoPathNameException) as inst:
             self.alertBox.configure(text=inst.message)
             self.after(3000, lambda:self.alertBox.configure(text=""))
 
+#===========================================================================================================================================================================================================================
+class WatchDirectoryPopup(ConditionalPopup):
+    #popup that starts or stops watching a directory for new files
+    def __init__(self, master):
+        self.xVar = tk.StringVar()
+        self.yVar = tk.StringVar()
+        self.plotVar = tk.StringVar()
+        super().__init__(master, "Watch Folder", directoryVar=tk.StringVar())
+
+    def makeWidgets(self):
+        directoryButton = ttk.Button(self.widgetFrame, text="Choose Folder", command=lambda:self.directoryVar.set(askdirectory()))
+        directoryButton.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        directoryLabel = tk.Label(self.widgetFrame, textvariable=self.directoryVar)
+        directoryLabel.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+
+        xLabel = tk.Label(self.widgetFrame, text="X Column (optional):")
+        xLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        xEntry = ttk.Entry(self.widgetFrame, textvariable=self.xVar)
+        xEntry.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+
+        yLabel = tk.Label(self.widgetFrame, text="Y Column (optional):")
+        yLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+        yEntry = ttk.Entry(self.widgetFrame, textvariable=self.yVar)
+        yEntry.grid(row=2, column=1, padx=10, pady=10, sticky='w')
+
+        plotLabel = tk.Label(self.widgetFrame, text="Add to plot (optional):")
+        plotLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+        plotCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=[""] + list(self.master.controller.plots.keys()), textvariable=self.plotVar)
+        plotCombobox.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+
+        stopButton = ttk.Button(self.widgetFrame, text="Stop Watching All", command=self.stopAll)
+        stopButton.grid(row=4, column=0, padx=10, pady=10, sticky='e')
+        watchingLabel = tk.Label(self.widgetFrame, text="Watching: " + (", ".join(self.master.controller.watchers) or "nothing"))
+        watchingLabel.grid(row=4, column=1, padx=10, pady=10, sticky='w')
+
+        self.makeAlertBox()
+        super().makeWidgets()
+
+    def stopAll(self):
+        for directory in list(self.master.controller.watchers):
+            self.master.controller.stop_watching(directory)
+        self.destroy()
+
+    def okPressed(self, *args):
+        self.master.controller.watch_directory(self.directoryVar.get(), x=self.xVar.get() or None, y=self.yVar.get() or None,
+                                               plot=self.plotVar.get() or None, onIngest=self.master.fileWatched)
+        self.master.alertBox.configure(text="Watching " + self.directoryVar.get())
+        super().okPressed()
+
+#===========================================================================================================================================================================================================================
+class DiagnosticsPopup(tk.Toplevel):
+    #window which shows the Profiler's records and the operation cache's statistics
+    def __init__(self, master):
+        super().__init__(master)
+        self.master = master
+        self.wm_title("Diagnostics")
+        self.profileVar = tk.BooleanVar(value=Profiler.enabled)
+        self.memoryVar = tk.BooleanVar(value=tracemalloc.is_tracing())
+        budget = self.master.controller.dfs.budget
+        self.budgetVar = tk.StringVar(value="" if budget is None else str(budget/1e6))
+        self.precisionVar = tk.StringVar(value=Spectrum.dtype.name)
+
+        optionsFrame = tk.Frame(self)
+        optionsFrame.grid(row=0, column=0, padx=10, pady=10, sticky='w')
+        ttk.Checkbutton(optionsFrame, text="Profile hot paths", variable=self.profileVar, command=self.toggleProfiling).grid(row=0, column=0, padx=5)
+        ttk.Checkbutton(optionsFrame, text="Track memory (slower)", variable=self.memoryVar, command=self.toggleProfiling).grid(row=0, column=1, padx=5)
+        ttk.Button(optionsFrame, text="Refresh", command=self.refresh).grid(row=0, column=2, padx=5)
+        ttk.Button(optionsFrame, text="Reset", command=lambda:(Profiler.reset(), self.refresh())).grid(row=0, column=3, padx=5)
+        ttk.Button(optionsFrame, text="Export JSON", command=lambda:self.export(Profiler.export_json, ".json")).grid(row=0, column=4, padx=5)
+        ttk.Button(optionsFrame, text="Export pstats", command=lambda:self.export(Profiler.export_pstats, ".prof")).grid(row=0, column=5, padx=5)
+
+        budgetFrame = tk.Frame(self)
+        budgetFrame.grid(row=1, column=0, padx=10, sticky='w')
+        tk.Label(budgetFrame, text="Memory budget for loaded files (MB, blank for no limit):").grid(row=0, column=0, padx=5)
+        ttk.Entry(budgetFrame, textvariable=self.budgetVar, width=10).grid(row=0, column=1, padx=5)
+        ttk.Button(budgetFrame, text="Apply", command=self.setBudget).grid(row=0, column=2, padx=5)
+        tk.Label(budgetFrame, text="Precision of spectra:").grid(row=0, column=3, padx=5)
+        precisionCombobox = ttk.Combobox(budgetFrame, state='readonly', values=Spectrum.PRECISIONS, textvariable=self.precisionVar, width=8)
+        precisionCombobox.grid(row=0, column=4, padx=5)
+        precisionCombobox.bind('<<ComboboxSelected>>', lambda event:(self.master.controller.set_precision(self.precisionVar.get()), self.refresh()))
+
+        self.statsText = tk.Text(self, state='disabled', width=100, height=30, wrap='none', font='TkFixedFont')
+        self.statsText.grid(row=2, column=0, padx=10, pady=10, sticky='nsew')
+        self.refresh()
+
+    def setBudget(self):
+        dfs = self.master.controller.dfs
+        if not self.budgetVar.get():
+            dfs.budget = None
+        elif isNumber(self.budgetVar.get()):
+            dfs.budget = float(self.budgetVar.get())*1e6
+            dfs.enforce()
+        self.refresh()
+
+    @staticmethod
+    def memorySummary(controller, largest=10):
+        usage = controller.memory_usage()
+        dfs = controller.dfs
+        lines = ["Memory: %.1f MB in total, spectra stored as %s" %(sum(sum(group.values()) for group in usage.values())/1e6, Spectrum.dtype.name),
+                 "  files    %10.1f MB  (%i of %i in memory, budget %s, %i evictions, %i reloads)" %(sum(usage['files'].values())/1e6,
+                 sum(dfs.isResident(name) for name in dfs), len(dfs), "none" if dfs.budget is None else "%.1f MB" %(dfs.budget/1e6), dfs.evictions, dfs.reloads),
+                 "  spectra  %10.1f MB  (%i)" %(sum(usage['spectra'].values())/1e6, len(usage['spectra'])),
+                 "  plots    %10.1f MB  (%i)" %(sum(usage['plots'].values())/1e6, len(usage['plots'])),
+                 "Largest:"]
+        objects = [(nbytes, kind, name) for kind, group in usage.items() for name, nbytes in group.items()]
+        for nbytes, kind, name in sorted(objects, reverse=True)[:largest]:
+            lines.append("  %-8s %10.1f MB  %s" %(kind, nbytes/1e6, name))
+        return "\n".join(lines)
+
+    def toggleProfiling(self):
+        if self.profileVar.get():
+            Profiler.enable(traceMemory=self.memoryVar.get())
+        else:
+            Profiler.disable()
+            self.memoryVar.set(False)
+        self.refresh()
+
+    def export(self, method, extension):
+        filename = asksaveasfilename(defaultextension=extension)
+        if filename:
+            method(filename)
+
+    def refresh(self):
+        controller = self.master.controller
+        cacheStats = controller.operationCache.stats()
+        text = Profiler.summary() + "\n\nOperation cache: %(hits)i hits, %(misses)i misses (hit rate %(hitRate).0f%%), %(size)i of %(maxsize)i results held" %dict(cacheStats, hitRate=100*cacheStats['hitRate'])
+        text += "\n\n" + self.memorySummary(controller)
+        if controller.startupTime is not None:
+            text += "\n\nStartup: %.2f s to the first window" %controller.startupTime
+        self.statsText.configure(state='normal')
+        self.statsText.delete(1.0, 'end')
+        self.statsText.insert('end', text)
+        self.statsText.configure(state='disabled')
+
+#===========================================================================================================================================================================================================================
+class MapViewer(tk.Toplevel):
+    #window which shows an image of a band across a hyperspectral map. The image is drawn from an ImagePyramid, at the
+    #level of detail of the current zoom, & clicking a pixel adds its spectrum to the spectra
+    def __init__(self, master):
+        super().__init__(master)
+        self.master = master
+        self.wm_title("Map Viewer")
+        self.map = None
+        self.pyramid = None
+        self.firstVar, self.lastVar = tk.StringVar(), tk.StringVar()
+        self.lowVar, self.highVar = tk.StringVar(value="1300"), tk.StringVar(value="1550")
+        self.modeVar, self.methodVar = tk.StringVar(value='area'), tk.StringVar(value='trapezoid')
+        self.baselineVar = tk.BooleanVar(value=True)
+
+        mapFrame = tk.Frame(self)
+        mapFrame.grid(row=0, column=0, padx=10, pady=5, sticky='w')
+        ttk.Button(mapFrame, text="Open Map", command=self.openMap).grid(row=0, column=0, padx=5)
+        tk.Label(mapFrame, text="First & last wavenumbers, if there is no .x.npy file:").grid(row=0, column=1, padx=5)
+        ttk.Entry(mapFrame, textvariable=self.firstVar, width=8).grid(row=0, column=2, padx=5)
+        ttk.Entry(mapFrame, textvariable=self.lastVar, width=8).grid(row=0, column=3, padx=5)
+
+        bandFrame = tk.Frame(self)
+        bandFrame.grid(row=1, column=0, padx=10, pady=5, sticky='w')
+        tk.Label(bandFrame, text="Band (cm-1):").grid(row=0, column=0, padx=5)
+        ttk.Entry(bandFrame, textvariable=self.lowVar, width=8).grid(row=0, column=1, padx=5)
+        ttk.Entry(bandFrame, textvariable=self.highVar, width=8).grid(row=0, column=2, padx=5)
+        ttk.Combobox(bandFrame, state='readonly', values=SpectralMap.MODES, textvariable=self.modeVar, width=8).grid(row=0, column=3, padx=5)
+        ttk.Combobox(bandFrame, state='readonly', values=BandIntegration.METHODS, textvariable=self.methodVar, width=10).grid(row=0, column=4, padx=5)
+        ttk.Checkbutton(bandFrame, text="Linear baseline", variable=self.baselineVar).grid(row=0, column=5, padx=5)
+        ttk.Button(bandFrame, text="Show", command=self.showBand).grid(row=0, column=6, padx=5)
+
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        self.figure = Figure(figsize=(6.5, 5.5), dpi=100, tight_layout=True)
+        self.axis = self.figure.add_subplot()
+        self.image = None #the AxesImage drawn from the pyramid
+        self.canvas = FigureCanvasTkAgg(self.figure, self)
+        self.canvas.get_tk_widget().grid(row=2, column=0, padx=10, pady=5)
+        toolbarFrame = tk.Frame(self)
+        toolbarFrame.grid(row=3, column=0, padx=10)
+        self.toolbar = NavigationToolbar2Tk(self.canvas, toolbarFrame)
+        self.toolbar.update()
+        self.canvas.mpl_connect('button_press_event', self.pickPixel)
+
+        self.alertBox = tk.Label(self, text="Open a map, then click a pixel to add its spectrum to the spectra.")
+        self.alertBox.grid(row=4, column=0, padx=10, pady=5)
+
+    def openMap(self):
+        filename = askopenfilename(filetypes=[("Map", "*.npy")])
+        if not filename:
+            return
+        try:
+            first, last = (float(var.get()) if isNumber(var.get()) else None for var in (self.firstVar, self.lastVar))
+            self.map = SpectralMap(filename, first, last)
+            self.alertBox.configure(text="%s: %i x %i pixels, %i points each. Click a pixel to add its spectrum to the spectra." %((self.map.name,) + self.map.shape + (len(self.map.axis.x),)))
+            self.showBand()
+        except ValueError as inst:
+            self.alertBox.configure(text=str(inst))
+        except BadAxisSymmetryException as inst:
+            self.alertBox.configure(text=inst.message)
+
+    def showBand(self):
+        if self.map is None or not (isNumber(self.lowVar.get()) and isNumber(self.highVar.get())):
+            return
+        image = self.map.band_image(float(self.lowVar.get()), float(self.highVar.get()), self.modeVar.get(), self.methodVar.get(), self.baselineVar.get())
+        self.pyramid = ImagePyramid(image)
+        self.figure.clear()
+        self.axis = self.figure.add_subplot()
+        rows, columns = image.shape
+        self.image = self.axis.imshow(self.pyramid.levels[-1], interpolation='nearest', extent=(-0.5, columns - 0.5, rows - 0.5, -0.5))
+        if np.isfinite(image).any(): #the colours are set by the whole image, so they do not change as the view moves
+            self.image.set_clim(np.nanmin(image), np.nanmax(image))
+        self.figure.colorbar(self.image, ax=self.axis, label="%s %s-%s" %(self.modeVar.get(), self.lowVar.get(), self.highVar.get()))
+        self.axis.set(xlim=(-0.5, columns - 0.5), ylim=(rows - 0.5, -0.5), title=self.map.name)
+        self.axis.set_autoscale_on(False) #setting the extent of the image as the view moves would otherwise rescale the axis
+        self.axis.callbacks.connect('xlim_changed', self.redrawView)
+        self.axis.callbacks.connect('ylim_changed', self.redrawView)
+        self.redrawView(self.axis)
+
+    def redrawView(self, axis):
+        if self.pyramid is None:
+            return
+        bbox = axis.get_window_extent()
+        data, extent, level = self.pyramid.view(axis.get_xlim(), axis.get_ylim(), bbox.width, bbox.height)
+        self.image.set_data(data)
+        self.image.set_extent(extent)
+        self.canvas.draw_idle()
+
+    def pickPixel(self, event):
+        if self.map is None or event.inaxes is not self.axis or self.toolbar.mode: #clicks while zooming or panning are not picks
+            return
+        row, column = int(round(event.ydata)), int(round(event.xdata))
+        if 0 <= row < self.map.shape[0] and 0 <= column < self.map.shape[1]:
+            spectrum = self.master.controller.map_spectrum(self.map, row, column)
+            self.alertBox.configure(text="Added %s to the spectra." %spectrum.name)
+
 #===========================================================================================================================================================================================================================
 class DuplicateSpectrumPopup(ConditionalPopup):
     def __init__(self, master):
@@ -729,9 +3895,38 @@ class DuplicateSpectrumPopup(ConditionalPopup):
         if self.nameVar.get() == self.spectrumVar.get():
             self.alertBox.configure(text="Names cannot be the same!")
         else:
-            self.master.controller.make_spectrum(self.nameVar.get(), self.master.controller.spectra[self.spectrumVar.get()].df, self.master.controller.spectra[self.spectrumVar.get()].df.columns[0], self.master.controller.spectra[self.spectrumVar.get()].df.columns[1])
+            self.master.controller.duplicate_spectrum(self.spectrumVar.get(), self.nameVar.get())
             super().okPressed()
 
+#=====================================================================================================================================================================================================================================================================================================
+class TagSpectrumPopup(ConditionalPopup):
+    #popup to set the tags of a spectrum, which can then be searched for with tag:name
+    def __init__(self, master):
+        self.tagsVar = tk.StringVar()
+        super().__init__(master, "Tag Spectrum", spectrumVar=tk.StringVar())
+        self.spectrumVar.trace('w', self.showTags)
+
+    def makeWidgets(self):
+        spectrumLabel = tk.Label(self.widgetFrame, text="Spectrum:")
+        spectrumLabel.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        spectrumCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(self.master.controller.spectra.keys()), textvariable=self.spectrumVar)
+        spectrumCombobox.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, spectrumCombobox).grid(row=0, column=2, padx=10, pady=10, sticky='w')
+
+        tagsLabel = tk.Label(self.widgetFrame, text="Tags (comma separated):")
+        tagsLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        tagsEntry = ttk.Entry(self.widgetFrame, textvariable=self.tagsVar, width=40)
+        tagsEntry.grid(row=1, column=1, columnspan=2, padx=10, pady=10, sticky='w')
+
+        super().makeWidgets()
+
+    def showTags(self, *args):
+        self.tagsVar.set(", ".join(sorted(self.master.controller.index.tags(self.spectrumVar.get()))))
+
+    def okPressed(self, *args):
+        self.master.controller.tag_spectrum(self.spectrumVar.get(), self.tagsVar.get().split(','))
+        super().okPressed()
+
 #=====================================================================================================================================================================================================================================================================================================
 class DeleteSpectrumPopup(ConditionalPopup):
     def __init__(self, master):
@@ -749,7 +3944,6 @@ class DeleteSpectrumPopup(ConditionalPopup):
 
     def okPressed(self, *args):
         self.master.controller.delete_spectrum(self.spectrumVar.get())
-        self.master.insertItems()
         super().okPressed()
 
 #=====================================================================================================================================================================================================================================================================================================
@@ -768,6 +3962,413 @@ class SaveSpectrumPopup(ConditionalPopup):
     def okPressed(self, *args):
         self.master.controller.save(self.spectrumVar.get(), asksaveasfilename())
 
+#======================================================================================================================================================================================================================================================================================================
+class ExportSpectraPopup(ConditionalPopup):
+    #popup that enables exporting many spectra at once
+    LAYOUTS = {'Wide (one column per spectrum)':'wide',
+               'Long (spectrum, x, y rows)':'long',
+               'One file per spectrum':'each'} #map layout descriptions to the layouts of the SpectrumExporter
+
+    def __init__(self, master):
+        super().__init__(master, "Export Spectra", layoutVar=tk.StringVar(),
+                                                     formatVar=tk.StringVar())
+
+    def makeWidgets(self):
+        layoutLabel = tk.Label(self.widgetFrame, text="Layout:")
+        layoutLabel.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        layoutCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(self.LAYOUTS.keys()), textvariable=self.layoutVar, width=30)
+        layoutCombobox.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+
+        formatLabel = tk.Label(self.widgetFrame, text="Format:")
+        formatLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        formatCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(SpectrumExporter.FORMATS), textvariable=self.formatVar)
+        formatCombobox.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+
+        spectraLabel = tk.Label(self.widgetFrame, text="Spectra:")
+        spectraLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+
+        listboxFrame = tk.Frame(self.widgetFrame)
+        listboxFrame.grid(row=2, column=1, padx=10, pady=10, sticky='w')
+
+        yscrollbar = ttk.Scrollbar(listboxFrame)
+        yscrollbar.grid(row=0, column=1, sticky='ns')
+
+        self.spectraListbox = tk.Listbox(listboxFrame, selectmode='extended', yscrollcommand=yscrollbar.set, exportselection=False)
+        self.spectraListbox.grid(row=0, column=0, sticky='nsew')
+        yscrollbar.configure(command=self.spectraListbox.yview)
+        for spectrumName in self.master.controller.spectra.keys():
+            self.spectraListbox.insert('end', spectrumName)
+        self.spectraListbox.bind('<<ListboxSelect>>', self.activateOK)
+
+        self.makeAlertBox()
+        super().makeWidgets()
+
+    def activateOK(self, *args):
+        self.okButton.configure(state='disabled')
+        if self.spectraListbox.curselection() and self.layoutVar.get() and self.formatVar.get():
+            self.okButton.configure(state='normal')
+
+    def okPressed(self, *args):
+        keys = [self.spectraListbox.get(i) for i in self.spectraListbox.curselection()]
+        layout = self.LAYOUTS[self.layoutVar.get()]
+        try:
+            if layout == 'each':
+                directory = askdirectory()
+                if not directory:
+                    return
+                stats = self.master.controller.export_each(keys, directory, self.formatVar.get())
+            else:
+                filename = asksaveasfilename(defaultextension="." + self.formatVar.get())
+                if not filename:
+                    return
+                stats = self.master.controller.export_spectra(keys, filename, layout, self.formatVar.get())
+            self.master.alertBox.configure(text="Exported %i spectra (%.1f MB) in %.2f s, %.1f MB/s" %(stats['spectra'], stats['bytes']/1e6, stats['seconds'], stats['MBps']))
+            self.master.after(5000, lambda:self.master.alertBox.configure(text=""))
+            super().okPressed()
+
+        except (BadAxisSymmetryException, MissingDependencyException) as inst:
+            self.alertBox.configure(text=inst.message)
+
+#======================================================================================================================================================================================================================================================================================================
+class BuildLibraryPopup(ConditionalPopup):
+    #popup that makes a reference library from chosen spectra
+    def __init__(self, master, onBuilt=None):
+        self.onBuilt = onBuilt #called once the library is built
+        super().__init__(master, "Build Reference Library", normalisationVar=tk.StringVar())
+
+    def makeWidgets(self):
+        normalisationLabel = tk.Label(self.widgetFrame, text="Normalisation:")
+        normalisationLabel.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        normalisationCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(SpectralLibrary.NORMALISATIONS), textvariable=self.normalisationVar)
+        normalisationCombobox.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        normalisationCombobox.set('vector')
+
+        spectraLabel = tk.Label(self.widgetFrame, text="References:")
+        spectraLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+
+        listboxFrame = tk.Frame(self.widgetFrame)
+        listboxFrame.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+
+        yscrollbar = ttk.Scrollbar(listboxFrame)
+        yscrollbar.grid(row=0, column=1, sticky='ns')
+
+        self.spectraListbox = tk.Listbox(listboxFrame, selectmode='extended', yscrollcommand=yscrollbar.set, exportselection=False)
+        self.spectraListbox.grid(row=0, column=0, sticky='nsew')
+        yscrollbar.configure(command=self.spectraListbox.yview)
+        self.spectraListbox.insert('end', *self.master.controller.spectra.keys())
+        self.spectraListbox.bind('<<ListboxSelect>>', self.activateOK)
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, self.spectraListbox).grid(row=2, column=1, padx=10, sticky='w')
+
+        selectAllButton = ttk.Button(self.widgetFrame, text="Select All", command=lambda:(self.spectraListbox.selection_set(0, 'end'), self.activateOK()))
+        selectAllButton.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+
+        self.makeAlertBox()
+        super().makeWidgets()
+
+    def activateOK(self, *args):
+        self.okButton.configure(state='disabled')
+        if self.spectraListbox.curselection() and self.normalisationVar.get():
+            self.okButton.configure(state='normal')
+
+    def okPressed(self, *args):
+        filename = asksaveasfilename(defaultextension=".npz", filetypes=[("Reference library", "*.npz")])
+        if filename:
+            try:
+                self.master.controller.build_library([self.spectraListbox.get(i) for i in self.spectraListbox.curselection()], filename, self.normalisationVar.get())
+                if self.onBuilt is not None:
+                    self.onBuilt()
+                super().okPressed()
+            except BadAxisSymmetryException:
+                self.alertBox.configure(text="The spectra do not share a range of wavenumbers.")
+
+#======================================================================================================================================================================================================================================================================================================
+class LibrarySearchPopup(ConditionalPopup):
+    #popup that ranks the references of the library by their similarity to a spectrum
+    def __init__(self, master):
+        self.candidatesVar = tk.StringVar() #optional, so it is not traced
+        super().__init__(master, "Library Search", spectrumVar=tk.StringVar(),
+                                                     metricVar=tk.StringVar(),
+                                                     kVar=tk.StringVar())
+
+    def makeWidgets(self):
+        self.libraryLabel = tk.Label(self.widgetFrame)
+        self.libraryLabel.grid(row=0, column=0, columnspan=2, padx=10, pady=10, sticky='w')
+        libraryButtons = tk.Frame(self.widgetFrame)
+        libraryButtons.grid(row=0, column=2, padx=10, pady=10, sticky='e')
+        ttk.Button(libraryButtons, text="Open Library", command=self.openLibrary).grid(row=0, column=0)
+        ttk.Button(libraryButtons, text="Build Library", command=lambda:BuildLibraryPopup(self.master, onBuilt=self.showLibrary)).grid(row=0, column=1)
+
+        spectrumLabel = tk.Label(self.widgetFrame, text="Unknown:")
+        spectrumLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        spectrumCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(self.master.controller.spectra.keys()), textvariable=self.spectrumVar)
+        spectrumCombobox.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, spectrumCombobox).grid(row=1, column=2, padx=10, pady=10, sticky='w')
+
+        metricLabel = tk.Label(self.widgetFrame, text="Similarity:")
+        metricLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+        metricCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(SpectralLibrary.METRICS), textvariable=self.metricVar)
+        metricCombobox.grid(row=2, column=1, padx=10, pady=10, sticky='w')
+        metricCombobox.set('correlation')
+
+        kLabel = tk.Label(self.widgetFrame, text="Number of matches:")
+        kLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+        kEntry = ttk.Entry(self.widgetFrame, textvariable=self.kVar)
+        kEntry.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+        kEntry.insert('end', '10')
+
+        candidatesLabel = tk.Label(self.widgetFrame, text="Coarse search candidates\n(optional, for large libraries):")
+        candidatesLabel.grid(row=4, column=0, padx=10, pady=10, sticky='e')
+        candidatesEntry = ttk.Entry(self.widgetFrame, textvariable=self.candidatesVar)
+        candidatesEntry.grid(row=4, column=1, padx=10, pady=10, sticky='w')
+
+        self.resultsText = tk.Text(self.widgetFrame, state='disabled', width=60, height=12, wrap='none')
+        self.resultsText.grid(row=5, column=0, columnspan=3, padx=10, pady=10, sticky='nsew')
+
+        self.makeAlertBox()
+        super().makeWidgets()
+        self.showLibrary()
+
+    def showLibrary(self):
+        library = self.master.controller.library
+        self.libraryLabel.configure(text="No library open" if library is None else "Library: %i references, %i points from %.0f to %.0f, %s normalisation"
+                                    %(len(library.names), library.grid.size, library.grid[0], library.grid[-1], library.normalisation))
+
+    def openLibrary(self):
+        filename = askopenfilename(filetypes=[("Reference library", "*.npz")])
+        if filename:
+            try:
+                self.master.controller.open_library(filename)
+                self.showLibrary()
+            except (UnsupportedFileTypeException, NoPathNameException) as inst:
+                self.alertBox.configure(text=inst.message)
+
+    def okPressed(self, *args):
+        if self.master.controller.library is None:
+            self.alertBox.configure(text="Open or build a library first.")
+        elif not self.kVar.get().isdigit() or not (self.candidatesVar.get() == "" or self.candidatesVar.get().isdigit()):
+            self.alertBox.configure(text="The numbers of matches & candidates must be whole numbers.")
+        else:
+            candidates = int(self.candidatesVar.get()) if self.candidatesVar.get() else None
+            matches = self.master.controller.match_spectrum(self.spectrumVar.get(), self.metricVar.get(), int(self.kVar.get()), candidates)
+            self.resultsText.configure(state='normal')
+            self.resultsText.delete(1.0, 'end')
+            self.resultsText.insert('end', matches.to_string(index=False))
+            self.resultsText.configure(state='disabled') #the popup stays open, to match more unknowns
+
+#======================================================================================================================================================================================================================================================================================================
+class BandRatioPopup(ConditionalPopup):
+    #popup that integrates bands of many spectra & tabulates their areas & ratios as a new file
+    def __init__(self, master):
+        self.selected = [] #the names of the chosen spectra, including any which the search is hiding
+        self.baselineVar = tk.BooleanVar(value=True)
+        super().__init__(master, "Band Ratios", nameVar=tk.StringVar(),
+                                                 methodVar=tk.StringVar(),
+                                                 bandsVar=tk.StringVar(),
+                                                 ratiosVar=tk.StringVar())
+
+    def makeWidgets(self):
+        nameLabel = tk.Label(self.widgetFrame, text="Name the table:")
+        nameLabel.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        nameEntry = ttk.Entry(self.widgetFrame, textvariable=self.nameVar)
+        nameEntry.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+
+        presetLabel = tk.Label(self.widgetFrame, text="Preset:")
+        presetLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        presetCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(BandIntegration.PRESETS.keys()))
+        presetCombobox.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+        presetCombobox.bind('<<ComboboxSelected>>', lambda event:self.usePreset(presetCombobox.get()))
+
+        bandsLabel = tk.Label(self.widgetFrame, text="Bands (name:low-high, ...):")
+        bandsLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+        bandsEntry = ttk.Entry(self.widgetFrame, width=40, textvariable=self.bandsVar)
+        bandsEntry.grid(row=2, column=1, columnspan=2, padx=10, pady=10, sticky='w')
+
+        ratiosLabel = tk.Label(self.widgetFrame, text="Ratios (band/band, ...):")
+        ratiosLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+        ratiosEntry = ttk.Entry(self.widgetFrame, width=40, textvariable=self.ratiosVar)
+        ratiosEntry.grid(row=3, column=1, columnspan=2, padx=10, pady=10, sticky='w')
+
+        methodLabel = tk.Label(self.widgetFrame, text="Integration:")
+        methodLabel.grid(row=4, column=0, padx=10, pady=10, sticky='e')
+        methodCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(BandIntegration.METHODS), textvariable=self.methodVar)
+        methodCombobox.grid(row=4, column=1, padx=10, pady=10, sticky='w')
+        methodCombobox.set('trapezoid')
+        baselineCheckbutton = ttk.Checkbutton(self.widgetFrame, text="Linear baseline", variable=self.baselineVar)
+        baselineCheckbutton.grid(row=4, column=2, padx=10, pady=10, sticky='w')
+
+        spectraLabel = tk.Label(self.widgetFrame, text="Spectra:")
+        spectraLabel.grid(row=5, column=0, padx=10, pady=10, sticky='e')
+        listboxFrame = tk.Frame(self.widgetFrame)
+        listboxFrame.grid(row=5, column=1, padx=10, pady=10, sticky='w')
+        yscrollbar = ttk.Scrollbar(listboxFrame)
+        yscrollbar.grid(row=0, column=1, sticky='ns')
+        self.spectraListbox = tk.Listbox(listboxFrame, selectmode='multiple', exportselection=False, yscrollcommand=yscrollbar.set)
+        self.spectraListbox.grid(row=0, column=0, sticky='nsew')
+        yscrollbar.configure(command=self.spectraListbox.yview)
+        for spectrumName in self.master.controller.spectra.keys():
+            self.spectraListbox.insert('end', spectrumName)
+        self.spectraListbox.bind('<<ListboxSelect>>', self.activateOK)
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, self.spectraListbox).grid(row=6, column=1, padx=10, sticky='w')
+        ttk.Button(self.widgetFrame, text="Select All", command=self.selectAll).grid(row=6, column=2, padx=10, sticky='w')
+
+        self.makeAlertBox()
+        super().makeWidgets()
+        presetCombobox.set('CALCITE')
+        self.usePreset('CALCITE')
+
+    def usePreset(self, preset):
+        bands, ratios = BandIntegration.PRESETS[preset]
+        self.bandsVar.set(", ".join("%s:%g-%g" %band for band in bands))
+        self.ratiosVar.set(", ".join("%s/%s" %ratio for ratio in ratios))
+
+    def selectAll(self):
+        self.spectraListbox.selection_set(0, 'end')
+        self.activateOK()
+
+    def activateOK(self, *args):
+        listed = set(self.spectraListbox.get(0, 'end'))
+        chosen = [self.spectraListbox.get(i) for i in self.spectraListbox.curselection()]
+        self.selected = [name for name in self.selected if name not in listed] + chosen
+        self.okButton.configure(state='disabled')
+        if self.selected:
+            super().activateOK()
+
+    def parse(self):
+        #@return the (name, low, high) bands & (numerator, denominator) ratios typed in, or raise ValueError
+        bands = []
+        for text in self.bandsVar.get().split(","):
+            match = re.fullmatch(r"\s*([^:]+?)\s*:\s*(-?[\d.]+)\s*-\s*(-?[\d.]+)\s*", text)
+            if match is None:
+                raise ValueError("Bands must be written as name:low-high, separated by commas.")
+            bands.append((match.group(1), float(match.group(2)), float(match.group(3))))
+        names = [band[0] for band in bands]
+        ratios = []
+        for text in self.ratiosVar.get().split(","):
+            if text.strip():
+                ratio = tuple(name.strip() for name in text.split("/"))
+                if len(ratio) != 2 or not set(ratio) <= set(names):
+                    raise ValueError("Ratios must be written as band/band, using the names of the bands.")
+                ratios.append(ratio)
+        return bands, ratios
+
+    def okPressed(self, *args):
+        try:
+            bands, ratios = self.parse()
+            self.master.controller.band_table(self.nameVar.get(), self.selected, bands, ratios, self.methodVar.get(), self.baselineVar.get())
+            super().okPressed()
+        except ValueError as inst:
+            self.alertBox.configure(text=str(inst))
+        except BadAxisSymmetryException as inst:
+            self.alertBox.configure(text=inst.message)
+
+#======================================================================================================================================================================================================================================================================================================
+class ChemometricsPopup(ConditionalPopup):
+    #popup that runs a PCA of many spectra, or a PLS regression of a response on them, & shows the scores plot
+    def __init__(self, master):
+        self.selected = [] #the names of the chosen spectra, including any which the search is hiding
+        self.fileVar = tk.StringVar() #the response is only needed for PLS, so it is not traced
+        self.columnVar = tk.StringVar()
+        super().__init__(master, "PCA/PLS", nameVar=tk.StringVar(),
+                                             methodVar=tk.StringVar(),
+                                             componentsVar=tk.StringVar())
+
+    def makeWidgets(self):
+        nameLabel = tk.Label(self.widgetFrame, text="Name the model:")
+        nameLabel.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        nameEntry = ttk.Entry(self.widgetFrame, textvariable=self.nameVar)
+        nameEntry.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+
+        methodLabel = tk.Label(self.widgetFrame, text="Method:")
+        methodLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        methodCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=['PCA', 'PLS'], textvariable=self.methodVar)
+        methodCombobox.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+        methodCombobox.bind('<<ComboboxSelected>>', self.activateResponseFields)
+
+        componentsLabel = tk.Label(self.widgetFrame, text="Number of components:")
+        componentsLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+        componentsEntry = ttk.Entry(self.widgetFrame, textvariable=self.componentsVar)
+        componentsEntry.grid(row=2, column=1, padx=10, pady=10, sticky='w')
+        componentsEntry.insert('end', '3')
+
+        responseLabel = tk.Label(self.widgetFrame, text="PLS response\n(file & column, by spectrum name or in order):")
+        responseLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+        self.fileCombobox = ttk.Combobox(self.widgetFrame, state='disabled', values=list(self.master.controller.dfs.keys()), textvariable=self.fileVar)
+        self.fileCombobox.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+        self.fileCombobox.bind('<<ComboboxSelected>>', self.fillColumns)
+        self.columnCombobox = ttk.Combobox(self.widgetFrame, state='disabled', textvariable=self.columnVar)
+        self.columnCombobox.grid(row=3, column=2, padx=10, pady=10, sticky='w')
+
+        spectraLabel = tk.Label(self.widgetFrame, text="Spectra:")
+        spectraLabel.grid(row=4, column=0, padx=10, pady=10, sticky='e')
+        listboxFrame = tk.Frame(self.widgetFrame)
+        listboxFrame.grid(row=4, column=1, padx=10, pady=10, sticky='w')
+        yscrollbar = ttk.Scrollbar(listboxFrame)
+        yscrollbar.grid(row=0, column=1, sticky='ns')
+        self.spectraListbox = tk.Listbox(listboxFrame, selectmode='multiple', exportselection=False, yscrollcommand=yscrollbar.set)
+        self.spectraListbox.grid(row=0, column=0, sticky='nsew')
+        yscrollbar.configure(command=self.spectraListbox.yview)
+        for spectrumName in self.master.controller.spectra.keys():
+            self.spectraListbox.insert('end', spectrumName)
+        self.spectraListbox.bind('<<ListboxSelect>>', self.activateOK)
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, self.spectraListbox).grid(row=5, column=1, padx=10, sticky='w')
+        ttk.Button(self.widgetFrame, text="Select All", command=self.selectAll).grid(row=5, column=2, padx=10, sticky='w')
+
+        self.makeAlertBox()
+        super().makeWidgets()
+
+    def activateResponseFields(self, *args):
+        state = 'readonly' if self.methodVar.get() == 'PLS' else 'disabled'
+        self.fileCombobox.configure(state=state)
+        self.columnCombobox.configure(state=state)
+
+    def fillColumns(self, *args):
+        self.columnCombobox.configure(values=[str(column) for column in self.master.controller.dfs[self.fileVar.get()].columns])
+        self.columnVar.set("")
+
+    def selectAll(self):
+        self.spectraListbox.selection_set(0, 'end')
+        self.activateOK()
+
+    def activateOK(self, *args):
+        listed = set(self.spectraListbox.get(0, 'end'))
+        chosen = [self.spectraListbox.get(i) for i in self.spectraListbox.curselection()]
+        self.selected = [name for name in self.selected if name not in listed] + chosen
+        self.okButton.configure(state='disabled')
+        if self.selected:
+            super().activateOK()
+
+    def response(self):
+        #@return the response of each selected spectrum: the rows named after the spectra, or else the rows in order
+        df = self.master.controller.dfs[self.fileVar.get()]
+        column = df[df.columns[[str(column) for column in df.columns].index(self.columnVar.get())]]
+        if set(self.selected) <= set(column.index):
+            return column.loc[self.selected].to_numpy(dtype=float)
+        if len(column) != len(self.selected):
+            raise ValueError("The response needs a row for each spectrum, named after it or in the order of the spectra.")
+        return column.to_numpy(dtype=float)
+
+    def okPressed(self, *args):
+        if not self.componentsVar.get().isdigit() or int(self.componentsVar.get()) < 1:
+            self.alertBox.configure(text="The number of components must be a whole number.")
+            return
+        controller = self.master.controller
+        try:
+            if self.methodVar.get() == 'PLS':
+                if not (self.fileVar.get() and self.columnVar.get()):
+                    raise ValueError("Choose the file & column of the response.")
+                controller.pls(self.nameVar.get(), self.selected, self.response(), int(self.componentsVar.get()))
+                plot = self.nameVar.get() + " fit"
+            else:
+                controller.pca(self.nameVar.get(), self.selected, int(self.componentsVar.get()))
+                plot = self.nameVar.get() + " scores"
+            if plot in controller.plots:
+                controller.page(GraphPage).showFigure(controller.plots[plot])
+            super().okPressed()
+        except ValueError as inst:
+            self.alertBox.configure(text=str(inst))
+        except BadAxisSymmetryException as inst:
+            self.alertBox.configure(text=inst.message)
+
 #======================================================================================================================================================================================================================================================================================================
 class TracePopup(GraphPopup):
     def __init__(self, master, title, **kwargs):
@@ -834,17 +4435,18 @@ class AddTracePopup(TracePopup):
             self.axisCombobox.configure(state='readonly', values=[i for i in range(len(self.master.controller.plots[self.plotVar.get()].axes))])
 
     def activateTraceField(self, *args):
-        self.traceCombobox.configure(state='readonly', values=list(self.master.controller.spectra.keys()))
+        self.traceCombobox.configure(state='readonly', values=self.traceSearch.results())
         
     def activateOK(self, *args):
         if self.colorVar.get() or self.linewidthVar.get():
             super().activateOK()
 
     def makeWidgets(self):
+        from matplotlib.colors import CSS4_COLORS
         #colour label and combobox
         colourLabel = tk.Label(self.widgetFrame, text="Colour:")
         colourLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
-        colourCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(mcolors.CSS4_COLORS), textvariable=self.colorVar)
+        colourCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(CSS4_COLORS), textvariable=self.colorVar)
         colourCombobox.grid(row=3, column=1, padx=10, pady=10, sticky='w')
 
         #linewidth label and entry
@@ -855,6 +4457,8 @@ class AddTracePopup(TracePopup):
 
         self.makeAlertBox()
         super().makeWidgets()
+        self.traceSearch = SpectrumSearchEntry(self.widgetFrame, self.master.controller, self.traceCombobox)
+        self.traceSearch.grid(row=2, column=2, padx=10, pady=10, sticky='w')
 
     def okPressed(self, *args):
         try:
@@ -875,7 +4479,7 @@ class DeleteTracePopup(TracePopup):
     def okPressed(self, *args):
         for line in self.master.controller.plots[self.plotVar.get()].axes[self.axisVar.get()].lines:
             if line.get_label() == self.traceVar.get():
-                line.remove()
+                self.master.controller.delete_trace(line)
                 break
         super().okPressed()
   
@@ -896,10 +4500,11 @@ class ModifyTracePopup(TracePopup):
             self.traceCombobox.configure(state='readonly', values=traces)
 
     def makeWidgets(self):
+        from matplotlib.colors import CSS4_COLORS
         #colour label and combobox
         colourLabel = tk.Label(self.widgetFrame, text="Colour:")
         colourLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
-        colourCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(mcolors.CSS4_COLORS), textvariable=self.colorVar)
+        colourCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=list(CSS4_COLORS), textvariable=self.colorVar)
         colourCombobox.grid(row=3, column=1, padx=10, pady=10, sticky='w')
 
         #linewidth label and entry
@@ -919,10 +4524,12 @@ class ModifyTracePopup(TracePopup):
         try:
             for line in self.master.controller.plots[self.plotVar.get()].axes[self.axisVar.get()].lines :
                 if line.get_label() == self.traceVar.get():
+                    properties = {}
                     if self.linewidthVar.get():
-                        line.set_linewidth(float(self.linewidthVar.get()))
+                        properties['linewidth'] = float(self.linewidthVar.get())
                     if self.colorVar.get():
-                        line.set_color(self.colorVar.get())
+                        properties['color'] = self.colorVar.get()
+                    self.master.controller.set_properties(line, **properties)
                     break
             super().okPressed()
         except ValueError:
@@ -954,6 +4561,7 @@ class ArithmeticPopup(ConditionalPopup):
         
         s1Combobox = ttk.Combobox(self.widgetFrame, values=list(self.master.controller.spectra.keys()), state='readonly', textvariable=self.s1Var)
         s1Combobox.grid(row=1, column=1, padx=10, pady=10,sticky='w')
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, s1Combobox).grid(row=1, column=2, padx=10, pady=10, sticky='w')
 
         opLabel = tk.Label(self.widgetFrame, text="Operation:")
         opLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
@@ -966,6 +4574,7 @@ class ArithmeticPopup(ConditionalPopup):
 
         self.s2Combobox = ttk.Combobox(self.widgetFrame, values=list(self.master.controller.spectra.keys()), state='disabled')
         self.s2Combobox.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, self.s2Combobox).grid(row=3, column=2, padx=10, pady=10, sticky='w')
 
         self.makeAlertBox()
         super().makeWidgets()
@@ -997,8 +4606,8 @@ class ArithmeticPopup(ConditionalPopup):
 class GrindingCurvePopup(ConditionalPopup):
     #popup that enables creating a grinding curve
     def __init__(self, master):
+        self.selected = [] #the names of the chosen spectra, including any which the search is hiding
         super().__init__(master, "Grinding Curve", nameVar=tk.StringVar(), mineralVar=tk.StringVar())
-        self.spectra = []
 
     def makeWidgets(self):
         mineralLabel = tk.Label(self.widgetFrame, text="Mineral:")
@@ -1026,6 +4635,7 @@ class GrindingCurvePopup(ConditionalPopup):
         self.spectraListbox.grid(row=0, column=0, sticky='nsew')
         self.fillListbox()
         self.spectraListbox.bind('<<ListboxSelect>>', self.activateOK)
+        SpectrumSearchEntry(self.widgetFrame, self.master.controller, self.spectraListbox).grid(row=3, column=1, padx=10, sticky='w')
         
         self.makeAlertBox()
         super().makeWidgets()
@@ -1035,10 +4645,16 @@ class GrindingCurvePopup(ConditionalPopup):
         for spectrumName in self.master.controller.spectra.keys():
             self.spectraListbox.insert('end', spectrumName)
         
+    @property
+    def spectra(self):
+        return [self.master.controller.spectra[name] for name in self.selected]
+
     def activateOK(self, *args):
-        for i in self.spectraListbox.curselection():
-            self.spectra.append(self.master.controller.spectra[self.spectraListbox.get(i)])
-        if self.spectra:
+        listed = set(self.spectraListbox.get(0, 'end'))
+        chosen = [self.spectraListbox.get(i) for i in self.spectraListbox.curselection()]
+        self.selected = [name for name in self.selected if name not in listed] + chosen
+        self.okButton.configure(state='disabled')
+        if self.selected:
            super().activateOK() 
         
     def okPressed(self, *args):
@@ -1052,12 +4668,16 @@ class GrindingCurvePopup(ConditionalPopup):
             self.alertBox.configure(text=inst.message)
 
 #================================================================================================================================================================
-class ZeroSpectrumPopup(ConditionalPopup):
+class RangeEditPopup(ConditionalPopup):
+    #popup that enables zeroing, clipping, masking or cropping a spectrum between two wavenumbers
     def __init__(self, master):
-        super().__init__(master, "Zero Spectrum", spectrumVar=tk.StringVar(),
-                                                     newNameVar=tk.StringVar(),
-                                                     leftIndexVar=tk.StringVar(),
-                                                     rightIndexVar=tk.StringVar())
+        super().__init__(master, "Edit Spectrum Range", spectrumVar=tk.StringVar(),
+                                                          newNameVar=tk.StringVar(),
+                                                          opVar=tk.StringVar(),
+                                                          lowVar=tk.StringVar(),
+                                                          highVar=tk.StringVar())
+        self.yminVar = tk.StringVar()
+        self.ymaxVar = tk.StringVar()
 
     def makeWidgets(self):
         spectraLabel = tk.Label(self.widgetFrame, text="Spectrum:")
@@ -1070,31 +4690,131 @@ class ZeroSpectrumPopup(ConditionalPopup):
         nameEntry = ttk.Entry(self.widgetFrame, textvariable=self.newNameVar)
         nameEntry.grid(row=1, column=1, padx=10, pady=10, sticky='w')
 
-        indicesLabel = tk.Label(self.widgetFrame, text="Indices:")
-        indicesLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
-        
-        indicesFrame = tk.Frame(self.widgetFrame)
-        indicesFrame.grid(row=2, column=1, pady=10, sticky='w')
+        opLabel = tk.Label(self.widgetFrame, text="Operation:")
+        opLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+        opCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=['zero', 'clip', 'mask', 'crop'], textvariable=self.opVar)
+        opCombobox.grid(row=2, column=1, padx=10, pady=10, sticky='w')
 
-        leftIndexEntry = ttk.Entry(indicesFrame, textvariable=self.leftIndexVar)
-        leftIndexEntry.grid(row=0, column=0, padx=5, sticky='e')
-        
-        rightIndexEntry = ttk.Entry(indicesFrame, textvariable=self.rightIndexVar)
-        rightIndexEntry.grid(row=0, column=1, padx=5, sticky='w')
-        
+        rangeLabel = tk.Label(self.widgetFrame, text="Wavenumbers:")
+        rangeLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+
+        rangeFrame = tk.Frame(self.widgetFrame)
+        rangeFrame.grid(row=3, column=1, pady=10, sticky='w')
+
+        lowEntry = ttk.Entry(rangeFrame, textvariable=self.lowVar)
+        lowEntry.grid(row=0, column=0, padx=5, sticky='e')
+
+        highEntry = ttk.Entry(rangeFrame, textvariable=self.highVar)
+        highEntry.grid(row=0, column=1, padx=5, sticky='w')
+
+        clipLabel = tk.Label(self.widgetFrame, text="Clip limits (optional):")
+        clipLabel.grid(row=4, column=0, padx=10, pady=10, sticky='e')
+
+        clipFrame = tk.Frame(self.widgetFrame)
+        clipFrame.grid(row=4, column=1, pady=10, sticky='w')
+
+        yminEntry = ttk.Entry(clipFrame, textvariable=self.yminVar)
+        yminEntry.grid(row=0, column=0, padx=5, sticky='e')
+
+        ymaxEntry = ttk.Entry(clipFrame, textvariable=self.ymaxVar)
+        ymaxEntry.grid(row=0, column=1, padx=5, sticky='w')
+
+        self.makeAlertBox()
         super().makeWidgets()
 
     def activateOK(self, *args):
         self.okButton.configure(state='disabled')
-        if self.spectrumVar.get() and self.leftIndexVar.get().isnumeric() and self.rightIndexVar.get().isnumeric():
+        if self.spectrumVar.get() and self.opVar.get() and isNumber(self.lowVar.get()) and isNumber(self.highVar.get()):
             self.okButton.configure(state='normal')
 
     def okPressed(self, *args):
         if not self.newNameVar.get().strip():
             self.newNameVar.set(self.spectrumVar.get())
-        self.master.controller.operation(ParameterisedOperations, 'zero', self.newNameVar.get(), self.master.controller.spectra[self.spectrumVar.get()], leftidx=int(self.leftIndexVar.get()), rightidx=int(self.rightIndexVar.get()))
+        low, high = sorted((float(self.lowVar.get()), float(self.highVar.get())))
+        kwargs = {}
+        if self.opVar.get() == 'clip':
+            if not (isNumber(self.yminVar.get()) or isNumber(self.ymaxVar.get())):
+                self.alertBox.configure(text="Clipping needs at least one numeric limit.")
+                return
+            kwargs['ymin'] = float(self.yminVar.get()) if isNumber(self.yminVar.get()) else None
+            kwargs['ymax'] = float(self.ymaxVar.get()) if isNumber(self.ymaxVar.get()) else None
+        self.master.controller.operation(ParameterisedOperations, self.opVar.get(), self.newNameVar.get(), self.master.controller.spectra[self.spectrumVar.get()], low=low, high=high, **kwargs)
         super().okPressed()
 
+#================================================================================================================================================================
+class SmoothSpectraPopup(ConditionalPopup):
+    #popup that enables Savitzky-Golay smoothing or differentiation of several spectra at once
+    def __init__(self, master):
+        super().__init__(master, "Smooth/Derivative", suffixVar=tk.StringVar(),
+                                                        windowVar=tk.StringVar(),
+                                                        orderVar=tk.StringVar(),
+                                                        derivVar=tk.StringVar())
+
+    def makeWidgets(self):
+        suffixLabel = tk.Label(self.widgetFrame, text="Suffix for result names:")
+        suffixLabel.grid(row=0, column=0, padx=10, pady=10, sticky='e')
+        suffixEntry = ttk.Entry(self.widgetFrame, textvariable=self.suffixVar)
+        suffixEntry.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        suffixEntry.insert('end', '_sg')
+
+        windowLabel = tk.Label(self.widgetFrame, text="Window length:")
+        windowLabel.grid(row=1, column=0, padx=10, pady=10, sticky='e')
+        windowEntry = ttk.Entry(self.widgetFrame, textvariable=self.windowVar)
+        windowEntry.grid(row=1, column=1, padx=10, pady=10, sticky='w')
+        windowEntry.insert('end', '11')
+
+        orderLabel = tk.Label(self.widgetFrame, text="Polynomial order:")
+        orderLabel.grid(row=2, column=0, padx=10, pady=10, sticky='e')
+        orderEntry = ttk.Entry(self.widgetFrame, textvariable=self.orderVar)
+        orderEntry.grid(row=2, column=1, padx=10, pady=10, sticky='w')
+        orderEntry.insert('end', '3')
+
+        derivLabel = tk.Label(self.widgetFrame, text="Derivative:")
+        derivLabel.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+        derivCombobox = ttk.Combobox(self.widgetFrame, state='readonly', values=['0', '1', '2'], textvariable=self.derivVar)
+        derivCombobox.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+        derivCombobox.set('0')
+
+        spectraLabel = tk.Label(self.widgetFrame, text="Spectra:")
+        spectraLabel.grid(row=4, column=0, padx=10, pady=10, sticky='e')
+
+        listboxFrame = tk.Frame(self.widgetFrame)
+        listboxFrame.grid(row=4, column=1, padx=10, pady=10, sticky='w')
+
+        yscrollbar = ttk.Scrollbar(listboxFrame)
+        yscrollbar.grid(row=0, column=1, sticky='ns')
+
+        self.spectraListbox = tk.Listbox(listboxFrame, selectmode='multiple', yscrollcommand=yscrollbar.set, exportselection=False)
+        self.spectraListbox.grid(row=0, column=0, sticky='nsew')
+        yscrollbar.configure(command=self.spectraListbox.yview)
+        for spectrumName in self.master.controller.spectra.keys():
+            self.spectraListbox.insert('end', spectrumName)
+        self.spectraListbox.bind('<<ListboxSelect>>', self.activateOK)
+
+        self.makeAlertBox()
+        super().makeWidgets()
+
+    def activateOK(self, *args):
+        self.okButton.configure(state='disabled')
+        if self.spectraListbox.curselection() and self.windowVar.get().isnumeric() and self.orderVar.get().isnumeric():
+            self.okButton.configure(state='normal')
+
+    def okPressed(self, *args):
+        sources = [self.spectraListbox.get(i) for i in self.spectraListbox.curselection()]
+        try:
+            self.master.controller.batch_operation(SmoothingOperations, 'savgol_stack',
+                                                   [source + self.suffixVar.get() for source in sources],
+                                                   *[self.master.controller.spectra[source] for source in sources],
+                                                   window=int(self.windowVar.get()),
+                                                   order=int(self.orderVar.get()),
+                                                   deriv=int(self.derivVar.get()))
+            super().okPressed()
+
+        except BadAxisSymmetryException as inst:
+            self.alertBox.configure(text=inst.message)
+        except ValueError:
+            self.alertBox.configure(text="The window must be longer than the polynomial order\nand no longer than the spectra.")
+
 #==========================================================================================================================================================================================================================================================================
 class NewPlotPopup(ConditionalPopup):
     #popup that enables creation of a new plot
@@ -1273,8 +4993,7 @@ class ModifyPlotPopup(GraphPopup):
                 self.applyChanges()
                 
         finally:
-            if self.titleVar.get():
-                self.master.controller.plots[self.plotVar.get()].suptitle(self.titleVar.get())
+            if self.titleVar.get(): #renaming also changes the title
                 self.master.controller.rename_plot(self.plotVar.get(), self.titleVar.get())
 
             super().okPressed()
@@ -1293,13 +5012,22 @@ class ModifyPlotPopup(GraphPopup):
         if all(var.get().isnumeric() for var in (self.lylimVar, self.rylimVar)):
             axeskw['ylim'] = (float(self.lylimVar.get()), float(self.rylimVar.get()))
 
-        self.master.controller.plots[self.plotVar.get()].axes[int(self.axisVar.get())].set(**axeskw)
+        self.master.controller.set_properties(self.master.controller.plots[self.plotVar.get()].axes[int(self.axisVar.get())], **axeskw)
           
         self.master.controller.plots[self.plotVar.get()].axes[int(self.axisVar.get())].legend().set_draggable(True)
 
         if not self.legendVar.get() and self.master.controller.plots[self.plotVar.get()].axes[self.axisVar.get()]:
             self.master.controller.plots[self.plotVar.get()].axes[int(self.axisVar.get())].legend().remove()
 
+#==============================================================================================================================================
+def isNumber(text):
+    #check whether the text of an entry field can be converted to a float
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
 #==============================================================================================================================================
 class UnsupportedFileTypeException(Exception):
     def __init__(self, path):
@@ -1315,16 +5043,44 @@ class NoPathNameException(Exception):
         else:
             self.message = "File " + self.filename + " could not be found."
 
+#==============================================================================================================================================
+class MissingDependencyException(Exception):
+    def __init__(self, package, feature):
+        self.package = package #the name of the optional package which is not installed
+        self.message = feature + " requires the " + package + " package,\nwhich is not installed."
+
 #==============================================================================================================================================
 class BadAxisSymmetryException(Exception):
     def __init__(self):
         self.message = " The x-axes are incongruent."
 
+#==============================================================================================================================================
+class ServiceException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message #the error reported by the SpectrumServer
+
 #==============================================================================================================================================      
 '''--------------------------------------------------------------------------------------------------------------------------------------------'''
 def main():
-    App().mainloop()
+    parser = argparse.ArgumentParser(description=SOFTWARE_NAME + " " + VERSION_NUMBER)
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help="run without a window, serving loading & operations over TCP (see SpectrumServer)")
+    parser.add_argument('--workers', type=int, default=4, help="worker threads of the server")
+    parser.add_argument('--limit', type=int, default=8, help="requests the server runs at once")
+    parser.add_argument('--startup-time', action='store_true', help="print the time to the first window, then quit")
+    parser.add_argument('--precision', choices=Spectrum.PRECISIONS, default='float64', help="the precision spectra are stored at")
+    args = parser.parse_args()
+    Spectrum.dtype = np.dtype(args.precision)
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        SpectrumServer(host=host or '127.0.0.1', port=int(port), workers=args.workers, limit=args.limit).serve_forever()
+    else:
+        app = App()
+        if args.startup_time:
+            app.after_idle(lambda:(print("%.3f s to the first window" %app.startupTime), app.destroy()))
+        app.mainloop()
     
     
-main()
+if __name__ == "__main__":
+    main()
 '''--------------------------------------------------------------------------------------------------------------------------------------------'''
@@ -0,0 +1,404 @@
+#Benchmarks for Spectacular's loaders, spectral operations, exports & rendering
+#Run with:  python benchmarks.py [--quick] [--save] [--baseline FILE] [--tolerance 0.25] [--only NAME] [--precision]
+#Each case is timed on synthetic FTIR spectra (best of several runs), then run once more under tracemalloc for its peak
+#memory. Results are compared with the stored baseline, and any case which is slower or uses more memory than the
+#baseline by more than the tolerance is flagged as a regression, in which case the exit status is 1
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from Spectacular import (Spectrum, SpectrumOperations, ParameterisedOperations, Transformations, SpectrumExporter,
+                         BandIntegration, Chemometrics, HeadlessApp, SpectralMap, ImagePyramid, MissingDependencyException)
+
+POINTS = 3601 #4000 to 400 cm-1 at 1 cm-1 spacing, as written by most mid-IR instruments
+COUNTS = (1, 100, 1000, 10000)
+QUICK_COUNTS = (1, 100)
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks.json")
+
+#(centre cm-1, half width cm-1, height) of the bands of a calcite-bearing sample with some water & organics
+BANDS = [(3400, 200, 0.30), (2920, 30, 0.15), (2850, 25, 0.10), (1630, 40, 0.20), (1420, 60, 1.00),
+         (1030, 50, 0.50), (875, 8, 0.60), (713, 5, 0.25)]
+
+#==========================================================================================================================================================================================
+def synthetic_spectra(count, points=POINTS, seed=0):
+    #@return (x, Y): descending wavenumbers from 4000 to 400 cm-1, and a (count, points) array of absorbance spectra. Each
+    #spectrum has Lorentzian bands with jittered centres & heights, a sloping baseline and noise, and is strictly positive
+    rng = np.random.default_rng(seed)
+    x = np.linspace(4000, 400, points)
+    Y = np.empty((count, points))
+    Y[:] = 0.05 + rng.uniform(0, 0.05, (count, 1)) * (4000 - x)/3600
+    for centre, width, height in BANDS:
+        centres = centre + rng.normal(0, 2, (count, 1))
+        heights = height * rng.uniform(0.5, 1.5, (count, 1))
+        Y += heights / (1 + ((x - centres)/width)**2)
+    Y += np.abs(rng.normal(0, 0.002, Y.shape))
+    return x, Y
+
+def synthetic_dataframe(count, points=POINTS, seed=0):
+    #@return a DataFrame with an x column and one y column per spectrum, as loaded from a wide csv file
+    x, Y = synthetic_spectra(count, points, seed)
+    return pd.DataFrame(np.column_stack([x, Y.T]), columns=['x'] + ['y%i' %i for i in range(count)])
+
+def synthetic_spectrum_objects(count, points=POINTS, seed=0):
+    df = synthetic_dataframe(count, points, seed)
+    return [Spectrum(column, df, 'x', column) for column in df.columns[1:]]
+
+def write_fixed_width(df, filename, width=14):
+    with open(filename, 'w') as f:
+        f.write("".join(str(column).rjust(width) for column in df.columns) + "\n")
+        np.savetxt(f, df.to_numpy(), fmt="%" + str(width) + ".6f", delimiter="")
+
+#==========================================================================================================================================================================================
+#Each case is set up by a function of (count, directory) which prepares its data untimed, and returns the callable to be
+#timed and the number of bytes it processes (0 if throughput in MB/s is meaningless for it), or None if the case cannot
+#run here (e.g. an optional package is not installed). maxCount caps the number of spectra a case is run with, for cases
+#which would otherwise take minutes or gigabytes at 10,000 spectra
+CASES = {}
+
+def case(name, maxCount=max(COUNTS)):
+    def register(setup):
+        CASES[name] = (setup, maxCount)
+        return setup
+    return register
+
+@case('startup.import', maxCount=1)
+def startup_import(count, directory):
+    #a fresh interpreter importing the app, which is most of the time to the first window
+    command = [sys.executable, "-c", "import Spectacular"]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    return lambda:subprocess.run(command, cwd=cwd, check=True), 0
+
+@case('load.csv', maxCount=1000)
+def load_csv(count, directory):
+    filename = os.path.join(directory, "load%i.csv" %count)
+    synthetic_dataframe(count).to_csv(filename, index=False)
+    return lambda:HeadlessApp().load(filename, 'csv'), os.path.getsize(filename)
+
+@case('load.fwf', maxCount=1000)
+def load_fwf(count, directory):
+    filename = os.path.join(directory, "load%i.txt" %count)
+    write_fixed_width(synthetic_dataframe(count), filename)
+    return lambda:HeadlessApp().load(filename, 'fwf'), os.path.getsize(filename)
+
+@case('spectrum.construct')
+def construct(count, directory):
+    df = synthetic_dataframe(count)
+    columns = list(df.columns[1:])
+    return lambda:[Spectrum(column, df, 'x', column) for column in columns], df.memory_usage(deep=False).sum()
+
+@case('spectrum.from_arrays')
+def from_arrays(count, directory):
+    #the fast path used for the results of operations, which skips the NaN checks & copies of the Spectrum constructor
+    x, Y = synthetic_spectra(count)
+    return lambda:[Spectrum.from_arrays('y%i' %i, x, y) for i, y in enumerate(Y)], Y.nbytes + x.nbytes*count
+
+@case('spectrum.from_frame')
+def from_frame(count, directory):
+    results = [SpectrumOperations.to_transmittance(spectrum) for spectrum in synthetic_spectrum_objects(count)]
+    return lambda:[Spectrum.from_frame('y%i' %i, df) for i, df in enumerate(results)], 16*POINTS*count
+
+def binary_operation(operationName):
+    def setup(count, directory):
+        spectra = synthetic_spectrum_objects(count)
+        other = synthetic_spectrum_objects(1, seed=1)[0]
+        operation = getattr(SpectrumOperations, operationName)
+        return lambda:[operation(spectrum, other) for spectrum in spectra], 16*POINTS*count
+    return setup
+
+def unary_operation(operationName):
+    def setup(count, directory):
+        spectra = synthetic_spectrum_objects(count)
+        operation = getattr(SpectrumOperations, operationName)
+        return lambda:[operation(spectrum) for spectrum in spectra], 16*POINTS*count
+    return setup
+
+for operationName in ('add', 'subtract', 'multiply', 'divide'):
+    case('operations.' + operationName)(binary_operation(operationName))
+for operationName in ('to_transmittance', 'to_absorption'):
+    case('operations.' + operationName)(unary_operation(operationName))
+
+@case('operations.zero')
+def zero(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    return lambda:[ParameterisedOperations.zero(spectrum, 2300, 2400) for spectrum in spectra], 0
+
+@case('app.operation')
+def app_operation(count, directory):
+    #through the App, including operand checks & the Spectrum made from each result. The cache is cleared each run
+    app = HeadlessApp()
+    spectra = synthetic_spectrum_objects(count)
+    other = synthetic_spectrum_objects(1, seed=1)[0]
+    def run():
+        app.operationCache.clear()
+        for spectrum in spectra:
+            app.operation(SpectrumOperations, 'subtract', spectrum.name, spectrum, other)
+    return run, 16*POINTS*count
+
+@case('transformations.find_maximum', maxCount=1000)
+def find_maximum(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    return lambda:[Transformations.find_maximum(spectrum, 1420) for spectrum in spectra], 0
+
+@case('transformations.find_maximum_global')
+def find_maximum_global(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    return lambda:[Transformations.find_maximum(spectrum) for spectrum in spectra], 0
+
+@case('operations.grinding_curve', maxCount=1000)
+def grinding_curve(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    return lambda:ParameterisedOperations.grinding_curve(*spectra), 0
+
+@case('operations.band_ratios')
+def band_ratios(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    bands, ratios = BandIntegration.PRESETS['CALCITE']
+    return lambda:BandIntegration.band_ratios(spectra, bands, ratios, 'simpson'), 0
+
+@case('chemometrics.pca')
+def pca(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    return lambda:Chemometrics.pca(spectra, min(5, count)), 8*POINTS*count
+
+@case('chemometrics.pls')
+def pls(count, directory):
+    spectra = synthetic_spectrum_objects(count)
+    response = np.linspace(0, 1, count)
+    return lambda:Chemometrics.pls(spectra, response, min(5, count)), 8*POINTS*count
+
+@case('export.save_csv', maxCount=1000)
+def save_csv(count, directory):
+    #the Save button: one csv file per spectrum, written through the Spectrum's DataFrame
+    spectra = synthetic_spectrum_objects(count)
+    filenames = [os.path.join(directory, "save%i.csv" %i) for i in range(count)]
+    def run():
+        for spectrum, filename in zip(spectra, filenames):
+            spectrum.df.to_csv(filename)
+    return run, 16*POINTS*count
+
+def exportable(name, export):
+    #@return False if the export needs a package which is not installed, judged by exporting one spectrum
+    try:
+        export()
+        return True
+    except MissingDependencyException as inst:
+        print("%-38s skipped: %s" %(name, inst.message.replace("\n", " ")), flush=True)
+        return False
+
+def export_case(layout, fmt):
+    #all the spectra exported to one file, in a layout & format
+    def setup(count, directory):
+        spectra = synthetic_spectrum_objects(count)
+        filename = os.path.join(directory, "export_%s%i.%s" %(layout, count, fmt))
+        if not exportable('export.%s_%s' %(layout, fmt), lambda:SpectrumExporter.export(spectra[:1], filename, layout, fmt)):
+            return None
+        return lambda:SpectrumExporter.export(spectra, filename, layout, fmt), 16*POINTS*count
+    return setup
+
+def export_each_case(fmt):
+    #one file per spectrum, written by the exporter's pool of threads
+    def setup(count, directory):
+        spectra = synthetic_spectrum_objects(count)
+        subdirectory = os.path.join(directory, "each_%s%i" %(fmt, count))
+        os.makedirs(subdirectory, exist_ok=True)
+        if not exportable('export.each_' + fmt, lambda:SpectrumExporter.export_each(spectra[:1], subdirectory, fmt)):
+            return None
+        return lambda:SpectrumExporter.export_each(spectra, subdirectory, fmt), 16*POINTS*count
+    return setup
+
+for layout in SpectrumExporter.LAYOUTS:
+    for fmt in SpectrumExporter.FORMATS:
+        case('export.%s_%s' %(layout, fmt), maxCount=1000)(export_case(layout, fmt))
+for fmt in SpectrumExporter.FORMATS:
+    case('export.each_' + fmt, maxCount=1000)(export_each_case(fmt))
+
+def synthetic_map(count, directory):
+    #@return a float32 map of count pixels, as near square as count allows, written to the directory & opened memory mapped
+    x, Y = synthetic_spectra(count)
+    rows = max(1, int(np.sqrt(count)))
+    filename = os.path.join(directory, "map%i.npy" %count)
+    SpectralMap.save(filename, x, Y[:rows*(count//rows)].astype(np.float32).reshape(rows, count//rows, x.size))
+    return SpectralMap(filename)
+
+@case('map.band_image')
+def map_band_image(count, directory):
+    #the image of a band's area at every pixel, & its levels of detail, from the map on disk
+    spectralMap = synthetic_map(count, directory)
+    start, stop = ParameterisedOperations.wavenumber_range(spectralMap.axis, 1300, 1550)
+    def run():
+        ImagePyramid(spectralMap.band_image(1300, 1550, 'area', 'trapezoid'))
+    return run, spectralMap.cube[..., start:stop].nbytes #only the points in the band are read
+
+@case('map.pixel_spectrum')
+def map_pixel_spectrum(count, directory):
+    #clicking every pixel of the map in turn: each spectrum is read from the map on its own
+    spectralMap = synthetic_map(count, directory)
+    app = HeadlessApp()
+    rows, columns = spectralMap.shape
+    return lambda:[app.map_spectrum(spectralMap, row, column) for row in range(rows) for column in range(columns)], spectralMap.cube.nbytes
+
+@case('render.agg', maxCount=100)
+def render(count, directory):
+    #plot the spectra on one axis & draw the figure off screen, at the size the Graph Page uses
+    spectra = synthetic_spectrum_objects(count)
+    app = HeadlessApp()
+    def run():
+        fig = Figure(figsize=(8.5, 5.5), dpi=100)
+        axis = fig.add_subplot()
+        for spectrum in spectra:
+            app.graph(axis, spectrum)
+        FigureCanvasAgg(fig).draw()
+    return run, 0
+
+def at_precision(setup, precision):
+    #the case set up & run with the spectra's y data stored at another precision
+    def wrapped(count, directory):
+        with Spectrum.precision(precision):
+            run, nbytes = setup(count, directory)
+        def run_at():
+            with Spectrum.precision(precision):
+                run()
+        return run_at, nbytes*np.dtype(precision).itemsize//8
+    return wrapped
+
+for name in ('operations.subtract', 'operations.band_ratios', 'chemometrics.pca', 'chemometrics.pls'):
+    case(name + '.float32', CASES[name][1])(at_precision(CASES[name][0], 'float32'))
+
+#==========================================================================================================================================================================================
+#Accuracy against speed of float32 storage: each reduction of a stack of spectra is run with the spectra stored as
+#float64 & as float32, and the largest error of the float32 result is reported relative to the largest float64 value
+PRECISION_REDUCTIONS = {
+    'operations.subtract':lambda spectra:np.vstack([SpectrumOperations.subtract(spectrum, spectra[0]).iloc[:, 1] for spectrum in spectra]),
+    'operations.to_absorption':lambda spectra:np.vstack([SpectrumOperations.to_absorption(spectrum).iloc[:, 1] for spectrum in spectra]),
+    'operations.band_ratios':lambda spectra:BandIntegration.band_ratios(spectra, *BandIntegration.PRESETS['CALCITE'], 'simpson').to_numpy(),
+    'chemometrics.pca':lambda spectra:Chemometrics.pca(spectra, min(3, len(spectra)))[0],
+    'chemometrics.pls':lambda spectra:Chemometrics.pls(spectra, np.linspace(0, 1, len(spectra)), min(3, len(spectra)))[4]}
+
+def precision_report(counts, only=None, repeat=3):
+    #@return {reduction name: {count: {'float64', 'float32' (seconds), 'speedup', 'relativeError'}}}
+    results = {}
+    for name, reduction in PRECISION_REDUCTIONS.items():
+        if only and only not in name:
+            continue
+        for count in counts:
+            if count > 1000:
+                continue
+            outputs, seconds = {}, {}
+            for precision in Spectrum.PRECISIONS:
+                with Spectrum.precision(precision):
+                    spectra = synthetic_spectrum_objects(count)
+                    outputs[precision] = np.asarray(reduction(spectra), dtype=float)
+                    seconds[precision] = measure(lambda:reduction(spectra), repeat)
+            error, scale = np.nanmax(np.abs(outputs['float32'] - outputs['float64'])), np.nanmax(np.abs(outputs['float64']))
+            error = error/scale if scale else error #e.g. the scores of a single spectrum are all 0
+            results.setdefault(name, {})[str(count)] = {'float64':seconds['float64'], 'float32':seconds['float32'],
+                                                        'speedup':seconds['float64']/seconds['float32'], 'relativeError':error}
+            print("%-38s %6i spectra %10.4f s float64 %10.4f s float32 %6.2fx %12.2e relative error" %(name, count, seconds['float64'],
+                  seconds['float32'], seconds['float64']/seconds['float32'], error), flush=True)
+    return results
+
+#==========================================================================================================================================================================================
+def measure(run, repeat):
+    #@return the best of the timed runs, in seconds. Slow cases are only run once
+    times = []
+    while len(times) < repeat:
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+        if times[0] > 1:
+            break
+    return min(times)
+
+def peak_memory(run):
+    #@return the peak memory allocated while running, in bytes
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmarks(counts, only=None, repeat=3):
+    #@return {case name: {count: {'seconds', 'spectraPerSecond', 'MBps', 'peakBytes'}}}
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (setup, maxCount) in CASES.items():
+            if only and only not in name:
+                continue
+            for count in counts:
+                if count > maxCount:
+                    continue
+                prepared = setup(count, directory)
+                if prepared is None:
+                    break
+                run, nbytes = prepared
+                seconds = measure(run, repeat)
+                peakBytes = peak_memory(run)
+                results.setdefault(name, {})[str(count)] = {'seconds':seconds, 'spectraPerSecond':count/seconds,
+                                                            'MBps':nbytes/1e6/seconds if nbytes else None, 'peakBytes':peakBytes}
+                print("%-38s %6i spectra %10.4f s %12.1f spectra/s %10s MB/s %10.1f MB peak" %(name, count, seconds, count/seconds,
+                      "%.1f" %(nbytes/1e6/seconds) if nbytes else "-", peakBytes/1e6), flush=True)
+    return results
+
+def regressions(results, baseline, tolerance):
+    #@return descriptions of the cases which are slower, or use more memory, than the baseline by more than the tolerance
+    found = []
+    for name, byCount in results.items():
+        for count, result in byCount.items():
+            reference = baseline.get(name, {}).get(count)
+            if reference is None:
+                continue
+            for key, unit in (('seconds', "s"), ('peakBytes', "bytes")):
+                if result[key] > reference[key]*(1 + tolerance):
+                    found.append("%s (%s spectra): %s %.4g %s, baseline %.4g %s" %(name, count, key, result[key], unit, reference[key], unit))
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Spectacular's loaders, operations, exports & rendering")
+    parser.add_argument('--quick', action='store_true', help="only run with %s spectra" %(QUICK_COUNTS,))
+    parser.add_argument('--only', help="only run the cases whose names contain this")
+    parser.add_argument('--repeat', type=int, default=3, help="number of timed runs per case (the best is kept)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="the stored baseline results")
+    parser.add_argument('--save', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="fractional slowdown or memory growth allowed before flagging")
+    parser.add_argument('--precision', action='store_true', help="report the speed & accuracy of float32 storage against float64, then quit")
+    args = parser.parse_args(argv)
+
+    if args.precision:
+        precision_report(QUICK_COUNTS if args.quick else COUNTS, args.only, args.repeat)
+        return 0
+    results = run_benchmarks(QUICK_COUNTS if args.quick else COUNTS, args.only, args.repeat)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for name, byCount in results.items():
+            baseline.setdefault(name, {}).update(byCount)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print("Baseline saved to " + args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline at " + args.baseline + ", run with --save to store one")
+        return 0
+    with open(args.baseline) as f:
+        found = regressions(results, json.load(f), args.tolerance)
+    for regression in found:
+        print("REGRESSION " + regression)
+    print("%i regression(s) against %s" %(len(found), args.baseline))
+    return 1 if found else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
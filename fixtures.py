@@ -0,0 +1,223 @@
+#Synthetic instrument files for checking Spectacular's vendor readers
+#Run with:  python fixtures.py [--keep DIRECTORY]
+#Small Bruker OPUS, Thermo Galactic SPC & JCAMP-DX files are written with known x & y values, in each layout the readers
+#support, and read back with VendorReaders. Any file whose values do not come back as written is reported, as is one
+#which, cut short, is not rejected as unsupported; in either case the exit status is 1. With --keep the files are left in
+#the directory, for use as samples
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+from Spectacular import HeadlessApp, UnsupportedFileTypeException, VendorReaders
+
+X = np.linspace(4000, 3950, 26) #descending wavenumbers, as instruments write them
+Y = np.array([120, 135, 135, 135, 160, 210, 290, 410, 570, 760, 940, 1000, 940, 760, 570, 410, 290, 210, 160, 135, 120, 120,
+              120, 90, 40, -35]) #a band on a flat baseline, with repeats & a negative tail for the compressed JCAMP forms
+Y2 = Y[::-1]*2 #a second channel or subfile
+
+#==========================================================================================================================================================================================
+#Bruker OPUS: a header pointing to a directory of blocks. Each spectrum has a data block of float32 y values & a data
+#status block of parameters (the number of points, the first & last x values & a y scaling factor). Directory entries
+#give a block's data type & channel type: the absorbance (AB) is data type 15, the sample's single channel spectra 7 &
+#the reference's 11, & each status block's data type is its data block's plus 16. These are written out here as numbers,
+#as instruments write them, rather than taken from the reader's own constants
+OPUS_AB, OPUS_SAMPLE, OPUS_REFERENCE, OPUS_STATUS_OFFSET = 15, 7, 11, 16
+OPUS_SPECTRUM, OPUS_INTERFEROGRAM = 4, 8 #channel types
+def opus_parameter(name, value):
+    if isinstance(value, int):
+        valueType, data = 0, struct.pack('<i', value)
+    else:
+        valueType, data = 1, struct.pack('<d', value)
+    return name.encode('ascii') + b'\x00' + struct.pack('<HH', valueType, len(data)//2) + data
+
+def write_opus(filename, spectra):
+    #@param spectra {(data type, channel type): (x, y, scaling factor)}
+    blocks = []
+    for (dataType, channel), (x, y, factor) in spectra.items():
+        status = b''.join([opus_parameter('NPT', len(y)), opus_parameter('FXV', float(x[0])), opus_parameter('LXV', float(x[-1])),
+                           opus_parameter('CSF', float(factor))]) + b'END\x00' + b'\x00'*4
+        blocks.append((dataType + OPUS_STATUS_OFFSET, channel, status))
+        blocks.append((dataType, channel, (np.asarray(y)/factor).astype('<f4').tobytes()))
+    header = VendorReaders.OPUS_MAGIC + struct.pack('<d', 920622.0) + struct.pack('<iii', 24, len(blocks), len(blocks))
+    offset = len(header) + 12*len(blocks)
+    directory, body = b'', b''
+    for blockType, channel, data in blocks:
+        directory += struct.pack('<BBBBii', blockType, channel, 0, 0, len(data)//4, offset + len(body))
+        body += data
+    with open(filename, 'wb') as f:
+        f.write(header + directory + body)
+
+#==========================================================================================================================================================================================
+#Thermo Galactic SPC (new format, little endian): a 512 byte header, an optional shared x array, then a subheader & the
+#y values (float32, or 16 or 32 bit fixed point with a power of 2 exponent) of each subfile
+SPC_FIELDS = ('flags', 'version', 'experiment', 'exponent', 'npts', 'first', 'last', 'nsub')
+
+def spc_header(**fields):
+    values = [0, 0, 0, 0, 0, 0.0, 0.0] + [0]*5 + [0, b'', b'', 0, b'', b'', b'', 0, 0, 0, 0, 0, 0.0, b'', 0.0, 0, 0.0, 0, b'']
+    for name, value in fields.items():
+        values[SPC_FIELDS.index(name)] = value
+    return VendorReaders.SPC_HEADER.pack(*values)
+
+def spc_subheader(exponent, npts=0):
+    return VendorReaders.SPC_SUBHEADER.pack(0, exponent, 0, 0.0, 0.0, 0.0, npts, 0, 0.0, b'')
+
+def spc_y(y, exponent, bits=32):
+    #@return the y values as stored: float32 if the exponent is -128, else fixed point with y = value*2**(exponent - bits)
+    if exponent == -128:
+        return np.asarray(y, '<f4').tobytes()
+    return np.round(np.asarray(y)*2.0**(bits - exponent)).astype('<i%i' %(bits//8)).tobytes()
+
+def write_spc(filename, layout):
+    #@param layout 'even' (evenly spaced x, float32 y), 'xvals' (an x array), 'fixed32', 'fixed16', or 'xyxy' (two subfiles, each with its own x)
+    version = VendorReaders.SPC_NEW_LSB
+    if layout == 'even':
+        data = spc_header(version=version, exponent=-128, npts=len(X), first=X[0], last=X[-1], nsub=1) + spc_subheader(-128) + spc_y(Y, -128)
+    elif layout == 'xvals':
+        data = (spc_header(flags=VendorReaders.SPC_TXVALS, version=version, exponent=-128, npts=len(X), nsub=1) + np.asarray(X, '<f4').tobytes()
+                + spc_subheader(-128) + spc_y(Y, -128))
+    elif layout == 'fixed32':
+        data = spc_header(version=version, exponent=12, npts=len(X), first=X[0], last=X[-1], nsub=1) + spc_subheader(12) + spc_y(Y, 12)
+    elif layout == 'fixed16':
+        data = (spc_header(flags=VendorReaders.SPC_TSPREC, version=version, exponent=12, npts=len(X), first=X[0], last=X[-1], nsub=1)
+                + spc_subheader(12) + spc_y(Y, 12, 16))
+    else:
+        flags = VendorReaders.SPC_TMULTI | VendorReaders.SPC_TXYXYS | VendorReaders.SPC_TXVALS
+        data = spc_header(flags=flags, version=version, exponent=-128, nsub=2)
+        for x, y in ((X, Y), (X[:10], Y2[:10])):
+            data += spc_subheader(-128, len(x)) + np.asarray(x, '<f4').tobytes() + spc_y(y, -128)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+#==========================================================================================================================================================================================
+#JCAMP-DX: labelled text. (X++(Y..Y)) tables are written in AFFN (plain numbers), SQZ (the sign & first digit of each
+#number as a letter), or DIFDUP (differences from the previous value, with repeats counted), 10 values a line
+def jcamp_sqz(value):
+    digits = str(abs(int(value)))
+    return ('@ABCDEFGHI'[int(digits[0])] if value >= 0 else 'abcdefghi'[int(digits[0]) - 1]) + digits[1:]
+
+def jcamp_dif(delta):
+    digits = str(abs(int(delta)))
+    return ('%JKLMNOPQR'[int(digits[0])] if delta >= 0 else 'jklmnopqr'[int(digits[0]) - 1]) + digits[1:]
+
+def jcamp_dup(count):
+    digits = str(count)
+    return 'STUVWXYZs'[int(digits[0]) - 1] + digits[1:]
+
+def jcamp_line(x, values, form):
+    if form == 'AFFN':
+        return "%g %s" %(x, " ".join("%i" %value for value in values))
+    if form == 'SQZ':
+        return "%g%s" %(x, "".join(jcamp_sqz(value) for value in values))
+    tokens = [jcamp_sqz(values[0])] #DIFDUP: the first value, then differences, with runs of the same difference counted
+    deltas = np.diff(values)
+    i = 0
+    while i < len(deltas):
+        run = 1
+        while i + run < len(deltas) and deltas[i + run] == deltas[i]:
+            run += 1
+        tokens.append(jcamp_dif(deltas[i]) + (jcamp_dup(run) if run > 1 else ""))
+        i += run
+    return "%g%s" %(x, "".join(tokens))
+
+def write_jcamp(filename, form, yfactor=0.001):
+    #@param form 'AFFN', 'SQZ', 'DIF', or 'XY' for an (XY..XY) table of pairs
+    lines = ["##TITLE= %s fixture" %form, "##JCAMP-DX= 4.24", "##XUNITS= 1/CM", "##YUNITS= ABSORBANCE", "##XFACTOR= 1",
+             "##YFACTOR= %g" %yfactor, "##FIRSTX= %g" %X[0], "##LASTX= %g" %X[-1], "##NPOINTS= %i" %len(X)]
+    if form == 'XY':
+        lines.append("##XYPOINTS= (XY..XY)")
+        lines += ["%g, %i" %(x, y) for x, y in zip(X, Y)]
+    else:
+        lines.append("##XYDATA= (X++(Y..Y))")
+        start = 0
+        while start < len(Y):
+            if form == 'DIF' and start: #a DIF line begins with the last value of the line before, as a check
+                start -= 1
+            lines.append(jcamp_line(X[start], Y[start:start + 10], form))
+            start += 10
+    lines.append("##END=")
+    with open(filename, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+#==========================================================================================================================================================================================
+def fixtures():
+    #@return {file name: (writer, {column: expected values})}
+    float32 = lambda values:np.asarray(values, np.float32).astype(float)
+    yfactor = 0.001
+    cases = {"fixture.0":(lambda filename:write_opus(filename, {(OPUS_AB, 0):(X, Y, 0.5), (OPUS_SAMPLE, OPUS_SPECTRUM):(X, Y2, 1.0)}),
+                          {'AB x':X, 'AB':float32(Y/0.5)*0.5, 'ScSm x':X, 'ScSm':float32(Y2)}),
+             #single channel spectra only, as saved before the absorbance is worked out
+             "fixture.1":(lambda filename:write_opus(filename, {(OPUS_SAMPLE, OPUS_SPECTRUM):(X, Y, 1.0), (OPUS_REFERENCE, OPUS_SPECTRUM):(X, Y2, 1.0),
+                                                                (OPUS_SAMPLE, OPUS_INTERFEROGRAM):(X[:10], Y[:10], 1.0)}),
+                          {'ScSm':float32(Y), 'ScRf x':X, 'ScRf':float32(Y2), 'IgSm x':X[:10], 'IgSm':float32(Y[:10])})}
+    for layout in ('even', 'xvals', 'fixed32', 'fixed16'):
+        cases["fixture_%s.spc" %layout] = (lambda filename, layout=layout:write_spc(filename, layout),
+                                           {'x':float32(X) if layout == 'xvals' else X, 'y':Y})
+    cases["fixture_xyxy.spc"] = (lambda filename:write_spc(filename, 'xyxy'), {'x0':float32(X), 'y0':Y, 'x1':float32(X[:10]), 'y1':Y2[:10]})
+    for form in ('AFFN', 'SQZ', 'DIF', 'XY'):
+        cases["fixture_%s.jdx" %form.lower()] = (lambda filename, form=form:write_jcamp(filename, form, yfactor),
+                                                 {'1/CM':X, 'ABSORBANCE':Y*yfactor})
+    return cases
+
+READERS = {'opus':VendorReaders.read_opus, 'spc':VendorReaders.read_spc, 'jdx':VendorReaders.read_jcamp}
+TRUNCATIONS = (0.6, 0.9) #the fractions of each file kept, to check that files cut short are rejected
+
+def truncated(filename, fraction):
+    #@return a description of the failure, or None if App.read rejects the file cut short as unsupported
+    with open(filename, 'rb') as f:
+        data = f.read()
+    cut = "%s.cut%i" %(filename, round(fraction*100))
+    with open(cut, 'wb') as f:
+        f.write(data[:int(len(data)*fraction)])
+    try:
+        HeadlessApp().read(cut, VendorReaders.filetype(filename))
+    except UnsupportedFileTypeException:
+        return None
+    except Exception as inst:
+        return "%s cut to %i%%: %s %s" %(os.path.basename(filename), round(fraction*100), type(inst).__name__, inst)
+    finally:
+        os.remove(cut)
+    return "%s cut to %i%%: read without an error" %(os.path.basename(filename), round(fraction*100))
+
+def check(directory):
+    #@return descriptions of the columns which were not read back as written
+    failures = []
+    for name, (write, expected) in fixtures().items():
+        filename = os.path.join(directory, name)
+        write(filename)
+        found = len(failures)
+        try:
+            df = READERS[VendorReaders.filetype(filename)](filename)
+        except Exception as inst:
+            failures.append("%s: %s %s" %(name, type(inst).__name__, inst))
+            continue
+        for column, values in expected.items():
+            if column not in df.columns:
+                failures.append("%s: no column %r, read %s" %(name, column, list(df.columns)))
+            elif not np.allclose(df[column].dropna().to_numpy(dtype=float), values, rtol=1e-12, atol=1e-12):
+                failures.append("%s: column %r read as %s, written as %s" %(name, column, df[column].to_numpy(), values))
+        failures += [failure for failure in (truncated(filename, fraction) for fraction in TRUNCATIONS) if failure is not None]
+        print("%-24s %s" %(name, "ok" if len(failures) == found else "FAILED"), flush=True)
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic instrument files & check that Spectacular's readers read them back")
+    parser.add_argument('--keep', metavar='DIRECTORY', help="write the files here & keep them")
+    args = parser.parse_args(argv)
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        failures = check(args.keep)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            failures = check(directory)
+    for failure in failures:
+        print("FAILURE " + failure)
+    print("%i failure(s)" %len(failures))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())